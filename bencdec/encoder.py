@@ -23,24 +23,24 @@ def _encode_list(element: list) -> bytes:
     """
     :return: bencoded bytes representing the list element
     """
-    result = LIST_START.to_bytes()
+    result = [LIST_START.to_bytes()]
     for item in element:
-        result += _encode_element(item)
-    result += ELEMENT_END.to_bytes()
-    return result
+        result.append(_encode_element(item))
+    result.append(ELEMENT_END.to_bytes())
+    return b''.join(result)
 
 
 def _encode_dict(element: dict[str, object]) -> bytes:
     """
     :return: bencoded bytes representing the dict element
     """
-    result = DICT_START.to_bytes()
+    result = [DICT_START.to_bytes()]
     for key in element:
         value = element[key]
-        result += _encode_element(key)
-        result += _encode_element(value)
-    result += ELEMENT_END.to_bytes()
-    return result
+        result.append(_encode_element(key))
+        result.append(_encode_element(value))
+    result.append(ELEMENT_END.to_bytes())
+    return b''.join(result)
 
 
 def _encode_int(element: int) -> bytes:
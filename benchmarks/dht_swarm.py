@@ -0,0 +1,100 @@
+"""
+Runs a swarm of DhtNodes on loopback: peers that some nodes announce must be found by the lookups of other nodes,
+a node that restarts from its saved routing table must bootstrap without the bootstrap node
+
+Run from the repository root:
+    python -m benchmarks.dht_swarm [node count] [announcing node count]
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+import torrent  # torrent must be imported first (circular imports)
+from dht import DhtNode
+from peer.peer_info import PeerInfo
+
+
+async def start_swarm(node_count: int) -> list[DhtNode]:
+    """
+    The first node is the bootstrap node of the others
+    """
+    bootstrap = DhtNode('127.0.0.1', 0, state_path=None, bootstrap_nodes=())
+    await bootstrap.start()
+    address = bootstrap.transport.get_extra_info('sockname')[:2]
+    nodes = [bootstrap]
+    for _ in range(node_count - 1):
+        node = DhtNode('127.0.0.1', 0, state_path=None, bootstrap_nodes=[address])
+        await node.start()
+        nodes.append(node)
+    await asyncio.gather(*(node.bootstrapped.wait() for node in nodes[1:]))
+    return nodes
+
+
+async def check_lookups(nodes: list[DhtNode], announcer_count: int) -> float:
+    """
+    Announces a torrent from announcer_count nodes, every other node must find every announced peer.
+    Returns the mean lookup time
+    """
+    info_hash = os.urandom(20)
+    announcers = random.sample(nodes[1:], announcer_count)
+    expected = set()
+    for i, node in enumerate(announcers):
+        await node.get_peers(info_hash, 7000 + i)
+        expected.add(PeerInfo('127.0.0.1', 7000 + i))
+    others = [node for node in nodes[1:] if node not in announcers]
+    start = time.perf_counter()
+    found = await asyncio.gather(*(node.get_peers(info_hash) for node in others))
+    elapsed = (time.perf_counter() - start) / len(others)
+    missing = sum(1 for peers in found if not expected <= peers)
+    assert not missing, f'{missing} / {len(others)} lookups did not find every announced peer'
+    return elapsed
+
+
+async def check_restart(nodes: list[DhtNode], directory: str) -> int:
+    """
+    Saves the routing table of a node, a node that loads it bootstraps from its nodes (the bootstrap node is unknown).
+    Returns the number of nodes that responded to the restarted node
+    """
+    state_path = os.path.join(directory, 'dht.state')
+    nodes[-1].routing_table.save(state_path)
+    restarted = DhtNode('127.0.0.1', 0, state_path=state_path, bootstrap_nodes=())
+    await restarted.start()
+    try:
+        await asyncio.wait_for(restarted.bootstrapped.wait(), 10)
+        # loaded nodes are in the table before they respond
+        responded = sum(1 for node in restarted.routing_table if node.last_response)
+        assert responded, 'the restarted node did not bootstrap from its saved routing table'
+        return responded
+    finally:
+        restarted.close()
+
+
+async def run(node_count: int, announcer_count: int):
+    start = time.perf_counter()
+    nodes = await start_swarm(node_count)
+    try:
+        print(f'{node_count} nodes bootstrapped in {time.perf_counter() - start:.2f} s | '
+              f'routing table sizes {min(len(node.routing_table) for node in nodes)} - '
+              f'{max(len(node.routing_table) for node in nodes)}')
+        elapsed = await check_lookups(nodes, announcer_count)
+        print(f'{announcer_count} announced peers found by {node_count - announcer_count - 1} lookups | '
+              f'{elapsed * 1000:.1f} ms per lookup')
+        with tempfile.TemporaryDirectory() as directory:
+            size = await check_restart(nodes, directory)
+        print(f'restarted node bootstrapped from its saved routing table | {size} nodes responded')
+    finally:
+        for node in nodes:
+            node.close()
+
+
+def main():
+    node_count = int(sys.argv[1]) if len(sys.argv) > 1 else 31
+    announcer_count = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    asyncio.run(run(node_count, announcer_count))
+
+
+if __name__ == '__main__':
+    main()
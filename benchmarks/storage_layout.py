@@ -0,0 +1,67 @@
+"""
+Compares the old linear file lookup of FileHandler with StorageLayout for torrents with many small files
+
+Run from the repository root:
+    python -m benchmarks.storage_layout [file count]
+"""
+import random
+import sys
+import time
+
+from torrent.metadata import Metadata  # torrent must be imported first (circular imports)
+from torrent.constants import *
+from file_handling.file_info import FileInfo
+from file_handling.storage_layout import StorageLayout
+
+
+def build_metadata(file_count: int, piece_size: int = 2 ** 18) -> Metadata:
+    sizes = [random.randint(1, 2 ** 16) for _ in range(file_count)]
+    piece_count = (sum(sizes) + piece_size - 1) // piece_size
+    return Metadata({
+        FILES: [{LENGTH: size, PATH: [f'file_{i}'.encode()]} for i, size in enumerate(sizes)],
+        NAME: b'bench',
+        PIECE_LENGTH: piece_size,
+        PIECES: bytes(20 * piece_count)
+    })
+
+
+def linear_lookup(files_info: tuple[FileInfo, ...], byte_in_torrent: int) -> tuple[int | None, int | None]:
+    """
+    The previous implementation of FileHandler._byte_in_torrent_to_file_and_offset
+    """
+    for i, file in enumerate(files_info):
+        if file.start_byte_in_torrent <= byte_in_torrent <= file.end_byte_in_torrent:
+            return i, byte_in_torrent - file.start_byte_in_torrent
+    return None, None
+
+
+def main():
+    file_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    random.seed(0)
+    metadata = build_metadata(file_count)
+
+    start = time.perf_counter()
+    layout = StorageLayout(metadata)
+    print(f'{file_count} files | {metadata.piece_count} pieces | '
+          f'layout built in {time.perf_counter() - start:.3f} s')
+
+    block_size = 2 ** 14
+    blocks = [random.randrange(metadata.torrent_size // block_size) * block_size for _ in range(2000)]
+
+    start = time.perf_counter()
+    for block in blocks[:200]:
+        linear_lookup(metadata.files_info, block)
+    linear_time = (time.perf_counter() - start) / 200
+
+    start = time.perf_counter()
+    for block in blocks:
+        layout.spans(block, block_size)
+    layout_time = (time.perf_counter() - start) / len(blocks)
+
+    print(f'linear lookup:  {linear_time * 1e6:10.1f} us / block')
+    print(f'StorageLayout:  {layout_time * 1e6:10.1f} us / block (spans included)')
+    print(f'speedup: {linear_time / layout_time:.0f}x')
+
+
+if __name__ == '__main__':
+    main()
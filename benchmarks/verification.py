@@ -0,0 +1,123 @@
+"""
+Compares the old serial piece verification with PieceVerifier
+
+Run from the repository root:
+    python -m benchmarks.verification [size in MiB] [piece size in KiB]
+"""
+import asyncio
+import hashlib
+import os
+import sys
+import tempfile
+import time
+
+from torrent.metadata import Metadata  # torrent must be imported first (circular imports)
+from torrent.constants import *
+from file_handling.piece_verifier import PieceVerifier
+from misc import utils
+
+
+def build_torrent(total_size: int, piece_size: int, file_count: int = 8) -> Metadata:
+    """
+    Writes file_count files of random data under ./bench and returns the Metadata that describes them
+    """
+    os.makedirs('./bench', exist_ok=True)
+    files = []
+    pieces = bytearray()
+    file_size = total_size // file_count
+    data_left_in_piece = bytearray()
+    for i in range(file_count):
+        data = os.urandom(file_size)
+        with open(f'./bench/file_{i}', 'wb') as f:
+            f.write(data)
+        files.append({LENGTH: file_size, PATH: [f'file_{i}'.encode()]})
+        data_left_in_piece += data
+        while len(data_left_in_piece) >= piece_size:
+            pieces += hashlib.sha1(data_left_in_piece[:piece_size]).digest()
+            del data_left_in_piece[:piece_size]
+    if data_left_in_piece:
+        pieces += hashlib.sha1(data_left_in_piece).digest()
+    return Metadata({FILES: files, NAME: b'bench', PIECE_LENGTH: piece_size, PIECES: bytes(pieces)})
+
+
+def serial_verify(metadata: Metadata) -> list[int]:
+    """
+    The previous implementation of FileHandler._calculate_pending_and_completed_pieces
+    """
+    files = [open(file.path, 'rb') for file in metadata.files_info]
+    completed_pieces: list[int] = []
+    try:
+        file_index = 0
+        for piece_info in metadata.pieces_info:
+            bytes_left = piece_info.length
+            data = b''
+            while bytes_left:
+                tmp_data = files[file_index].read(bytes_left)
+                data += tmp_data
+                bytes_read = len(tmp_data)
+                if bytes_read != bytes_left:
+                    file_index += 1
+                bytes_left -= bytes_read
+            if utils.calculate_hash(data) == piece_info.hash_value:
+                completed_pieces.append(piece_info.index)
+    except (Exception,):
+        pass
+    for f in files:
+        f.close()
+    return completed_pieces
+
+
+async def measure(coro_func, *args) -> tuple[object, float, float]:
+    """
+    Runs coro_func(*args) while a ticker measures the longest event loop stall
+    Returns (result, elapsed seconds, longest stall in seconds)
+    """
+    longest_stall = 0.0
+    done = asyncio.Event()
+
+    async def ticker():
+        nonlocal longest_stall
+        last = time.perf_counter()
+        while not done.is_set():
+            await asyncio.sleep(0.01)
+            now = time.perf_counter()
+            longest_stall = max(longest_stall, now - last - 0.01)
+            last = now
+
+    ticker_task = asyncio.create_task(ticker())
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    result = await coro_func(*args)
+    elapsed = time.perf_counter() - start
+    done.set()
+    await ticker_task
+    return result, elapsed, longest_stall
+
+
+async def serial_verify_on_loop(metadata: Metadata) -> list[int]:
+    return serial_verify(metadata)
+
+
+async def parallel_verify(metadata: Metadata) -> list[int]:
+    return await PieceVerifier(metadata).verify()
+
+
+def main():
+    size = int(sys.argv[1]) * 2 ** 20 if len(sys.argv) > 1 else 2 ** 29
+    piece_size = int(sys.argv[2]) * 2 ** 10 if len(sys.argv) > 2 else 2 ** 18
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        metadata = build_torrent(size, piece_size)
+        print(f'{size / 2 ** 20:.0f} MiB | {metadata.piece_count} pieces of {piece_size // 2 ** 10} KiB')
+
+        results = []
+        for name, coro_func in (('serial', serial_verify_on_loop), ('verifier', parallel_verify)):
+            completed, elapsed, stall = asyncio.run(measure(coro_func, metadata))
+            print(f'{name:<8} | {elapsed:.3f} s | {size / 2 ** 20 / elapsed:.0f} MiB/s | '
+                  f'longest loop stall {stall * 1000:.1f} ms | {len(completed)} ok')
+            results.append(completed)
+        assert results[0] == results[1]
+
+
+if __name__ == '__main__':
+    main()
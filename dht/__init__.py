@@ -0,0 +1 @@
+from .dht_node import DhtNode
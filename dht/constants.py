@@ -0,0 +1,21 @@
+T = b't'
+Y = b'y'
+Q = b'q'
+A = b'a'
+R = b'r'
+E = b'e'
+QUERY = b'q'
+RESPONSE = b'r'
+ERROR = b'e'
+PING = b'ping'
+FIND_NODE = b'find_node'
+GET_PEERS = b'get_peers'
+ANNOUNCE_PEER = b'announce_peer'
+ID = b'id'
+TARGET = b'target'
+INFO_HASH = b'info_hash'
+NODES = b'nodes'
+VALUES = b'values'
+TOKEN = b'token'
+PORT = b'port'
+IMPLIED_PORT = b'implied_port'
@@ -0,0 +1,365 @@
+import asyncio
+import heapq
+import os
+import random
+import socket
+import time
+from asyncio import DatagramTransport, Future, Task
+from typing import Iterable
+
+import bencdec
+from dht.constants import *
+from dht.routing_table import Node, RoutingTable, decode_nodes, decode_peers, distance, encode_nodes, encode_peer
+from misc import utils
+from peer.peer_info import PeerInfo
+
+
+class DhtNode(asyncio.DatagramProtocol):
+    """
+    A Kademlia DHT node (BEP 5) on a UDP socket shared by the torrents of a session, finds peers without trackers
+
+    Lookups query the __ALPHA__ closest nodes of the target in parallel until the k closest nodes that did not fail
+    were all queried. get_peers returns the peers that the nodes know and announces us to the closest nodes
+    with the tokens they gave. Queries of other nodes are answered too: tokens are a hash of the ip and a secret
+    that changes every __TOKEN_ROTATION__ seconds (tokens of the previous secret are still valid), announced peers
+    are kept for __PEER_TTL__ seconds.
+    The routing table is saved to state_path, a restart bootstraps from the saved nodes
+    and only asks the bootstrap nodes if none of them responds
+    """
+    __ALPHA__ = 3
+    __QUERY_TIMEOUT__ = 2.0
+    __TOKEN_ROTATION__ = 300.0
+    __PEER_TTL__ = 1800.0
+    __MAX_TORRENTS__ = 2000
+    __MAX_PEERS_PER_TORRENT__ = 200
+    __MAX_VALUES__ = 50
+    __MAINTENANCE_INTERVAL__ = 60.0
+    __REFRESH_INTERVAL__ = 900.0
+    __SAVE_INTERVAL__ = 300.0
+    __STATE_PATH__ = './dht.state'
+    __BOOTSTRAP_NODES__ = (
+        ('router.bittorrent.com', 6881),
+        ('dht.transmissionbt.com', 6881),
+        ('router.utorrent.com', 6881),
+    )
+
+    def __init__(self, host: str = '0.0.0.0', port: int = 0, state_path: str | None = __STATE_PATH__,
+                 bootstrap_nodes: Iterable[tuple[str, int]] = __BOOTSTRAP_NODES__):
+        """
+        The routing table is not saved if state_path is None
+        """
+        self.host = host
+        self.port = port
+        self.state_path = state_path
+        self.bootstrap_nodes: list[tuple[str, int]] = list(bootstrap_nodes)
+        self.routing_table: RoutingTable = \
+            (state_path and RoutingTable.load(state_path)) or RoutingTable(os.urandom(20))
+        self.transport: DatagramTransport | None = None
+        self.bootstrapped: asyncio.Event = asyncio.Event()
+        self._transactions: dict[bytes, tuple[tuple, Future]] = {}
+        self._secrets: list[bytes] = [os.urandom(8), os.urandom(8)]
+        self._secret_changed: float = time.monotonic()
+        self._peers: dict[bytes, dict[PeerInfo, float]] = {}
+        self._pinging: set[bytes] = set()
+        self._tasks: set[Task] = set()
+        self._maintenance_task: Task | None = None
+
+    @property
+    def node_id(self) -> bytes:
+        return self.routing_table.node_id
+
+    async def start(self):
+        """
+        Opens the socket, bootstrapping goes on in the background (lookups wait for it)
+        """
+        await asyncio.get_running_loop().create_datagram_endpoint(lambda: self, local_addr=(self.host, self.port))
+        self._maintenance_task = asyncio.create_task(self._maintenance_job(), name='DHT')
+
+    def close(self):
+        self.save()
+        if self._maintenance_task:
+            self._maintenance_task.cancel()
+        for task in self._tasks:
+            task.cancel()
+        for _, future in self._transactions.values():
+            if not future.done():
+                future.cancel()
+        if self.transport:
+            self.transport.close()
+            self.transport = None
+
+    def save(self):
+        if self.state_path:
+            self.routing_table.save(self.state_path)
+
+    def connection_made(self, transport: DatagramTransport):
+        self.transport = transport
+
+    def connection_lost(self, exc: Exception | None):
+        self.transport = None
+
+    def error_received(self, exc: Exception):
+        # errors (icmp unreachable...) can not be matched to a transaction, the query times out
+        pass
+
+    def datagram_received(self, data: bytes, addr: tuple):
+        try:
+            message = bencdec.decode(data)[0]
+            kind, transaction_id = message[Y], message[T]
+        except (ValueError, KeyError, TypeError, IndexError):
+            return
+        if not isinstance(transaction_id, bytes):
+            return
+        if kind == QUERY:
+            self._handle_query(message, addr)
+        elif kind in (RESPONSE, ERROR):
+            transaction = self._transactions.get(transaction_id)
+            if transaction is None or transaction[0] != addr[:2] or transaction[1].done():
+                return
+            transaction[1].set_result(message)
+
+    def _send(self, message: dict, addr: tuple):
+        """
+        Keys of message must be sorted, bencdec keeps their order
+        """
+        if self.transport:
+            self.transport.sendto(bencdec.encode(message), addr)
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._on_task_done)
+
+    def _on_task_done(self, task: Task):
+        self._tasks.discard(task)
+        if not task.cancelled():
+            task.exception()
+
+    def _heard(self, node_id: bytes, addr: tuple, responded: bool):
+        if questionable := self.routing_table.heard(node_id, addr[0], addr[1], responded):
+            self._spawn(self._ping(questionable))
+
+    async def _ping(self, node: Node):
+        """
+        Pings a node of a full bucket that is not good, it is replaced once it does not respond (see RoutingTable)
+        """
+        if node.id in self._pinging:
+            return
+        self._pinging.add(node.id)
+        try:
+            await self._query(node.address, PING, {}, node.id)
+        except (TimeoutError, ValueError):
+            pass
+        finally:
+            self._pinging.discard(node.id)
+
+    async def _query(self, addr: tuple, method: bytes, args: dict, node_id: bytes | None = None) -> dict:
+        """
+        Sends a query and returns the response arguments, the routing table learns about the responding node.
+        node_id is the id we expect, the node is marked as failed if it does not respond.
+        Raises TimeoutError if there is no response and ValueError on error / invalid responses
+        """
+        while (transaction_id := os.urandom(2)) in self._transactions:
+            pass
+        future = asyncio.get_running_loop().create_future()
+        self._transactions[transaction_id] = (addr[:2], future)
+        try:
+            self._send({A: {ID: self.node_id, **args}, Q: method, T: transaction_id, Y: QUERY}, addr)
+            async with asyncio.timeout(self.__QUERY_TIMEOUT__):
+                message = await future
+        except TimeoutError:
+            if node_id:
+                self.routing_table.failed(node_id)
+            raise
+        finally:
+            del self._transactions[transaction_id]
+        if message[Y] == ERROR:
+            raise ValueError(f'DHT error: {message.get(E)}')
+        response = message.get(R)
+        if not isinstance(response, dict) or not isinstance(response.get(ID), bytes) or len(response[ID]) != 20:
+            raise ValueError(f'Invalid response: {message}')
+        self._heard(response[ID], addr, responded=True)
+        return response
+
+    async def _lookup(self, target: bytes, method: bytes, seeds: list[Node] | None = None) \
+            -> tuple[list[tuple[Node, bytes | None]], set[PeerInfo]]:
+        """
+        Iterative lookup (find_node or get_peers) of target, starting from the closest nodes of the routing table
+        and seeds. Returns the closest nodes that responded with their tokens and the peers of the responses
+        """
+        candidates: dict[bytes, Node] = {node.id: node for node in self.routing_table.closest(target)}
+        for node in seeds or []:
+            candidates.setdefault(node.id, node)
+        args = {INFO_HASH: target} if method == GET_PEERS else {TARGET: target}
+        queried: set[bytes] = set()
+        failed: set[bytes] = set()
+        responded: dict[bytes, tuple[Node, bytes | None]] = {}
+        peers: set[PeerInfo] = set()
+        pending: dict[Task, Node] = {}
+        try:
+            while True:
+                closest = heapq.nsmallest(
+                    self.routing_table.k, (node for node in candidates.values() if node.id not in failed),
+                    key=lambda node: distance(node.id, target)
+                )
+                for node in [node for node in closest if node.id not in queried][:self.__ALPHA__ - len(pending)]:
+                    queried.add(node.id)
+                    pending[asyncio.create_task(self._query(node.address, method, args, node.id))] = node
+                if not pending:
+                    break
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    node = pending.pop(task)
+                    try:
+                        response = task.result()
+                    except (TimeoutError, ValueError):
+                        failed.add(node.id)
+                        continue
+                    responded[node.id] = (node, response.get(TOKEN))
+                    for new_node in decode_nodes(response.get(NODES)):
+                        if new_node.id != self.node_id:
+                            candidates.setdefault(new_node.id, new_node)
+                    peers |= decode_peers(response.get(VALUES))
+        finally:
+            await utils.cancel_tasks(set(pending))
+        closest_responded = heapq.nsmallest(
+            self.routing_table.k, responded.values(), key=lambda result: distance(result[0].id, target)
+        )
+        return closest_responded, peers
+
+    async def _bootstrap_from(self, host: str, port: int) -> list[Node]:
+        """
+        The nodes that a bootstrap node returns for our id, empty if it can not be reached
+        """
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(
+                host, port, family=socket.AF_INET, type=socket.SOCK_DGRAM
+            )
+            response = await self._query(infos[0][4], FIND_NODE, {TARGET: self.node_id})
+        except (OSError, TimeoutError, ValueError):
+            return []
+        return decode_nodes(response.get(NODES))
+
+    async def _bootstrap(self):
+        """
+        Fills the routing table with a lookup of our own id, from the saved nodes if some of them respond
+        and from the bootstrap nodes otherwise
+        """
+        try:
+            nodes, _ = await self._lookup(self.node_id, FIND_NODE)
+            if not nodes:
+                seeds = await asyncio.gather(*(self._bootstrap_from(host, port) for host, port in self.bootstrap_nodes))
+                await self._lookup(self.node_id, FIND_NODE, [node for nodes in seeds for node in nodes])
+        finally:
+            self.bootstrapped.set()
+        print(f'DHT | Bootstrapped: {len(self.routing_table)} nodes')
+
+    async def _maintenance_job(self):
+        """
+        Bootstraps, then refreshes buckets that did not change for __REFRESH_INTERVAL__ seconds
+        with a lookup of a random id in their range and saves the routing table every __SAVE_INTERVAL__ seconds
+        """
+        await self._bootstrap()
+        self.save()
+        last_save = time.monotonic()
+        while True:
+            await asyncio.sleep(self.__MAINTENANCE_INTERVAL__)
+            for bucket in self.routing_table.stale_buckets(self.__REFRESH_INTERVAL__):
+                bucket.last_changed = time.monotonic()
+                await self._lookup(bucket.random_id(), FIND_NODE)
+            if time.monotonic() - last_save >= self.__SAVE_INTERVAL__:
+                self.save()
+                last_save = time.monotonic()
+
+    async def get_peers(self, info_hash: bytes, announce_port: int | None = None) -> set[PeerInfo]:
+        """
+        Looks up the peers of info_hash. If announce_port is given we are announced as a peer (on that port)
+        to the closest nodes that gave a token
+        """
+        await self.bootstrapped.wait()
+        nodes, peers = await self._lookup(info_hash, GET_PEERS)
+        if announce_port is not None:
+            await asyncio.gather(*(
+                self._query(node.address, ANNOUNCE_PEER, {INFO_HASH: info_hash, PORT: announce_port, TOKEN: token},
+                            node.id)
+                for node, token in nodes if isinstance(token, bytes)
+            ), return_exceptions=True)
+        return peers
+
+    def _token(self, ip: str, secret: bytes) -> bytes:
+        return utils.calculate_hash(ip.encode() + secret)[:8]
+
+    def _current_secrets(self) -> list[bytes]:
+        if time.monotonic() - self._secret_changed >= self.__TOKEN_ROTATION__:
+            self._secrets = [os.urandom(8), self._secrets[0]]
+            self._secret_changed = time.monotonic()
+        return self._secrets
+
+    def _stored_peers(self, info_hash: bytes) -> list[PeerInfo]:
+        """
+        Announced peers of info_hash, expired ones are dropped
+        """
+        if (peers := self._peers.get(info_hash)) is None:
+            return []
+        now = time.monotonic()
+        for peer_info in [peer_info for peer_info, expiry in peers.items() if expiry <= now]:
+            del peers[peer_info]
+        if not peers:
+            del self._peers[info_hash]
+        return list(peers)
+
+    def _store_peer(self, info_hash: bytes, peer_info: PeerInfo):
+        """
+        The peer of the oldest announce makes room when there are too many peers
+        """
+        if info_hash not in self._peers and len(self._peers) >= self.__MAX_TORRENTS__:
+            return
+        self._stored_peers(info_hash)
+        peers = self._peers.setdefault(info_hash, {})
+        if peer_info not in peers and len(peers) >= self.__MAX_PEERS_PER_TORRENT__:
+            del peers[min(peers, key=peers.get)]
+        peers[peer_info] = time.monotonic() + self.__PEER_TTL__
+
+    @staticmethod
+    def _id_argument(args: dict, key: bytes) -> bytes:
+        if not isinstance(value := args.get(key), bytes) or len(value) != 20:
+            raise ValueError(f'Invalid {key.decode()}')
+        return value
+
+    def _send_error(self, transaction_id: bytes, addr: tuple, code: int, message: str):
+        self._send({E: [code, message.encode()], T: transaction_id, Y: ERROR}, addr)
+
+    def _handle_query(self, message: dict, addr: tuple):
+        transaction_id, args = message[T], message.get(A)
+        try:
+            node_id = self._id_argument(args, ID)
+            match message.get(Q):
+                case b'ping':
+                    response = {}
+                case b'find_node':
+                    response = {NODES: encode_nodes(self.routing_table.closest(self._id_argument(args, TARGET)))}
+                case b'get_peers':
+                    info_hash = self._id_argument(args, INFO_HASH)
+                    token = self._token(addr[0], self._current_secrets()[0])
+                    if peers := self._stored_peers(info_hash):
+                        peers = random.sample(peers, min(len(peers), self.__MAX_VALUES__))
+                        response = {TOKEN: token, VALUES: [encode_peer(peer_info) for peer_info in peers]}
+                    else:
+                        response = {NODES: encode_nodes(self.routing_table.closest(info_hash)), TOKEN: token}
+                case b'announce_peer':
+                    info_hash = self._id_argument(args, INFO_HASH)
+                    if args.get(TOKEN) not in [self._token(addr[0], secret) for secret in self._current_secrets()]:
+                        raise ValueError('Bad token')
+                    port = addr[1] if args.get(IMPLIED_PORT) else args.get(PORT)
+                    if not isinstance(port, int) or not 0 < port < 2 ** 16:
+                        raise ValueError('Invalid port')
+                    self._store_peer(info_hash, PeerInfo(addr[0], port))
+                    response = {}
+                case _:
+                    self._send_error(transaction_id, addr, 204, 'Method Unknown')
+                    return
+        except (ValueError, TypeError, AttributeError) as e:
+            self._send_error(transaction_id, addr, 203, f'Protocol Error: {e}')
+            return
+        self._heard(node_id, addr, responded=False)
+        self._send({R: {ID: self.node_id, **response}, T: transaction_id, Y: RESPONSE}, addr)
@@ -0,0 +1,254 @@
+import bisect
+import dataclasses
+import heapq
+import ipaddress
+import os
+import random
+import time
+from collections import deque
+from typing import Iterator
+
+import bencdec
+from dht.constants import *
+from peer.peer_info import PeerInfo
+
+
+def distance(a: bytes, b: bytes) -> int:
+    """
+    Kademlia (xor) distance of two ids
+    """
+    return int.from_bytes(a, byteorder="big") ^ int.from_bytes(b, byteorder="big")
+
+
+@dataclasses.dataclass(eq=False)
+class Node:
+    """
+    A DHT node. Times are monotonic, last_response is 0.0 if the node never responded to us
+    """
+    __GOOD_PERIOD__ = 900.0
+    __MAX_FAILURES__ = 2
+
+    id: bytes
+    ip: str
+    port: int
+    last_seen: float = 0.0
+    last_response: float = 0.0
+    failures: int = 0
+
+    @property
+    def address(self) -> tuple[str, int]:
+        return self.ip, self.port
+
+    def is_good(self) -> bool:
+        """
+        Good nodes responded to us and were heard of recently (BEP 5)
+        """
+        return self.failures == 0 and self.last_response > 0.0 and \
+            time.monotonic() - self.last_seen < self.__GOOD_PERIOD__
+
+    def is_bad(self) -> bool:
+        return self.failures >= self.__MAX_FAILURES__
+
+
+def encode_nodes(nodes: list[Node]) -> bytes:
+    """
+    Nodes in compact form, 20 bytes of id, 4 bytes of ip and 2 bytes of port each
+    """
+    return b''.join(
+        node.id + ipaddress.IPv4Address(node.ip).packed + node.port.to_bytes(2, byteorder="big") for node in nodes
+    )
+
+
+def decode_nodes(raw_nodes: bytes) -> list[Node]:
+    nodes: list[Node] = []
+    if not isinstance(raw_nodes, bytes):
+        return nodes
+    for i in range(0, len(raw_nodes) - len(raw_nodes) % 26, 26):
+        port = int.from_bytes(raw_nodes[i + 24: i + 26], byteorder="big")
+        if port:
+            nodes.append(Node(raw_nodes[i: i + 20], str(ipaddress.IPv4Address(raw_nodes[i + 20: i + 24])), port))
+    return nodes
+
+
+def encode_peer(peer_info: PeerInfo) -> bytes:
+    """
+    A peer in compact form, 4 bytes of ip and 2 bytes of port
+    """
+    return ipaddress.IPv4Address(peer_info.ip).packed + peer_info.port.to_bytes(2, byteorder="big")
+
+
+def decode_peers(values: list) -> set[PeerInfo]:
+    """
+    The peers of a get_peers response, a list of peers in compact form
+    """
+    if not isinstance(values, list):
+        return set()
+    return {
+        PeerInfo(str(ipaddress.IPv4Address(value[:4])), int.from_bytes(value[4:], byteorder="big"))
+        for value in values if isinstance(value, bytes) and len(value) == 6
+    }
+
+
+class Bucket:
+    """
+    The nodes whose ids are in [low, high), least recently seen first.
+    Nodes that do not fit are kept as replacements of the nodes that go bad
+    """
+    def __init__(self, low: int, high: int, size: int):
+        self.low = low
+        self.high = high
+        self.nodes: list[Node] = []
+        self.replacements: deque[Node] = deque(maxlen=size)
+        self.last_changed: float = time.monotonic()
+
+    def covers(self, node_id: bytes) -> bool:
+        return self.low <= int.from_bytes(node_id, byteorder="big") < self.high
+
+    def random_id(self) -> bytes:
+        return random.randrange(self.low, self.high).to_bytes(20, byteorder="big")
+
+
+class RoutingTable:
+    """
+    Kademlia routing table: k-buckets that cover the id space, only the bucket that covers our own id is split
+    when it is full. Nodes of a full bucket are replaced once they are bad (see DhtNode._ping)
+    """
+    __K__ = 8
+
+    def __init__(self, node_id: bytes, k: int = __K__):
+        self.node_id = node_id
+        self.k = k
+        self.buckets: list[Bucket] = [Bucket(0, 2 ** 160, k)]
+
+    def __len__(self) -> int:
+        return sum(len(bucket.nodes) for bucket in self.buckets)
+
+    def __iter__(self) -> Iterator[Node]:
+        return (node for bucket in self.buckets for node in bucket.nodes)
+
+    def _bucket(self, node_id: bytes) -> Bucket:
+        index = bisect.bisect_right(self.buckets, int.from_bytes(node_id, byteorder="big"), key=lambda b: b.low)
+        return self.buckets[index - 1]
+
+    def get(self, node_id: bytes) -> Node | None:
+        return next((node for node in self._bucket(node_id).nodes if node.id == node_id), None)
+
+    def heard(self, node_id: bytes, ip: str, port: int, responded: bool) -> Node | None:
+        """
+        Records a message (query or response) of a node.
+        Returns the node that should be pinged when the node did not fit in its full bucket:
+        the least recently seen node that is not good, it is replaced if it does not respond
+        """
+        if node_id == self.node_id:
+            return None
+        now = time.monotonic()
+        bucket = self._bucket(node_id)
+        if node := self.get(node_id):
+            if node.address != (ip, port) and not responded:
+                # queries are easy to spoof, the address only changes with a response
+                return None
+            node.ip, node.port, node.last_seen = ip, port, now
+            if responded:
+                node.last_response, node.failures = now, 0
+            bucket.nodes.remove(node)
+            bucket.nodes.append(node)
+            bucket.last_changed = now
+            return None
+        return self._insert(Node(node_id, ip, port, now, now if responded else 0.0))
+
+    def _insert(self, node: Node) -> Node | None:
+        while True:
+            bucket = self._bucket(node.id)
+            if len(bucket.nodes) < self.k or (bad := next((n for n in bucket.nodes if n.is_bad()), None)):
+                if len(bucket.nodes) >= self.k:
+                    bucket.nodes.remove(bad)
+                bucket.nodes.append(node)
+                bucket.last_changed = node.last_seen
+                return None
+            if not bucket.covers(self.node_id) or bucket.high - bucket.low <= self.k:
+                break
+            self._split(bucket)
+        for replacement in bucket.replacements:
+            if replacement.id == node.id:
+                bucket.replacements.remove(replacement)
+                break
+        bucket.replacements.append(node)
+        return next((n for n in bucket.nodes if not n.is_good()), None)
+
+    def _split(self, bucket: Bucket):
+        middle = (bucket.low + bucket.high) // 2
+        upper = Bucket(middle, bucket.high, self.k)
+        bucket.high = middle
+        upper.nodes = [node for node in bucket.nodes if upper.covers(node.id)]
+        bucket.nodes = [node for node in bucket.nodes if bucket.covers(node.id)]
+        for node in list(bucket.replacements):
+            if upper.covers(node.id):
+                bucket.replacements.remove(node)
+                upper.replacements.append(node)
+        upper.last_changed = bucket.last_changed
+        self.buckets.insert(self.buckets.index(bucket) + 1, upper)
+
+    def failed(self, node_id: bytes):
+        """
+        A query of the node timed out, bad nodes are replaced by the latest replacement of their bucket
+        """
+        if not (node := self.get(node_id)):
+            return
+        node.failures += 1
+        bucket = self._bucket(node_id)
+        if node.is_bad() and bucket.replacements:
+            bucket.nodes.remove(node)
+            bucket.nodes.append(bucket.replacements.pop())
+
+    def closest(self, target: bytes, count: int = 0) -> list[Node]:
+        """
+        The count (default k) closest nodes to target that are not bad
+        """
+        return heapq.nsmallest(
+            count or self.k, (node for node in self if not node.is_bad()), key=lambda node: distance(node.id, target)
+        )
+
+    def stale_buckets(self, interval: float) -> list[Bucket]:
+        """
+        Buckets that did not change for interval seconds, they are refreshed with a lookup of a random id
+        """
+        return [bucket for bucket in self.buckets if time.monotonic() - bucket.last_changed >= interval]
+
+    def save(self, path: str) -> bool:
+        """
+        Writes our id and the nodes (the ones that responded first), the file is replaced atomically
+        """
+        nodes = sorted(self, key=lambda node: (node.is_bad(), not node.last_response))
+        try:
+            if directory := os.path.dirname(path):
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f'{path}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(bencdec.encode({ID: self.node_id, NODES: encode_nodes(nodes)}))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f'{path} - save - {e}')
+            return False
+        return True
+
+    @classmethod
+    def load(cls, path: str, k: int = __K__) -> 'RoutingTable | None':
+        """
+        The saved table, its nodes have to respond again before they are good.
+        None if there is no usable saved table
+        """
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                data = bencdec.decode(f.read())[0]
+            node_id, nodes = data[ID], decode_nodes(data[NODES])
+        except (OSError, ValueError, KeyError, TypeError, IndexError) as e:
+            print(f'{path} - load - {type(e).__name__} - {e}')
+            return None
+        if not isinstance(node_id, bytes) or len(node_id) != 20:
+            return None
+        table = cls(node_id, k)
+        for node in nodes:
+            table.heard(node.id, node.ip, node.port, responded=False)
+        return table
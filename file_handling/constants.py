@@ -0,0 +1,6 @@
+INFO_HASH = b'info hash'
+PIECES = b'pieces'
+FILES = b'files'
+PATH = b'path'
+SIZE = b'size'
+MTIME = b'mtime'
@@ -0,0 +1,133 @@
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Callable, Iterable
+
+
+class DiskIO:
+    """
+    Performs file reads / writes on a bounded pool of worker threads so that the event loop never blocks on disk
+
+    Every file has its own queue of jobs that run in order, one at a time, while different files proceed in parallel.
+    Since jobs of a file never overlap, a file object (unbuffered) can be shared safely with the worker threads.
+    Writes are fire-and-forget (a future is still returned), reads are awaitable.
+    A DiskIO can be shared by many torrents: drain waits for the jobs of some files only,
+    backpressure is up to the users (see FileHandler.writable)
+    """
+    def __init__(self, workers: int = 4, executor: ThreadPoolExecutor | None = None):
+        """
+        An executor that is given is not shut down by close
+        """
+        self._own_executor: bool = executor is None
+        self._executor: ThreadPoolExecutor = executor or ThreadPoolExecutor(workers, thread_name_prefix='DiskIO')
+        self._queues: dict[BinaryIO, deque[tuple[asyncio.Future, Callable, tuple]]] = {}
+        self._drain_waiters: dict[BinaryIO, list[asyncio.Future]] = {}
+        self.queued_bytes: int = 0
+        self.idle: asyncio.Event = asyncio.Event()
+        self.idle.set()
+
+    def _update_events(self):
+        if self._queues:
+            self.idle.clear()
+        else:
+            self.idle.set()
+
+    def _submit(self, io: BinaryIO, func: Callable, *args) -> asyncio.Future:
+        """
+        Queues a job for file io. The job starts immediately if the file has no other job running
+        """
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues.setdefault(io, deque())
+        queue.append((future, func, args))
+        if len(queue) == 1:
+            self._run_next(io)
+        self._update_events()
+        return future
+
+    def _run_next(self, io: BinaryIO):
+        """
+        Runs the job at the front of the queue of file io, the job is removed from the queue once it is done
+        """
+        _, func, args = self._queues[io][0]
+        job = asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        job.add_done_callback(lambda j: self._on_job_done(io, j))
+
+    def _on_job_done(self, io: BinaryIO, job: asyncio.Future):
+        queue = self._queues[io]
+        future, func, args = queue.popleft()
+        if func is self._write:
+            self.queued_bytes -= len(args[2])
+        if not future.cancelled():
+            if job.exception():
+                future.set_exception(job.exception())
+            else:
+                future.set_result(job.result())
+        if queue:
+            self._run_next(io)
+        else:
+            del self._queues[io]
+            for waiter in self._drain_waiters.pop(io, []):
+                if not waiter.done():
+                    waiter.set_result(None)
+        self._update_events()
+
+    @staticmethod
+    def _write(io: BinaryIO, offset: int, data: bytes | memoryview) -> int:
+        io.seek(offset)
+        written = 0
+        while written < len(data):
+            written += io.write(data[written:])
+        return written
+
+    @staticmethod
+    def _read(io: BinaryIO, offset: int, length: int) -> bytes:
+        io.seek(offset)
+        result = io.read(length)
+        if len(result) != length:
+            raise IOError(f'Expected {length} bytes but read {len(result)}')
+        return result
+
+    @staticmethod
+    def _log_write_error(future: asyncio.Future):
+        if not future.cancelled() and future.exception():
+            print(f"DiskIO - write - {type(future.exception()).__name__} - {future.exception()}")
+
+    def write(self, io: BinaryIO, offset: int, data: bytes | memoryview) -> asyncio.Future:
+        """
+        Queues a write of data at offset of file io. Data must not be modified until the write is done
+        The returned future can be ignored, errors are printed
+        """
+        self.queued_bytes += len(data)
+        future = self._submit(io, self._write, io, offset, data)
+        future.add_done_callback(self._log_write_error)
+        return future
+
+    async def read(self, io: BinaryIO, offset: int, length: int) -> bytes:
+        """
+        Reads length bytes at offset of file io. Reads are ordered after writes that are already queued for the file
+        """
+        return await self._submit(io, self._read, io, offset, length)
+
+    async def drain(self, ios: Iterable[BinaryIO]):
+        """
+        Waits until the queued jobs of files ios are done, jobs of other files are not waited for
+        """
+        for io in ios:
+            while io in self._queues:
+                waiter = asyncio.get_running_loop().create_future()
+                self._drain_waiters.setdefault(io, []).append(waiter)
+                await waiter
+
+    async def wait_idle(self):
+        """
+        Waits until every queued job is done
+        """
+        await self.idle.wait()
+
+    async def close(self):
+        """
+        Waits until every queued job is done and stops the worker threads
+        """
+        await self.wait_idle()
+        if self._own_executor:
+            self._executor.shutdown(wait=False)
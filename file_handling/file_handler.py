@@ -1,124 +1,196 @@
+import asyncio
+import functools
 import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Callable
 
+from file_handling.disk_io import DiskIO
 from file_handling.file import File
+from file_handling.piece_verifier import PieceVerifier
+from file_handling.read_cache import ReadCache
+from file_handling.resume_data import ResumeData
+from file_handling.storage_layout import StorageLayout, FileSpan
 from messages import Piece
-from misc import utils
 from torrent.metadata import Metadata
 
 
 class FileHandler:
     """
     Class to handle files in torrent
+    File reads / writes are performed by DiskIO worker threads, never on the event loop
+    DiskIO, the read cache and the hash executor can be shared by the torrents of a session
+    When more than __MAX_QUEUED_BYTES__ of the torrent are waiting to be written the writable event is cleared,
+    peers of the torrent wait for it (backpressure), the other torrents of the session are not held back
     """
-    def __init__(self, metadata: Metadata):
+    __MAX_QUEUED_BYTES__ = 2 ** 26
+
+    def __init__(self, metadata: Metadata, disk_io: DiskIO | None = None, read_cache: ReadCache | None = None,
+                 hash_executor: ThreadPoolExecutor | None = None):
         self.metadata = metadata
+        self._own_disk_io: bool = disk_io is None
+        self.disk_io: DiskIO = disk_io or DiskIO()
+        self.read_cache: ReadCache = read_cache or ReadCache()
+        self.hash_executor: ThreadPoolExecutor | None = hash_executor
+        self._piece_loads: dict[int, asyncio.Task] = {}
+        self.layout = StorageLayout(metadata)
+        self.resume_data = ResumeData(metadata, self.layout)
         self.files: tuple[File, ...] = tuple()
         self.completed_pieces: list[int] = []
         self.pending_pieces: list[int] = []
+        self.queued_bytes: int = 0
+        self.writable: asyncio.Event = asyncio.Event()
+        self.writable.set()
 
-    def on_metadata_completion(self):
+    async def on_metadata_completion(self, progress: Callable[[int, int], None] | None = None):
         """
         Ensures that directories and files in torrent are created and have the correct length
+        Then verifies the pieces that are already on disk, progress(checked, total) is called periodically
         """
         files: list[File] = []
         for file in self.metadata.files_info:
             os.makedirs(os.path.dirname(file.path), exist_ok=True)
             if not os.path.exists(file.path):
                 open(file.path, "x").close()
-            f = open(file.path, "rb+")
+            f = open(file.path, "rb+", buffering=0)
             if os.path.getsize(file.path) != file.size:
                 f.truncate(file.size)
-                f.flush()
             f.seek(0)
             files.append(File(f, file))
         self.files = tuple(files)
-        self._calculate_pending_and_completed_pieces()
+        await self._calculate_pending_and_completed_pieces(progress)
 
-    def _calculate_pending_and_completed_pieces(self):
+    async def _calculate_pending_and_completed_pieces(self, progress: Callable[[int, int], None] | None = None):
         """
         Update the lists of pending and completed pieces
+        Pieces of files that did not change since resume data was saved are trusted, the rest are hashed
         """
-        self.completed_pieces: list[int] = []
-        try:
-            file_index = 0
-            for piece_info in self.metadata.pieces_info:
-                bytes_left = piece_info.length
-                data = b''
-                while bytes_left:
-                    tmp_data = self.files[file_index].io.read(bytes_left)
-                    data += tmp_data
-                    bytes_read = len(tmp_data)
-                    if bytes_read != bytes_left:
-                        file_index += 1
-                    bytes_left -= bytes_read
-                if utils.calculate_hash(data) == piece_info.hash_value:
-                    self.completed_pieces.append(piece_info.index)
-        except (Exception,):
-            pass
-        for file in self.files:
-            file.io.seek(0)
+        trusted_pieces, pieces_to_check = [], None
+        if resume := self.resume_data.load():
+            trusted_pieces, pieces_to_check = resume
+            print(f'{self.resume_data.path} - trusted: {len(trusted_pieces)} - to check: {len(pieces_to_check)}')
+        verified_pieces = []
+        if pieces_to_check is None or pieces_to_check:
+            verifier = PieceVerifier(self.metadata, self.layout, executor=self.hash_executor)
+            verified_pieces = await verifier.verify(pieces_to_check, progress)
+        self.completed_pieces: list[int] = sorted(trusted_pieces + verified_pieces)
         self.pending_pieces = list(set(range(self.metadata.piece_count)) - set(self.completed_pieces))
+        await self.save_resume_data()
 
-    def write_piece(self, index: int, begin: int, data: bytes) -> bool:
+    async def close(self):
         """
-        Writes a piece to the appropriate torrent files
+        Waits for queued writes and closes the files
+        """
+        await self.disk_io.drain(file.io for file in self.files)
+        for file in self.files:
+            file.io.close()
+        self.files = tuple()
+        for index in range(self.metadata.piece_count):
+            self.read_cache.discard(self._cache_key(index))
+        if self._own_disk_io:
+            await self.disk_io.close()
+
+    def _cache_key(self, index: int) -> tuple[bytes, int]:
+        return self.metadata.info_hash, index
+
+    async def save_resume_data(self) -> bool:
         """
-        file_index, offset = self._byte_in_torrent_to_file_and_offset(
-            index * self.metadata.piece_size + begin
-        )
-        if file_index is None or offset is None:
+        Waits for queued writes and saves the completed pieces together with the current state of files
+        """
+        if not self.files:
             return False
+        await self.disk_io.drain(file.io for file in self.files)
+        return self.resume_data.save(self.completed_pieces)
 
-        bytes_left = len(data)
-        start_byte = 0
-        while bytes_left and file_index < len(self.files):
-            self.files[file_index].io.seek(offset)
+    async def wait_writable(self):
+        await self.writable.wait()
 
-            bytes_to_write = min(bytes_left, self.files[file_index].info.size - offset)
-            end_byte = start_byte + bytes_to_write
+    def _on_write_done(self, length: int, _: asyncio.Future):
+        self.queued_bytes -= length
+        if self.queued_bytes <= self.__MAX_QUEUED_BYTES__:
+            self.writable.set()
 
-            written = self.files[file_index].io.write(data[start_byte:end_byte])
-            if bytes_to_write != written:
-                return False
+    def _write(self, io: BinaryIO, offset: int, data: memoryview) -> asyncio.Future:
+        """
+        Queues a write on DiskIO, the bytes count towards the backpressure of the torrent until it is done
+        """
+        self.queued_bytes += len(data)
+        if self.queued_bytes > self.__MAX_QUEUED_BYTES__:
+            self.writable.clear()
+        future = self.disk_io.write(io, offset, data)
+        future.add_done_callback(functools.partial(self._on_write_done, len(data)))
+        return future
+
+    def _block_spans(self, index: int, begin: int, length: int) -> list[FileSpan] | tuple[FileSpan, ...] | None:
+        """
+        Returns the file spans of a block or None if the block is not inside piece index
+        """
+        if not 0 <= index < self.metadata.piece_count:
+            return None
+        if begin < 0 or length < 0 or begin + length > self.metadata.pieces_info[index].length:
+            return None
+        return self.layout.block_spans(index, begin, length)
 
-            bytes_left -= written
+    async def write_piece(self, index: int, begin: int, data: bytes | bytearray | memoryview) -> bool:
+        """
+        Writes a piece to the appropriate torrent files, one write per file that the piece touches
+        Data must not be modified until the write is done
+        Returns False if the piece does not fit in torrent files or if writing fails
+        """
+        spans = self._block_spans(index, begin, len(data))
+        if spans is None or not self.files:
+            return False
+        view = memoryview(data)
+        writes = []
+        start_byte = 0
+        for span in spans:
+            end_byte = start_byte + span.length
+            writes.append(self._write(self.files[span.file_index].io, span.offset, view[start_byte:end_byte]))
             start_byte = end_byte
-            file_index += 1
-            offset = 0
+        results = await asyncio.gather(*writes, return_exceptions=True)
+        if any(isinstance(result, BaseException) for result in results):
+            return False
+        if begin == 0 and len(data) == self.metadata.pieces_info[index].length:
+            # freshly completed pieces are the ones that peers are about to request
+            self.read_cache.put(self._cache_key(index), bytes(view) if isinstance(data, memoryview) else data)
         return True
 
-    def _byte_in_torrent_to_file_and_offset(self, byte_in_torrent: int) -> tuple[int | None, int | None]:
+    async def _read_spans(self, spans: list[FileSpan] | tuple[FileSpan, ...]) -> bytes | None:
+        try:
+            parts = await asyncio.gather(
+                *(self.disk_io.read(self.files[span.file_index].io, span.offset, span.length) for span in spans)
+            )
+        except OSError as e:
+            print(f"read_piece - {spans} - {e}")
+            return None
+        return b''.join(parts)
+
+    async def _load_piece(self, index: int) -> bytes | None:
         """
-        It figures out which file and offset correspond to a byte in torrent
+        Reads a whole piece into the read cache. Concurrent loads of the same piece share one read
         """
-        for i, file in enumerate(self.files):
-            if file.info.start_byte_in_torrent <= byte_in_torrent <= file.info.end_byte_in_torrent:
-                return i, byte_in_torrent - file.info.start_byte_in_torrent
-        return None, None
-
-    def read_piece(self, index: int, begin: int, length: int) -> Piece | None:
+        if index not in self._piece_loads:
+            load = asyncio.create_task(self._read_spans(self.layout.piece_spans[index]))
+            self._piece_loads[index] = load
+            load.add_done_callback(lambda _: self._piece_loads.pop(index, None))
+        data = await asyncio.shield(self._piece_loads[index])
+        if data is not None:
+            self.read_cache.put(self._cache_key(index), data)
+        return data
+
+    async def read_piece(self, index: int, begin: int, length: int) -> Piece | None:
         """
         Reads the appropriate piece that can be used as a response to a request
+        On a cache miss the whole piece is read (read-ahead) and cached, blocks are slices of cached pieces
         """
-        file_index, offset = self._byte_in_torrent_to_file_and_offset(
-            index * self.metadata.piece_size + begin
-        )
-        if file_index is None or offset is None:
+        spans = self._block_spans(index, begin, length)
+        if spans is None or not self.files:
             return None
-
-        result: bytearray = bytearray()
-        bytes_left = length
-        while bytes_left and file_index < len(self.files):
-            self.files[file_index].io.seek(offset)
-
-            bytes_to_read = min(bytes_left, self.files[file_index].info.size - offset)
-            bytes_read = self.files[file_index].io.read(bytes_to_read)
-            if bytes_to_read != len(bytes_read):
+        if not self.read_cache.fits(self.metadata.pieces_info[index].length):
+            data = await self._read_spans(spans)
+            return Piece(index, begin, data) if data is not None else None
+        data = self.read_cache.get(self._cache_key(index))
+        if data is None:
+            data = await self._load_piece(index)
+            if data is None:
                 return None
-
-            result.extend(bytes_read)
-
-            bytes_left -= len(bytes_read)
-            file_index += 1
-            offset = 0
-        return Piece(index, begin, bytes(result))
+        return Piece(index, begin, memoryview(data)[begin: begin + length])
@@ -0,0 +1,148 @@
+import asyncio
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Callable, Iterable
+
+from file_handling.storage_layout import StorageLayout
+from piece_handling.piece_info import PieceInfo
+from torrent.metadata import Metadata
+
+
+class PieceVerifier:
+    """
+    Verifies the pieces of a torrent that are already on disk
+
+    Files are read sequentially in large chunks (whole pieces) into a few reusable buffers by a dedicated reader
+    thread. Hashing runs on a thread pool (hashlib releases the GIL for large data) while the next chunk is read,
+    so verification is disk bound and the event loop is never blocked.
+    A failure while reading a chunk only marks the pieces of that chunk as not completed.
+    """
+    __CHUNK_SIZE__ = 2 ** 23
+    __PROGRESS_INTERVAL__ = 1.0
+
+    def __init__(self, metadata: Metadata, layout: StorageLayout | None = None, workers: int = 0,
+                 executor: ThreadPoolExecutor | None = None):
+        self.metadata = metadata
+        self.layout: StorageLayout = layout or StorageLayout(metadata)
+        self._workers: int = workers if workers > 0 else min(8, os.cpu_count() or 1)
+        self._executor: ThreadPoolExecutor | None = executor
+        self._file_handles: dict[int, BinaryIO] = {}
+        self._pieces_per_chunk: int = max(1, self.__CHUNK_SIZE__ // max(1, metadata.piece_size))
+
+    def _open_file(self, file_index: int) -> BinaryIO:
+        if file_index not in self._file_handles:
+            self._file_handles[file_index] = open(self.metadata.files_info[file_index].path, "rb", buffering=0)
+        return self._file_handles[file_index]
+
+    def _close_files(self):
+        for f in self._file_handles.values():
+            f.close()
+        self._file_handles = {}
+
+    def _read_into(self, byte_in_torrent: int, view: memoryview) -> list[tuple[int, int]]:
+        """
+        Reads len(view) bytes of the torrent starting at byte_in_torrent into view.
+        Runs on the reader thread.
+        Returns the (start, end) ranges of view that could not be read (missing file, short read, I/O error)
+        """
+        bad_ranges: list[tuple[int, int]] = []
+        done = 0
+        for span in self.layout.spans(byte_in_torrent, len(view)):
+            span_end = done + span.length
+            try:
+                f = self._open_file(span.file_index)
+                f.seek(span.offset)
+                while done < span_end:
+                    bytes_read = f.readinto(view[done: span_end])
+                    if not bytes_read:
+                        break
+                    done += bytes_read
+            except OSError:
+                pass
+            if done < span_end:
+                bad_ranges.append((done, span_end))
+                done = span_end
+        if done < len(view):
+            bad_ranges.append((done, len(view)))
+        return bad_ranges
+
+    @staticmethod
+    def _is_hash_ok(view: memoryview, piece_info: PieceInfo) -> bool:
+        return hashlib.sha1(view).digest() == piece_info.hash_value
+
+    def _build_chunks(self, piece_indices: Iterable[int]) -> list[list[PieceInfo]]:
+        """
+        Groups pieces into chunks of consecutive pieces so that each chunk is read with sequential reads
+        """
+        chunks: list[list[PieceInfo]] = []
+        previous = None
+        for index in sorted(set(piece_indices)):
+            if previous is None or index != previous + 1 or len(chunks[-1]) >= self._pieces_per_chunk:
+                chunks.append([])
+            chunks[-1].append(self.metadata.pieces_info[index])
+            previous = index
+        return chunks
+
+    async def verify(self, piece_indices: Iterable[int] | None = None,
+                     progress: Callable[[int, int], None] | None = None) -> list[int]:
+        """
+        Hashes the requested pieces (all pieces by default) and returns the indices of the ones that are correct.
+        progress(pieces_checked, pieces_total) is called periodically from the event loop
+        """
+        if piece_indices is None:
+            piece_indices = range(self.metadata.piece_count)
+        chunks = self._build_chunks(piece_indices)
+        total = sum(len(chunk) for chunk in chunks)
+        completed: list[int] = []
+        checked = 0
+        last_report = time.monotonic()
+        loop = asyncio.get_running_loop()
+
+        free_buffers: asyncio.Queue[bytearray] = asyncio.Queue()
+        for _ in range(self._workers + 1):
+            free_buffers.put_nowait(bytearray(self._pieces_per_chunk * self.metadata.piece_size))
+
+        async def hash_chunk(chunk: list[PieceInfo], buffer: bytearray, bad_ranges: list[tuple[int, int]]):
+            nonlocal checked, last_report
+            view = memoryview(buffer)
+            try:
+                hashed: list[PieceInfo] = []
+                futures = []
+                offset = 0
+                for piece_info in chunk:
+                    end = offset + piece_info.length
+                    if not any(bad_start < end and offset < bad_end for bad_start, bad_end in bad_ranges):
+                        piece_view = view[offset: end]
+                        futures.append(loop.run_in_executor(executor, self._is_hash_ok, piece_view, piece_info))
+                        hashed.append(piece_info)
+                    offset = end
+                results = await asyncio.gather(*futures)
+                completed.extend(piece_info.index for piece_info, ok in zip(hashed, results) if ok)
+            finally:
+                free_buffers.put_nowait(buffer)
+            checked += len(chunk)
+            if progress and (time.monotonic() - last_report >= self.__PROGRESS_INTERVAL__ or checked == total):
+                last_report = time.monotonic()
+                progress(checked, total)
+
+        executor = self._executor or ThreadPoolExecutor(self._workers, thread_name_prefix='PieceVerifier')
+        reader = ThreadPoolExecutor(1, thread_name_prefix='PieceVerifierReader')
+        hash_tasks: list[asyncio.Task] = []
+        try:
+            for chunk in chunks:
+                buffer = await free_buffers.get()
+                chunk_length = sum(piece_info.length for piece_info in chunk)
+                bad_ranges = await loop.run_in_executor(
+                    reader, self._read_into, chunk[0].index * self.metadata.piece_size,
+                    memoryview(buffer)[:chunk_length]
+                )
+                hash_tasks.append(asyncio.create_task(hash_chunk(chunk, buffer, bad_ranges)))
+            await asyncio.gather(*hash_tasks)
+        finally:
+            await loop.run_in_executor(reader, self._close_files)
+            reader.shutdown(wait=False)
+            if executor is not self._executor:
+                executor.shutdown(wait=False)
+        return sorted(completed)
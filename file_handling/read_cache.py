@@ -0,0 +1,56 @@
+from collections import OrderedDict
+from typing import Hashable
+
+
+class ReadCache:
+    """
+    Memory budgeted cache of whole pieces with LRU eviction, used to serve Requests without touching the disk
+
+    Blocks are served as slices of cached pieces. hits / misses count lookups
+    Keys are chosen by the users of the cache, so that one cache (one memory budget) can be shared by many torrents
+    """
+    def __init__(self, max_bytes: int = 2 ** 26):
+        self.max_bytes: int = max_bytes
+        self.size: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self._pieces: OrderedDict[Hashable, bytes | bytearray] = OrderedDict()
+
+    def __repr__(self):
+        return f"pieces: {len(self._pieces)} | size: {self.size} | hits: {self.hits} | misses: {self.misses}"
+
+    def fits(self, length: int) -> bool:
+        """
+        True if a piece of length bytes can be cached at all
+        """
+        return length <= self.max_bytes
+
+    def get(self, key: Hashable) -> bytes | bytearray | None:
+        """
+        Returns the cached piece and marks it as most recently used, None on a miss
+        """
+        data = self._pieces.get(key)
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._pieces.move_to_end(key)
+        return data
+
+    def put(self, key: Hashable, data: bytes | bytearray):
+        """
+        Caches a piece, least recently used pieces are evicted until it fits. Data must not be modified afterwards
+        """
+        if not self.fits(len(data)):
+            return
+        self.discard(key)
+        while self._pieces and self.size + len(data) > self.max_bytes:
+            _, evicted = self._pieces.popitem(last=False)
+            self.size -= len(evicted)
+        self._pieces[key] = data
+        self.size += len(data)
+
+    def discard(self, key: Hashable):
+        data = self._pieces.pop(key, None)
+        if data is not None:
+            self.size -= len(data)
@@ -0,0 +1,88 @@
+import os
+from typing import Iterable
+
+import bencdec
+from file_handling.constants import *
+from file_handling.storage_layout import StorageLayout
+from messages import Bitfield
+from torrent.metadata import Metadata
+
+
+class ResumeData:
+    """
+    Fast-resume state of a torrent, a bencoded file per info hash that holds
+    the bitfield of completed pieces and the size / modification time of every file at the time of saving.
+
+    At startup pieces of unchanged files are trusted, only pieces that touch changed files have to be hashed again
+    """
+    __DIRECTORY__ = './resume'
+
+    def __init__(self, metadata: Metadata, layout: StorageLayout, directory: str = __DIRECTORY__):
+        self.metadata = metadata
+        self.layout = layout
+        self.path: str = os.path.join(directory, f'{metadata.info_hash.hex()}.resume')
+
+    @staticmethod
+    def _file_state(path: str) -> tuple[int, int] | None:
+        """
+        Returns (size, modification time in ns) of file or None if it does not exist
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def save(self, completed_pieces: Iterable[int]) -> bool:
+        """
+        Writes the resume file. The file is replaced atomically so a crash never leaves a broken resume file
+        """
+        bitfield = Bitfield()
+        bitfield.update_from_completed_pieces(list(completed_pieces), self.metadata.piece_count)
+        files = []
+        for file in self.metadata.files_info:
+            state = self._file_state(file.path)
+            if state is None:
+                return False
+            files.append({MTIME: state[1], PATH: file.path.encode(), SIZE: state[0]})
+        data = {FILES: files, INFO_HASH: self.metadata.info_hash, PIECES: bytes(bitfield.data)}
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(bencdec.encode(data))
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f'{self.path} - save - {e}')
+            return False
+        return True
+
+    def load(self) -> tuple[list[int], list[int]] | None:
+        """
+        Reads the resume file and compares it with files on disk
+        Returns (completed pieces that can be trusted, pieces that must be hashed)
+        or None if there is no usable resume data, in that case every piece must be hashed
+        """
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, 'rb') as f:
+                data = bencdec.decode(f.read())[0]
+            if data[INFO_HASH] != self.metadata.info_hash or len(data[FILES]) != len(self.metadata.files_info):
+                return None
+            bitfield = Bitfield(data[PIECES])
+            saved_states = [(saved.get(SIZE), saved.get(MTIME)) for saved in data[FILES]]
+        except (OSError, ValueError, KeyError, TypeError, IndexError, AttributeError) as e:
+            print(f'{self.path} - load - {type(e).__name__} - {e}')
+            return None
+
+        pieces_to_check: set[int] = set()
+        for file_index, file in enumerate(self.metadata.files_info):
+            if self._file_state(file.path) != saved_states[file_index]:
+                pieces_to_check.update(self.layout.pieces_of_file(file_index))
+
+        completed_pieces = [
+            index for index in range(self.metadata.piece_count)
+            if bitfield.get_bit_value(index) and index not in pieces_to_check
+        ]
+        return completed_pieces, sorted(pieces_to_check)
@@ -0,0 +1,93 @@
+import bisect
+import dataclasses
+
+from torrent.metadata import Metadata
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class FileSpan:
+    """
+    A contiguous part of a file: length bytes starting at offset of file file_index
+    """
+    file_index: int
+    offset: int
+    length: int
+
+
+class StorageLayout:
+    """
+    Maps byte ranges of the torrent to the files that hold them
+
+    Start bytes of files are kept in a sorted list, so any range is located with a binary search (O(log files)).
+    The spans of every piece are precomputed since whole pieces are read / written / hashed all the time.
+    Empty files never appear in spans.
+    """
+    def __init__(self, metadata: Metadata):
+        self.metadata = metadata
+        self._file_indices: list[int] = [i for i, file in enumerate(metadata.files_info) if file.size > 0]
+        self._file_starts: list[int] = [metadata.files_info[i].start_byte_in_torrent for i in self._file_indices]
+        self.piece_spans: tuple[tuple[FileSpan, ...], ...] = self._build_piece_spans()
+
+    def _build_piece_spans(self) -> tuple[tuple[FileSpan, ...], ...]:
+        """
+        Walks pieces and files together, O(pieces + files)
+        """
+        result: list[tuple[FileSpan, ...]] = []
+        position = 0
+        for piece_info in self.metadata.pieces_info:
+            piece_start = piece_info.index * self.metadata.piece_size
+            piece_end = piece_start + piece_info.length
+            spans: list[FileSpan] = []
+            while position < len(self._file_indices):
+                file_index = self._file_indices[position]
+                file = self.metadata.files_info[file_index]
+                start = max(piece_start, file.start_byte_in_torrent)
+                end = min(piece_end, file.end_byte_in_torrent + 1)
+                if start < end:
+                    spans.append(FileSpan(file_index, start - file.start_byte_in_torrent, end - start))
+                if file.end_byte_in_torrent + 1 > piece_end:
+                    break
+                position += 1
+            result.append(tuple(spans))
+        return tuple(result)
+
+    def spans(self, byte_in_torrent: int, length: int) -> list[FileSpan]:
+        """
+        Returns the file spans that hold length bytes starting at byte_in_torrent
+        If the range exceeds the torrent, spans cover only the part inside the torrent
+        """
+        spans: list[FileSpan] = []
+        if byte_in_torrent < 0:
+            return spans
+        position = bisect.bisect_right(self._file_starts, byte_in_torrent) - 1
+        end = byte_in_torrent + length
+        while byte_in_torrent < end and 0 <= position < len(self._file_indices):
+            file_index = self._file_indices[position]
+            file = self.metadata.files_info[file_index]
+            span_length = min(end, file.end_byte_in_torrent + 1) - byte_in_torrent
+            if span_length <= 0:
+                break
+            spans.append(FileSpan(file_index, byte_in_torrent - file.start_byte_in_torrent, span_length))
+            byte_in_torrent += span_length
+            position += 1
+        return spans
+
+    def block_spans(self, index: int, begin: int, length: int) -> list[FileSpan] | tuple[FileSpan, ...]:
+        """
+        Returns the file spans of a block (or a whole piece) of piece index
+        """
+        if begin == 0 and 0 <= index < len(self.piece_spans) and length == self.metadata.pieces_info[index].length:
+            return self.piece_spans[index]
+        return self.spans(index * self.metadata.piece_size + begin, length)
+
+    def pieces_of_file(self, file_index: int) -> range:
+        """
+        Returns the indices of the pieces that touch file file_index
+        """
+        file = self.metadata.files_info[file_index]
+        if file.size == 0:
+            return range(0)
+        return range(
+            file.start_byte_in_torrent // self.metadata.piece_size,
+            file.end_byte_in_torrent // self.metadata.piece_size + 1
+        )
@@ -1,25 +1,16 @@
 import asyncio
 
-from torrent import Torrent
+from session import Session
 from torrent.torrent_info import TorrentInfo
 
 
-async def torrent1():
-    torrent = Torrent(TorrentInfo('test1.torrent', 6881, b'hello i am testing  '))
-    await torrent.start()
-
-
-async def torrent2():
-    torrent = Torrent(TorrentInfo('test2.torrent', 6881, b'hello i am testing  '))
-    await torrent.start()
-
-
 async def main():
-    tasks = [
-        asyncio.create_task(torrent1()),
-        # asyncio.create_task(torrent2())
-    ]
-    await asyncio.wait(tasks)
+    # a single session (port, connection budget, disk pool, bandwidth limits) for every torrent
+    session = Session(6881)
+    await session.start()
+    session.add_torrent(TorrentInfo('test1.torrent', session.port, b'hello i am testing  '))
+    # session.add_torrent(TorrentInfo('test2.torrent', session.port, b'hello i am testing  '))
+    await asyncio.Event().wait()
 
 
 asyncio.run(main())
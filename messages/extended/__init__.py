@@ -2,3 +2,4 @@ from .extended_handshake import ExtendedHandshake
 from .piece_request import ExtendedMetadataPieceRequest
 from .piece_response import ExtendedMetadataPieceResponse
 from .piece_reject import ExtendedMetadataPieceReject
+from .pex import ExtendedPex
@@ -1,6 +1,12 @@
+ADDED = b'added'
+ADDED_F = b'added.f'
+DROPPED = b'dropped'
 M = b'm'
 METADATA = b'ut_metadata'
 METADATA_SIZE = b'metadata_size'
 MSG_TYPE = b'msg_type'
+P = b'p'
+PEX = b'ut_pex'
 PIECE = b'piece'
+REQQ = b'reqq'
 TOTAL_SIZE = b'total_size'
@@ -1,17 +1,32 @@
 import bencdec
 from messages import Message, IDs
-from messages.extended.constants import METADATA_SIZE, M, METADATA
+from messages.extended.constants import METADATA_SIZE, M, METADATA, REQQ, PEX, P
 from messages.extended.extended import Extended
 
 
 class ExtendedHandshake(Message):
-    def __init__(self, message_length: int, ext_id: int, metadata_uid: int, metadata_size: int):
+    def __init__(self, message_length: int, ext_id: int, metadata_uid: int | None, metadata_size: int | None,
+                 reqq: int | None = None, pex_uid: int | None = None, port: int | None = None):
         super().__init__(message_length, IDs.extended.value)
         self.ext_id = ext_id
         self.metadata_uid = metadata_uid
         self.metadata_size = metadata_size
+        self.reqq = reqq
+        self.pex_uid = pex_uid
+        # listen port of the peer, the port of an incoming connection is not the one to connect to
+        self.port = port
 
     def to_bytes(self) -> bytes:
-        return Extended(self.ext_id, bencdec.encode(
-            {M: {METADATA: self.metadata_uid}, METADATA_SIZE: self.metadata_size}
-        )).to_bytes()
+        m = {}
+        if self.metadata_uid:
+            m[METADATA] = self.metadata_uid
+        if self.pex_uid:
+            m[PEX] = self.pex_uid
+        data = {M: m}
+        if self.metadata_size:
+            data[METADATA_SIZE] = self.metadata_size
+        if self.port:
+            data[P] = self.port
+        if self.reqq:
+            data[REQQ] = self.reqq
+        return Extended(self.ext_id, bencdec.encode(data)).to_bytes()
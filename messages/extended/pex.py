@@ -0,0 +1,56 @@
+import ipaddress
+
+import bencdec
+from messages import Message, IDs
+from messages.extended.constants import ADDED, ADDED_F, DROPPED
+from messages.extended.extended import Extended
+
+
+class ExtendedPex(Message):
+    """
+    Peer Exchange message (BEP 11): peers that were connected / dropped since the previous message,
+    added_flags holds a byte of flags for every added peer
+    """
+    __SEED__ = 0x02
+    __REACHABLE__ = 0x10
+
+    def __init__(self, message_length: int, ext_id: int, added: list[tuple[str, int]], added_flags: bytes,
+                 dropped: list[tuple[str, int]]):
+        super().__init__(message_length, IDs.extended.value)
+        self.ext_id = ext_id
+        self.added = added
+        self.added_flags = added_flags
+        self.dropped = dropped
+
+    @staticmethod
+    def is_supported(ip: str) -> bool:
+        """
+        Only IPv4 peers are exchanged (added / dropped), IPv6 peers (added6 / dropped6) are left out
+        """
+        try:
+            ipaddress.IPv4Address(ip)
+        except ValueError:
+            return False
+        return True
+
+    @staticmethod
+    def encode_peers(peers: list[tuple[str, int]]) -> bytes:
+        return b''.join(ipaddress.IPv4Address(ip).packed + port.to_bytes(2, byteorder="big") for ip, port in peers)
+
+    @staticmethod
+    def decode_peers(raw_peers: bytes) -> list[tuple[str, int]]:
+        if not isinstance(raw_peers, bytes):
+            return []
+        return [
+            (str(ipaddress.IPv4Address(raw_peers[i: i + 4])), int.from_bytes(raw_peers[i + 4: i + 6], byteorder="big"))
+            for i in range(0, len(raw_peers) - len(raw_peers) % 6, 6)
+        ]
+
+    def to_bytes(self) -> bytes:
+        return Extended(self.ext_id, bencdec.encode(
+            {
+                ADDED: self.encode_peers(self.added),
+                ADDED_F: self.added_flags,
+                DROPPED: self.encode_peers(self.dropped)
+            }
+        )).to_bytes()
@@ -1,6 +1,6 @@
 import bencdec
 from messages import Message, IDs
-from messages.extended.constants import MSG_TYPE, TOTAL_SIZE
+from messages.extended.constants import MSG_TYPE, PIECE
 from messages.extended.extended import Extended
 from messages.ids import ExtMetadataIDs
 
@@ -15,6 +15,6 @@ class ExtendedMetadataPieceRequest(Message):
         return Extended(self.ext_id, bencdec.encode(
             {
                 MSG_TYPE: ExtMetadataIDs.request.value,
-                TOTAL_SIZE: self.piece
+                PIECE: self.piece
             }
         )).to_bytes()
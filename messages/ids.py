@@ -16,6 +16,7 @@ class IDs(Enum):
 
 class ExtIDs(Enum):
     handshake = 0
+    pex = 1
     metadata = 2
 
 
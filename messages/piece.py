@@ -5,7 +5,7 @@ from messages.ids import IDs
 
 
 class Piece(Message):
-    def __init__(self, index: int, begin: int, block: bytes):
+    def __init__(self, index: int, begin: int, block: bytes | memoryview):
         super().__init__(9 + len(block), IDs.piece.value)
         self.index = index
         self.begin = begin
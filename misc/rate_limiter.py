@@ -0,0 +1,89 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter, buckets form a hierarchy (global -> torrent -> peer)
+
+    Spending bytes consumes tokens of the bucket and of all its parents. A bucket may go into debt, spending is
+    allowed again once every bucket of the chain paid its debt back. This way any amount can be spent at once
+    while the average rate is kept, and bursts are limited to burst seconds worth of tokens.
+    rate is in bytes per second, 0 means unlimited. Rates can be changed at any time with set_rate
+    """
+    __BURST__ = 0.25
+    __MIN_CAPACITY__ = 2 ** 16
+
+    def __init__(self, rate: float = 0.0, parent: 'TokenBucket | None' = None, burst: float = __BURST__):
+        self.parent = parent
+        self.rate: float = 0.0
+        self.capacity: float = 0.0
+        self._burst: float = burst
+        self._tokens: float = 0.0
+        self._last_refill: float = time.monotonic()
+        self.set_rate(rate)
+
+    def __repr__(self):
+        return f"rate: {self.rate / 1024:.1f} KiB/s | tokens: {self._tokens:.0f}"
+
+    def set_rate(self, rate: float):
+        self._refill()
+        self.rate = max(0.0, rate)
+        self.capacity = max(self.rate * self._burst, self.__MIN_CAPACITY__)
+        self._tokens = min(self._tokens, self.capacity) if self.rate else 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate:
+            self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def _chain(self):
+        bucket = self
+        while bucket:
+            yield bucket
+            bucket = bucket.parent
+
+    def delay(self) -> float:
+        """
+        Seconds until spending is allowed
+        """
+        result = 0.0
+        for bucket in self._chain():
+            if bucket.rate:
+                bucket._refill()
+                if bucket._tokens < 0:
+                    result = max(result, -bucket._tokens / bucket.rate)
+        return result
+
+    def consume(self, amount: int):
+        """
+        Spends amount bytes, even if it puts the buckets into debt
+        """
+        for bucket in self._chain():
+            if bucket.rate:
+                bucket._refill()
+                bucket._tokens -= amount
+
+    def try_consume(self, amount: int) -> bool:
+        """
+        Spends amount bytes if spending is allowed now
+        """
+        if self.delay() > 0:
+            return False
+        self.consume(amount)
+        return True
+
+    async def wait_available(self):
+        """
+        Waits until spending is allowed
+        """
+        while (delay := self.delay()) > 0:
+            await asyncio.sleep(delay)
+
+    async def wait(self, amount: int):
+        """
+        Waits until spending is allowed and spends amount bytes
+        """
+        await self.wait_available()
+        self.consume(amount)
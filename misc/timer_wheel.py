@@ -0,0 +1,95 @@
+import asyncio
+import math
+import time
+from typing import Callable
+
+
+class Timer:
+    """
+    A callback scheduled on a TimerWheel. Cancelling only marks the timer, it is dropped when its slot is processed
+    """
+    __slots__ = ('tick', 'callback', 'args', 'cancelled')
+
+    def __init__(self, tick: int, callback: Callable, args: tuple):
+        self.tick = tick
+        self.callback = callback
+        self.args = args
+        self.cancelled: bool = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel, a single driver for a large number of timers (request timeouts, keepalives...)
+
+    Time is split into ticks of tick seconds, a timer is stored in slot (deadline tick % slots).
+    Scheduling and cancelling are O(1). A single call_later runs once per tick (only while timers exist),
+    processes the slots of the ticks that passed and fires the expired timers in a batch.
+    Timers fire up to one tick late, never early
+    """
+    __TICK__ = 0.1
+    __SLOTS__ = 1024
+
+    def __init__(self, tick: float = __TICK__, slots: int = __SLOTS__):
+        self._tick_length: float = tick
+        self._slots: list[list[Timer]] = [[] for _ in range(slots)]
+        self._origin: float = time.monotonic()
+        self._current_tick: int = 0
+        self._count: int = 0
+        self._handle: asyncio.TimerHandle | None = None
+
+    def __len__(self):
+        """
+        Number of stored timers, cancelled timers are counted until their slot is processed
+        """
+        return self._count
+
+    def _now_tick(self) -> int:
+        return int((time.monotonic() - self._origin) / self._tick_length)
+
+    def schedule(self, delay: float, callback: Callable, *args) -> Timer:
+        """
+        Calls callback(*args) after delay seconds. Returns a Timer that can be cancelled
+        """
+        tick = max(math.ceil((time.monotonic() - self._origin + delay) / self._tick_length), self._current_tick + 1)
+        timer = Timer(tick, callback, args)
+        self._slots[tick % len(self._slots)].append(timer)
+        self._count += 1
+        if self._handle is None:
+            self._current_tick = max(self._current_tick, self._now_tick() - 1)
+            self._handle = asyncio.get_running_loop().call_later(self._tick_length, self._run)
+        return timer
+
+    def _run(self):
+        now_tick = self._now_tick()
+        ticks = range(self._current_tick + 1, now_tick + 1)
+        if len(ticks) > len(self._slots):
+            ticks = ticks[-len(self._slots):]
+        expired: list[Timer] = []
+        for tick in ticks:
+            slot = self._slots[tick % len(self._slots)]
+            if not slot:
+                continue
+            remaining: list[Timer] = []
+            for timer in slot:
+                if timer.cancelled:
+                    continue
+                if timer.tick <= now_tick:
+                    expired.append(timer)
+                else:
+                    remaining.append(timer)
+            self._count -= len(slot) - len(remaining)
+            self._slots[tick % len(self._slots)] = remaining
+        self._current_tick = max(self._current_tick, now_tick)
+
+        for timer in expired:
+            if timer.cancelled:
+                continue
+            try:
+                timer.callback(*timer.args)
+            except Exception as e:
+                print(f"TimerWheel - {timer.callback} - {type(e).__name__} - {e}")
+
+        self._handle = asyncio.get_running_loop().call_later(self._tick_length, self._run) if self._count else None
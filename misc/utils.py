@@ -7,7 +7,7 @@ import bencdec
 from messages import Message, Choke, Unchoke, Interested, NotInterested, Have, Bitfield, Request, Piece, Cancel, \
     Unknown, Keepalive
 from messages.extended import ExtendedHandshake, ExtendedMetadataPieceRequest, ExtendedMetadataPieceResponse, \
-    ExtendedMetadataPieceReject
+    ExtendedMetadataPieceReject, ExtendedPex
 from messages.extended.constants import *
 from messages.ids import IDs, ExtMetadataIDs, ExtIDs
 
@@ -19,6 +19,7 @@ def calculate_hash(data: bytes) -> bytes:
 def mem_view_to_msg(msg_id: int, data: memoryview) -> Message:
     """
     Translates data to the appropriate message given the message id.
+    Piece blocks are not copied, they are views of data
     """
     match msg_id:
         case IDs.choke.value:
@@ -40,7 +41,7 @@ def mem_view_to_msg(msg_id: int, data: memoryview) -> Message:
         case IDs.piece.value:
             return Piece(index=int.from_bytes(data[:4], byteorder="big"),
                          begin=int.from_bytes(data[4:8], byteorder="big"),
-                         block=bytes(data[8:]))
+                         block=data[8:])
         case IDs.cancel.value:
             return Cancel(index=int.from_bytes(data[:4], byteorder="big"),
                           begin=int.from_bytes(data[4:8], byteorder="big"),
@@ -51,13 +52,21 @@ def mem_view_to_msg(msg_id: int, data: memoryview) -> Message:
             message_length = 2 + len(raw_data)
             decoded_data, offset = bencdec.decode(raw_data)
             if ext_id == ExtIDs.handshake.value:
-                metadata_size = decoded_data[METADATA_SIZE]
+                metadata_size = decoded_data.get(METADATA_SIZE)
                 metadata_uid = None
-                m: dict[bytes, int] = decoded_data[M]
+                pex_uid = None
+                m: dict[bytes, int] = decoded_data.get(M, {})
                 for key, value in m.items():
                     if b'metadata' in key:
                         metadata_uid = value
-                return ExtendedHandshake(message_length, ext_id, metadata_uid, metadata_size)
+                    elif key == PEX:
+                        pex_uid = value
+                reqq = decoded_data.get(REQQ)
+                port = decoded_data.get(P)
+                return ExtendedHandshake(message_length, ext_id, metadata_uid, metadata_size,
+                                         reqq if isinstance(reqq, int) else None,
+                                         pex_uid if isinstance(pex_uid, int) else None,
+                                         port if isinstance(port, int) and 0 < port < 2 ** 16 else None)
             elif ext_id == ExtIDs.metadata.value:
                 message_type = decoded_data[MSG_TYPE]
                 piece = decoded_data[PIECE]
@@ -72,6 +81,12 @@ def mem_view_to_msg(msg_id: int, data: memoryview) -> Message:
                         raw_data[offset:])
                 elif message_type == ExtMetadataIDs.reject.value:
                     return ExtendedMetadataPieceReject(message_length, ext_id, piece)
+            elif ext_id == ExtIDs.pex.value:
+                added_flags = decoded_data.get(ADDED_F, b'')
+                return ExtendedPex(message_length, ext_id,
+                                   ExtendedPex.decode_peers(decoded_data.get(ADDED)),
+                                   added_flags if isinstance(added_flags, bytes) else b'',
+                                   ExtendedPex.decode_peers(decoded_data.get(DROPPED)))
     return Unknown(msg_id, bytes(data))
 
 
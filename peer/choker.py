@@ -0,0 +1,84 @@
+import asyncio
+import random
+from typing import Callable
+
+from misc import utils
+from peer.peer_base import PeerBase
+
+
+class Choker:
+    """
+    Tit-for-tat choking: decides which peers may download from us
+
+    Every __INTERVAL__ seconds the upload_slots interested peers with the best rate are unchoked, the rate is
+    the one they upload to us (download rate) or, when seeding, the one we upload to them.
+    Every __OPTIMISTIC_INTERVAL__ seconds one more random interested peer is unchoked optimistically,
+    so that new peers get a chance to show their rate. Every other peer is choked.
+    A peer that becomes interested while fewer than upload_slots peers are unchoked is unchoked at once,
+    rounds only rotate the peers by rate
+    """
+    __INTERVAL__ = 10.0
+    __OPTIMISTIC_INTERVAL__ = 30.0
+    __UPLOAD_SLOTS__ = 4
+
+    def __init__(self, peers: set[PeerBase], seeding: Callable[[], bool], upload_slots: int = __UPLOAD_SLOTS__):
+        self.peers = peers
+        self.seeding = seeding
+        self.upload_slots = upload_slots
+        self.optimistic: PeerBase | None = None
+        self._rounds: int = 0
+        self._last_bytes: dict[PeerBase, int] = {}
+
+    def _rates(self) -> dict[PeerBase, float]:
+        """
+        Bytes per second of every alive peer since the previous round
+        """
+        seeding = self.seeding()
+        rates: dict[PeerBase, float] = {}
+        last_bytes: dict[PeerBase, int] = {}
+        for peer in self.peers:
+            if not peer.alive():
+                continue
+            total = peer.uploaded_bytes if seeding else peer.downloaded_bytes
+            rates[peer] = (total - self._last_bytes.get(peer, total)) / self.__INTERVAL__
+            last_bytes[peer] = total
+        self._last_bytes = last_bytes
+        return rates
+
+    def rechoke(self):
+        rates = self._rates()
+        interested = [peer for peer in rates if peer.is_interested()]
+        interested.sort(key=lambda peer: rates[peer], reverse=True)
+        unchoked = set(interested[:self.upload_slots])
+
+        rotate = self._rounds % round(self.__OPTIMISTIC_INTERVAL__ / self.__INTERVAL__) == 0
+        if rotate or self.optimistic not in rates or not self.optimistic.is_interested():
+            candidates = [peer for peer in interested if peer not in unchoked]
+            self.optimistic = random.choice(candidates) if candidates else None
+        if self.optimistic:
+            unchoked.add(self.optimistic)
+        self._rounds += 1
+
+        for peer in rates:
+            if peer in unchoked:
+                peer.unchoke()
+            else:
+                peer.choke()
+
+    def on_interested(self, peer: PeerBase):
+        """
+        Unchokes a newly interested peer if an upload slot is free
+        """
+        if not peer.is_choked() or not peer.alive():
+            return
+        unchoked = sum(
+            1 for other in self.peers if other.alive() and not other.is_choked() and other is not self.optimistic
+        )
+        if unchoked < self.upload_slots:
+            peer.unchoke()
+
+    async def run(self, stop: asyncio.Event):
+        while True:
+            self.rechoke()
+            if await utils.run_with_timeout(stop.wait(), self.__INTERVAL__):
+                break
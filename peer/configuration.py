@@ -6,6 +6,9 @@ class Timeouts:
     # Number of seconds until a request is timed-out (not responded)
     Request: float = 10.0
 
+    # Number of seconds to wait for a tcp connection to a peer
+    Connect: float = 10.0
+
     # Number of seconds to wait for handshake
     Handshake: float = 12.0
 
@@ -18,6 +21,15 @@ class Timeouts:
     # Wait at most this number of seconds to print progress
     Progress: float = 1.0
 
+    # Number of seconds between saves of fast-resume data
+    ResumeData: float = 60.0
+
+    # Have messages of pieces completed within this number of seconds are sent together (0.0 sends them immediately)
+    HaveBatch: float = 0.0
+
+    # Number of seconds between Peer Exchange messages to a peer (BEP 11 allows one per minute)
+    Pex: float = 60.0
+
 
 @dataclasses.dataclass
 class Punishments:
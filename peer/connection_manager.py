@@ -0,0 +1,174 @@
+import asyncio
+import contextlib
+import dataclasses
+import time
+from asyncio import Task
+from typing import Callable
+
+from misc import utils
+from peer.configuration import Timeouts
+from peer.peer_base import PeerBase
+from peer.peer_info import PeerInfo
+
+
+@dataclasses.dataclass(eq=False)
+class Candidate:
+    """
+    An address we may connect to. score is the number of bytes its past connections transferred,
+    next_attempt is the (monotonic) time before which it is not connected to
+    """
+    peer_info: PeerInfo
+    score: int = 0
+    failures: int = 0
+    next_attempt: float = 0.0
+    connected: bool = False
+
+    def backoff(self, base: float, max_backoff: float):
+        """
+        One more failure, the next attempt is base * 2 ** (failures - 1) seconds from now (at most max_backoff)
+        """
+        self.failures += 1
+        self.next_attempt = time.monotonic() + min(base * 2 ** (self.failures - 1), max_backoff)
+
+
+class ConnectionManager:
+    """
+    Candidate pool of a torrent: peers learned from trackers, the DHT and Peer Exchange wait here until
+    the torrent has room for them (see room). The best candidates are connected first: the ones that transferred
+    the most, then the ones that failed the least.
+
+    At most __MAX_HALF_OPEN__ connects of the torrent are in progress at a time, half_open limits
+    the connects of every torrent of a session together. Candidates that can not be connected are retried
+    after __BACKOFF_BASE__ * 2 ** (failures - 1) seconds (up to __MAX_BACKOFF__) and forgotten after
+    __MAX_FAILURES__ failures. Peers whose connection drops after they transferred data are reconnected
+    after __RECONNECT_DELAY__ seconds
+    """
+    __MAX_CANDIDATES__ = 2000
+    __MAX_HALF_OPEN__ = 8
+    __MAX_FAILURES__ = 5
+    __BACKOFF_BASE__ = 30.0
+    __MAX_BACKOFF__ = 1800.0
+    __RECONNECT_DELAY__ = 5.0
+    # room of the torrent may grow without a wake up (max peers of a session), it is checked at least this often
+    __MAX_SLEEP__ = 5.0
+
+    def __init__(self, create_peer: Callable[[PeerInfo], PeerBase | None], run_peer: Callable[[PeerBase], None],
+                 room: Callable[[], int], half_open: asyncio.Semaphore | None = None):
+        """
+        create_peer returns a new peer (None if the torrent refuses it), run_peer runs a connected peer,
+        room is the number of connections the torrent can still open
+        """
+        self.create_peer = create_peer
+        self.run_peer = run_peer
+        self.room = room
+        self.half_open = half_open
+        self.candidates: dict[PeerInfo, Candidate] = {}
+        self._connecting: set[Task] = set()
+        self._wake_up: asyncio.Event = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self.candidates)
+
+    def add(self, peer_info: PeerInfo) -> bool:
+        """
+        Adds a candidate, returns False if it is known already or the pool is full
+        """
+        if peer_info in self.candidates or len(self.candidates) >= self.__MAX_CANDIDATES__ or not peer_info.port:
+            return False
+        self.candidates[peer_info] = Candidate(peer_info)
+        self._wake_up.set()
+        return True
+
+    def _backoff(self, candidate: Candidate):
+        candidate.backoff(self.__BACKOFF_BASE__, self.__MAX_BACKOFF__)
+        if candidate.failures >= self.__MAX_FAILURES__:
+            del self.candidates[candidate.peer_info]
+
+    def on_peer_connected(self, address: PeerInfo):
+        """
+        Called when a peer that connected to us told its listen address: it is not connected to while it is connected
+        """
+        if address in self.candidates or self.add(address):
+            self.candidates[address].connected = True
+
+    def on_peer_closed(self, peer: PeerBase):
+        """
+        Called when the connection of a peer is over (ours or accepted). Peers that transferred data are reconnected
+        soon, peers that did not complete the handshake back off
+        """
+        if (address := peer.listen_address()) is None:
+            return
+        if not (candidate := self.candidates.get(address)):
+            if not peer.incoming or not self.add(address):
+                return
+            candidate = self.candidates[address]
+        candidate.connected = False
+        transferred = peer.downloaded_bytes + peer.uploaded_bytes
+        candidate.score += transferred
+        if peer.is_handshaken() and transferred:
+            candidate.failures = 0
+            candidate.next_attempt = time.monotonic() + self.__RECONNECT_DELAY__
+        else:
+            self._backoff(candidate)
+        self._wake_up.set()
+
+    def _best_candidates(self, count: int) -> list[Candidate]:
+        now = time.monotonic()
+        ready = (
+            candidate for candidate in self.candidates.values()
+            if not candidate.connected and candidate.next_attempt <= now
+        )
+        return sorted(ready, key=lambda candidate: (-candidate.score, candidate.failures))[:count]
+
+    async def _connect(self, candidate: Candidate):
+        """
+        Connects within the half-open limit, the connected peer is run by the torrent
+        """
+        if not (peer := self.create_peer(candidate.peer_info)):
+            # refused (mostly because it is connected already), it is not a failure of the candidate
+            candidate.connected = False
+            candidate.next_attempt = time.monotonic() + self.__BACKOFF_BASE__
+            return
+        try:
+            async with self.half_open or contextlib.nullcontext():
+                async with asyncio.timeout(Timeouts.Connect):
+                    connected = await peer.create_tcp_connection()
+        except TimeoutError:
+            connected = False
+        if connected:
+            self.run_peer(peer)
+        else:
+            candidate.connected = False
+            self._backoff(candidate)
+
+    def _on_connect_done(self, task: Task):
+        self._connecting.discard(task)
+        self._wake_up.set()
+
+    def _next_delay(self) -> float:
+        """
+        Seconds until the next candidate is ready to be connected
+        """
+        now = time.monotonic()
+        waiting = [candidate.next_attempt - now for candidate in self.candidates.values() if not candidate.connected]
+        return max(0.0, min(waiting + [self.__MAX_SLEEP__]))
+
+    async def run(self, stop: asyncio.Event):
+        """
+        Connects the best candidates whenever the torrent has room for them
+        """
+        try:
+            while not stop.is_set():
+                self._wake_up.clear()
+                count = min(self.room(), self.__MAX_HALF_OPEN__) - len(self._connecting)
+                best = self._best_candidates(count) if count > 0 else []
+                for candidate in best:
+                    candidate.connected = True
+                    task = asyncio.create_task(self._connect(candidate), name=f'Connect {candidate.peer_info.ip}')
+                    self._connecting.add(task)
+                    task.add_done_callback(self._on_connect_done)
+                # without room ready candidates wait for a wake up (connect done, peer closed, new candidate)
+                delay = self._next_delay() if count > len(best) else self.__MAX_SLEEP__
+                await utils.run_with_timeout(self._wake_up.wait(), delay)
+        finally:
+            await utils.cancel_tasks(set(self._connecting))
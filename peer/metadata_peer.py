@@ -0,0 +1,129 @@
+import asyncio
+
+from messages import Message, Handshake
+from messages.extended import ExtendedHandshake, ExtendedMetadataPieceRequest, ExtendedMetadataPieceResponse, \
+    ExtendedMetadataPieceReject
+from messages.ids import ExtIDs
+from misc import utils
+from peer.configuration import Timeouts
+from peer.peer_info import PeerInfo
+from peer.peer_protocol import PeerProtocol
+
+
+# noinspection PyBroadException
+class MetadataPeer:
+    """
+    Short-lived connection that only downloads metadata pieces from a peer (BEP 9), see MetadataFetcher
+
+    After the handshakes at most __MAX_REQUESTS__ pieces are requested at a time, a new one every time a piece
+    arrives. The connection is closed when the metadata is complete, when the peer does not have the metadata
+    or rejects a request, when it does not respond within Timeouts.Request seconds
+    or after Timeouts.Metadata seconds in total
+    """
+    __MAX_REQUESTS__ = 2
+
+    def __init__(self, peer_info: PeerInfo, fetcher: 'MetadataFetcher'):
+        self._peer_info = peer_info
+        self._fetcher = fetcher
+        self._transport: asyncio.Transport | None = None
+        self._protocol: PeerProtocol | None = None
+        self._peer_uid: int | None = None
+        self._metadata_size: int = 0
+        self._requests: set[int] = set()
+        self._idle_handle: asyncio.TimerHandle | None = None
+
+    def __repr__(self):
+        return f"{self._peer_info.ip} : {self._peer_info.port} | metadata"
+
+    @property
+    def peer_info(self) -> PeerInfo:
+        return self._peer_info
+
+    async def run(self):
+        try:
+            async with asyncio.timeout(Timeouts.Handshake):
+                self._transport, self._protocol = await asyncio.get_running_loop().create_connection(
+                    lambda: PeerProtocol(self._on_message), self._peer_info.ip, self._peer_info.port
+                )
+        except Exception:
+            return
+        try:
+            reserved = bytearray(int(0).to_bytes(8))
+            reserved[5] = 0x10
+            self._send(Handshake(self._fetcher.info_hash, self._fetcher.self_id, reserved=reserved))
+            self._send(ExtendedHandshake(0, ExtIDs.handshake.value, ExtIDs.metadata.value, None))
+            self._reset_idle_timer(Timeouts.Handshake)
+            await utils.run_with_timeout(asyncio.shield(self._protocol.closed), Timeouts.Metadata)
+        finally:
+            self.close()
+            if self._idle_handle:
+                self._idle_handle.cancel()
+            requests, self._requests = self._requests, set()
+            for piece in requests:
+                self._fetcher.request_failed(piece)
+
+    def close(self):
+        if self._transport and not self._transport.is_closing():
+            self._transport.close()
+
+    def _send(self, msg: Message):
+        if self._transport and not self._transport.is_closing():
+            self._transport.write(msg.to_bytes())
+
+    def _reset_idle_timer(self, timeout: float):
+        if self._idle_handle:
+            self._idle_handle.cancel()
+        self._idle_handle = asyncio.get_running_loop().call_later(timeout, self._on_idle)
+
+    def _on_idle(self):
+        """
+        Peers that did not send their extended handshake or do not respond to requests are dropped,
+        peers that wait for pieces to become available are kept
+        """
+        if self._peer_uid is None or self._requests:
+            self.close()
+        else:
+            self._reset_idle_timer(Timeouts.Request)
+
+    def _on_message(self, msg: Message) -> bool:
+        if isinstance(msg, Handshake):
+            if msg.info_hash != self._fetcher.info_hash or not msg.reserved[5] & 0x10:
+                self.close()
+                return False
+        elif isinstance(msg, ExtendedHandshake):
+            if not msg.metadata_uid or not msg.metadata_size:
+                self.close()
+                return False
+            self._peer_uid, self._metadata_size = msg.metadata_uid, msg.metadata_size
+            self.request_pieces()
+        elif isinstance(msg, ExtendedMetadataPieceResponse):
+            if msg.piece in self._requests:
+                self._requests.discard(msg.piece)
+                self._fetcher.on_piece(self, msg.piece, msg.metadata_part)
+                self.request_pieces()
+        elif isinstance(msg, ExtendedMetadataPieceReject):
+            if msg.piece in self._requests:
+                self._requests.discard(msg.piece)
+                self._fetcher.request_failed(msg.piece)
+            self.close()
+        elif isinstance(msg, ExtendedMetadataPieceRequest) and self._peer_uid:
+            # we do not have the metadata yet
+            self._send(ExtendedMetadataPieceReject(0, self._peer_uid, msg.piece))
+        return True
+
+    def request_pieces(self):
+        """
+        Requests pieces that the fetcher still needs, up to __MAX_REQUESTS__ outstanding pieces
+        """
+        if self._peer_uid is None or not self._transport or self._transport.is_closing():
+            return
+        if not self._fetcher.set_size(self._metadata_size):
+            self.close()
+            return
+        while len(self._requests) < self.__MAX_REQUESTS__:
+            piece = self._fetcher.next_piece(self._requests)
+            if piece is None:
+                break
+            self._requests.add(piece)
+            self._send(ExtendedMetadataPieceRequest(0, self._peer_uid, piece))
+        self._reset_idle_timer(Timeouts.Request)
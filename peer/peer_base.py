@@ -1,36 +1,88 @@
 import asyncio
 import datetime
 import time
-from asyncio import CancelledError
+from typing import Any, Callable, Iterable
 
 import bencdec
 from file_handling.file_handler import FileHandler
 from messages import Message, Bitfield, Interested, NotInterested, Choke, Unchoke, Piece, Have, Request, Unknown, \
     Handshake, Cancel, Keepalive
+from messages.extended import ExtendedHandshake, ExtendedMetadataPieceRequest, ExtendedMetadataPieceResponse, \
+    ExtendedMetadataPieceReject, ExtendedPex
 from messages.extended.extended import Extended
+from messages.ids import ExtIDs
 from misc import utils
+from misc.rate_limiter import TokenBucket
+from misc.timer_wheel import TimerWheel, Timer
 from peer.configuration import Timeouts
 from peer.peer_info import PeerInfo
+from peer.pipeline import Pipeline
 from peer.score import Score
 from peer.status_events import StatusEvents
 from piece_handling.active_piece import ActivePiece
 from piece_handling.active_request import ActiveRequest
+from piece_handling.piece_picker import PiecePicker
+from torrent.metadata import Metadata
 
 
 class PeerBase:
-
-    def __init__(self, peer_info: PeerInfo, bitfield_len: int, file_handler: FileHandler):
+    # Peer Exchange (BEP 11): at most this number of added / dropped peers per message,
+    # messages of the peer that come sooner than __PEX_MIN_INTERVAL__ seconds after the previous one are ignored
+    __PEX_MAX_PEERS__ = 50
+    __PEX_MIN_INTERVAL__ = 45.0
+
+    def __init__(self, peer_info: PeerInfo, bitfield_len: int, file_handler: FileHandler, piece_picker: PiecePicker,
+                 timer_wheel: TimerWheel, download_limiter: TokenBucket | None = None,
+                 upload_limiter: TokenBucket | None = None,
+                 on_pex: Callable[[dict[PeerInfo, int]], Any] | None = None,
+                 on_upload: Callable[[int], Any] | None = None,
+                 on_listen_address: Callable[['PeerBase'], Any] | None = None,
+                 on_wasted: Callable[[int], Any] | None = None,
+                 on_interested: Callable[['PeerBase'], Any] | None = None):
+        """
+        on_pex receives the peers (and their flags) that the peer tells us about with Peer Exchange,
+        Peer Exchange is not supported if it is None. on_upload receives the length of every block we sent,
+        on_listen_address is called once a peer that connected to us told its listen port (see listen_address),
+        on_wasted receives the length of every duplicate block of endgame mode,
+        on_interested is called when the peer becomes interested in our pieces
+        """
         self._score: Score = Score()
-        self._grabbed_active_requests: set[ActiveRequest] = set()
+        self._pipeline: Pipeline = Pipeline()
+        self._grabbed_active_requests: dict[tuple[int, int, int], ActiveRequest] = {}
+        self._superseded_requests: set[tuple[int, int, int]] = set()
+        self._upload_tasks: set[asyncio.Task] = set()
         self._status = StatusEvents()
         self._file_handler = file_handler
+        self._piece_picker = piece_picker
+        self._timer_wheel = timer_wheel
+        self._keepalive_timer: Timer | None = None
+        # per peer limits, parents are the limits of the torrent
+        self.download_limiter: TokenBucket = TokenBucket(parent=download_limiter)
+        self.upload_limiter: TokenBucket = TokenBucket(parent=upload_limiter)
         self._last_tx_time = 0.0
+        self.downloaded_bytes: int = 0
+        self.uploaded_bytes: int = 0
+        self._outbox: list[bytes] = []
         self._bitfield: Bitfield = Bitfield(bytes(bitfield_len))
         self._ready_for_requests: asyncio.Event = asyncio.Event()
         self._dead: asyncio.Event = asyncio.Event()
         self._peer_id_str: str = peer_info.peer_id_tracker.decode(encoding='ascii', errors='ignore')
         self._peer_info: PeerInfo = peer_info
         self._self_report_name: bytes = bytes()
+        self._handshake_sent: bool = False
+        self._supports_extensions: bool = False
+        self._peer_metadata_uid: int | None = None
+        self._on_pex = on_pex
+        self._on_upload = on_upload
+        self._on_listen_address = on_listen_address
+        self._on_wasted = on_wasted
+        self._on_interested = on_interested
+        self._peer_pex_uid: int | None = None
+        self._peer_listen_port: int | None = None
+        self._pex_sent: set[PeerInfo] = set()
+        self._last_pex_received: float = 0.0
+        # True if the peer connected to us
+        self.incoming: bool = False
         self.extended_dict: dict = dict()
 
     def __repr__(self):
@@ -65,124 +117,304 @@ class PeerBase:
             return True
         if isinstance(msg, Unchoke):
             self._status.am_not_choked.set()
-            self.send(Unchoke())
         elif isinstance(msg, Choke):
             self._status.am_not_choked.clear()
-            self.send(Choke())
         elif isinstance(msg, Interested):
+            interested = self.is_interested()
             self._status.am_interesting.set()
+            if not interested and self._on_interested:
+                self._on_interested(self)
         elif isinstance(msg, NotInterested):
             self._status.am_interesting.clear()  # lol
         elif isinstance(msg, Bitfield):
             if self._bitfield.message_length != msg.message_length:
                 return False
             else:
+                self._piece_picker.remove_peer_bitfield(self, self._bitfield)
                 self._bitfield = Bitfield(msg.data)
+                self._piece_picker.add_peer_bitfield(self, self._bitfield)
                 self.send(Interested())
         elif isinstance(msg, Have):
-            self._bitfield.set_bit_value(msg.piece_index, True)
+            if not self.has_piece(msg.piece_index):
+                self._bitfield.set_bit_value(msg.piece_index, True)
+                self._piece_picker.add_peer_have(self, msg.piece_index)
         elif isinstance(msg, Request):
-            response: Piece = self._file_handler.read_piece(msg.index, msg.begin, msg.data_length)
-            self.send(response)
+            if self.is_choked():
+                # requests of choked peers are rejected (dropped, the fast extension is not supported)
+                return True
+            upload_task = asyncio.create_task(self._serve_request(msg))
+            self._upload_tasks.add(upload_task)
+            upload_task.add_done_callback(self._upload_tasks.discard)
         elif isinstance(msg, Unknown):
             return False
         elif isinstance(msg, Piece):
+            self.downloaded_bytes += len(msg.block)
             request = self._find_matching_request(msg)
-            if request:
-                self._file_handler.write_piece(msg.index, msg.begin, msg.block)
-                request.completed.set()
+            if request and request.active_piece.block_received(request):
+                request.active_piece.write_block(msg.begin, msg.block)
+                self._on_request_completed(request)
+            elif request or self._superseded_requests:
+                self._handle_duplicate_block(msg, request)
+        elif isinstance(msg, ExtendedHandshake):
+            self._pipeline.set_max_window(msg.reqq)
+            self._peer_metadata_uid = msg.metadata_uid
+            self._peer_pex_uid = msg.pex_uid if self._on_pex else None
+            self._peer_listen_port = msg.port
+            if self.incoming and msg.port and self._on_listen_address:
+                self._on_listen_address(self)
+        elif isinstance(msg, ExtendedMetadataPieceRequest):
+            self._serve_metadata_request(msg.piece)
+        elif isinstance(msg, ExtendedPex):
+            self._handle_pex(msg)
         elif isinstance(msg, Extended):
             self.extended_dict = bencdec.decode(msg.raw_data)
         elif isinstance(msg, Handshake):
             self._status.handshake.set()
             self._self_report_name = msg.peer_id
+            self._supports_extensions = bool(msg.reserved[5] & 0x10)
         self._update_ready_for_requests()
         return True
 
+    async def _serve_request(self, request: Request):
+        """
+        Reads the requested block from disk (off the event loop) and sends it, unless the peer was choked meanwhile
+        """
+        response: Piece | None = await self._file_handler.read_piece(request.index, request.begin, request.data_length)
+        if not response:
+            return
+        await self.upload_limiter.wait(len(response.block))
+        if not self.is_choked() and self.send(response):
+            self.uploaded_bytes += len(response.block)
+            if self._on_upload:
+                self._on_upload(len(response.block))
+
+    def _serve_metadata_request(self, piece: int):
+        """
+        Sends a piece of the info dictionary to a peer that downloads the metadata (BEP 9)
+        """
+        if not self._peer_metadata_uid:
+            return
+        metadata = self._file_handler.metadata.encoded_info_data
+        begin = piece * Metadata.__METADATA_PIECE_SIZE__
+        if 0 <= begin < len(metadata):
+            self.send(ExtendedMetadataPieceResponse(
+                0, self._peer_metadata_uid, piece, len(metadata),
+                metadata[begin: begin + Metadata.__METADATA_PIECE_SIZE__]
+            ))
+        else:
+            self.send(ExtendedMetadataPieceReject(0, self._peer_metadata_uid, piece))
+
+    def _handle_pex(self, msg: ExtendedPex):
+        """
+        Passes the added peers to on_pex, dropped peers are ignored (they may still be reachable).
+        Peers that send Peer Exchange messages too often or too large ones are not listened to
+        """
+        now = time.monotonic()
+        if not self._on_pex or now - self._last_pex_received < self.__PEX_MIN_INTERVAL__:
+            return
+        self._last_pex_received = now
+        added = msg.added[:self.__PEX_MAX_PEERS__]
+        flags = msg.added_flags.ljust(len(added), b'\0')
+        self._on_pex({PeerInfo(ip, port): flags[i] for i, (ip, port) in enumerate(added) if port})
+
+    def listen_address(self) -> PeerInfo | None:
+        """
+        The address where other peers can connect to the peer: the one we connected to,
+        or the listen port of its extended handshake if it connected to us. None if it is not known
+        """
+        if not self.incoming:
+            return self._peer_info
+        if self._peer_listen_port:
+            return PeerInfo(self._peer_info.ip, self._peer_listen_port)
+        return None
+
+    def peer_id(self) -> bytes:
+        """
+        The peer id of the peer's handshake, empty until it arrives
+        """
+        return self._self_report_name
+
+    def is_seed(self) -> bool:
+        piece_count = self._file_handler.metadata.piece_count
+        return int.from_bytes(self._bitfield.data, byteorder="big").bit_count() == piece_count
+
+    def pex_flags(self) -> int:
+        """
+        Flags of the peer in our Peer Exchange messages: seed and reachable (we connected to it)
+        """
+        return (ExtendedPex.__SEED__ if self.is_seed() else 0) | (0 if self.incoming else ExtendedPex.__REACHABLE__)
+
+    def send_pex(self, connected: dict[PeerInfo, int]) -> bool:
+        """
+        Tells the peer which of the connected peers (listen addresses and their flags) were added / dropped
+        since the previous message, at most __PEX_MAX_PEERS__ of each. Must not be called more than once per minute.
+        Peers that ExtendedPex does not support (IPv6) are left out
+        """
+        if not self._peer_pex_uid:
+            return False
+        own_address = self.listen_address()
+        added = [
+            peer_info for peer_info in connected
+            if peer_info not in self._pex_sent and peer_info != own_address and ExtendedPex.is_supported(peer_info.ip)
+        ]
+        dropped = [peer_info for peer_info in self._pex_sent if peer_info not in connected]
+        added, dropped = added[:self.__PEX_MAX_PEERS__], dropped[:self.__PEX_MAX_PEERS__]
+        if not added and not dropped:
+            return False
+        if not self.send(ExtendedPex(
+            0, self._peer_pex_uid, [(peer_info.ip, peer_info.port) for peer_info in added],
+            bytes(connected[peer_info] for peer_info in added), [(peer_info.ip, peer_info.port) for peer_info in dropped]
+        )):
+            return False
+        self._pex_sent.difference_update(dropped)
+        self._pex_sent.update(added)
+        return True
+
     def _find_matching_request(self, piece: Piece) -> ActiveRequest | None:
         """
         When a piece is received this functions finds the relevant active_request from self._grabbed_active_requests
         """
-        for req in self._grabbed_active_requests:
-            if piece.index == req.index and piece.begin == req.begin and len(piece.block) == req.data_length:
-                return req
-        return None
+        return self._grabbed_active_requests.get((piece.index, piece.begin, len(piece.block)))
+
+    def _handle_duplicate_block(self, piece: Piece, request: ActiveRequest | None):
+        """
+        Endgame mode: the block was already received from another peer, count it as wasted
+        """
+        if request is None:
+            key = (piece.index, piece.begin, len(piece.block))
+            if key not in self._superseded_requests:
+                return
+            self._superseded_requests.discard(key)
+        else:
+            self._grabbed_active_requests.pop(request.key, None)
+        if self._on_wasted:
+            self._on_wasted(len(piece.block))
+
+    def on_piece_completed(self, index: int):
+        """
+        Blocks of a completed piece that were cancelled are not expected any more
+        (peers that honour Cancel never send them)
+        """
+        if self._superseded_requests:
+            self._superseded_requests = {key for key in self._superseded_requests if key[0] != index}
 
     def _update_ready_for_requests(self):
         """
         Checks if it is ok to send a request to the peer
         """
-        if self._status.ok_for_request() and self.active_request_count() < 8 and self.alive():
+        if self._status.ok_for_request() and self.active_request_count() < self._pipeline.window and self.alive():
             self._ready_for_requests.set()
         else:
             self._ready_for_requests.clear()
 
-    async def _wait_for_response(self, active_request: ActiveRequest, timeout: float) -> bool:
+    def _on_request_completed(self, active_request: ActiveRequest):
         """
-        Waits for active_request to be responded
+        The block of active_request landed. Response times feed the pipeline that sizes the window of outstanding requests
         """
-        try:
-            async with asyncio.timeout(timeout):
-                await active_request.completed.wait()
-            active_request.on_success()
-        except Exception as e:
-            active_request.on_failure()
-            self.send(
-                Cancel(
-                    active_request.request.index,
-                    active_request.request.begin,
-                    active_request.request.data_length
-                )
-            )
-            print(f"{self} - _wait_for_response: {type(e).__name__} - {e} - {datetime.datetime.now()} - {self._score.calculate()}")
-        self._grabbed_active_requests.discard(active_request)
+        active_request.timer.cancel()
+        active_request.on_success()
+        self._pipeline.on_response(
+            active_request.data_length, time.monotonic() - active_request.sent_time, self.active_request_count()
+        )
+        self._grabbed_active_requests.pop(active_request.key, None)
+        self._score.update(True)
         self._update_ready_for_requests()
-        self._score.update(active_request.completed.is_set())
-        return active_request.completed.is_set()
-
-    async def _keep_alive(self):
-        print(f"{self} - _keep_alive - started")
-        while True:
-            non_tx_time = time.time() - self._last_tx_time
-            if non_tx_time >= Timeouts.Keepalive:
-                self.send(Keepalive())
-                non_tx_time = 0
-            time_to_sleep = Timeouts.Keepalive - non_tx_time
-            try:
-                await asyncio.sleep(time_to_sleep)
-            except CancelledError:
-                break
-        print(f"{self} - _keep_alive - stopped")
+
+    def _on_request_timeout(self, active_request: ActiveRequest):
+        """
+        Called by the timer wheel when active_request was not responded in time
+        """
+        if self._grabbed_active_requests.get(active_request.key) is not active_request:
+            return
+        self._pipeline.on_timeout()
+        self._fail_request(active_request)
+        print(f"{self} - _on_request_timeout - {datetime.datetime.now()} - {self._score.calculate()}")
+
+    def _fail_request(self, active_request: ActiveRequest):
+        active_request.timer.cancel()
+        active_request.on_failure()
+        self.send(Cancel(active_request.index, active_request.begin, active_request.data_length))
+        self._grabbed_active_requests.pop(active_request.key, None)
+        self._score.update(False)
+        self._update_ready_for_requests()
+
+    def on_request_superseded(self, active_request: ActiveRequest):
+        """
+        Another peer delivered the block first (endgame mode), send Cancel.
+        The peer may already be sending the block, so remember it in order to count it as wasted
+        """
+        if self._grabbed_active_requests.get(active_request.key) is not active_request:
+            return
+        active_request.timer.cancel()
+        self.send(Cancel(active_request.index, active_request.begin, active_request.data_length))
+        self._superseded_requests.add(active_request.key)
+        self._grabbed_active_requests.pop(active_request.key, None)
+        self._score.update(True)
+        self._update_ready_for_requests()
+
+    def _on_keepalive_timer(self):
+        """
+        Sends a Keepalive if nothing was sent for Timeouts.Keepalive seconds and schedules the next check
+        """
+        if not self.alive():
+            return
+        non_tx_time = time.time() - self._last_tx_time
+        if non_tx_time >= Timeouts.Keepalive:
+            self.send(Keepalive())
+            non_tx_time = 0
+        self._keepalive_timer = self._timer_wheel.schedule(Timeouts.Keepalive - non_tx_time, self._on_keepalive_timer)
 
     def get_score_value(self) -> float:
         return self._score.calculate()
 
-    async def run_till_dead(self, handshake: Handshake):
+    def send_handshake(self, handshake: Handshake, bitfield: Bitfield) -> bool:
+        """
+        Sends our handshake followed by our bitfield, only the first call sends them
+        """
+        if not self._handshake_sent:
+            self._handshake_sent = self.send(handshake) and self.send(bitfield)
+        return self._handshake_sent
+
+    async def run_till_dead(self, handshake: Handshake, bitfield: Bitfield, listen_port: int = 0):
         """
         Initiates a peer connection, sends bitfield and performs handshake and waits until connection is dead
+        listen_port (if known) is sent in the extended handshake, peers pass it on with Peer Exchange
         """
         # try to create a connection
         if not await self.create_tcp_connection():
             return
 
         # send handshake and bitfield
-        if not self.send(handshake):
-            return
-        if not self.send(self._bitfield):
+        if not self.send_handshake(handshake, bitfield):
             return
 
         # wait for handshake and terminate if timeout occurs
         if not await utils.run_with_timeout(self.wait_for_handshake(), Timeouts.Handshake):
             await self.close()
+        elif self._supports_extensions:
+            # metadata_size lets peers that only know the info hash download the metadata from us
+            self.send(ExtendedHandshake(
+                0, ExtIDs.handshake.value, ExtIDs.metadata.value, len(self._file_handler.metadata.encoded_info_data),
+                pex_uid=ExtIDs.pex.value if self._on_pex else None, port=listen_port or None
+            ))
 
-        keep_alive_task = asyncio.create_task(self._keep_alive())
+        self._on_keepalive_timer()
 
         await self._dead.wait()
-        keep_alive_task.cancel()
-
-    def grab_request(self, active_pieces: list[ActivePiece]) -> ActiveRequest | None:
+        # readiness waiters wake up and find the peer dead, so the torrent forgets them
+        self._ready_for_requests.set()
+        if self._keepalive_timer:
+            self._keepalive_timer.cancel()
+        # outstanding requests can not be responded any more, give them back to other peers
+        for active_request in list(self._grabbed_active_requests.values()):
+            self._fail_request(active_request)
+        self._piece_picker.remove_peer_bitfield(self, self._bitfield)
+        self._bitfield = Bitfield(bytes(len(self._bitfield.data)))
+
+    def grab_request(self, active_pieces: Iterable[ActivePiece], endgame: bool = False) -> ActiveRequest | None:
         """
         Given the list of active pieces, grabs a request that can be served by this peer.
+        In endgame mode, if there is no request in queue, a request that is in flight on another peer is duplicated.
         Once the request is completed / failed, on_success / on_failure must be called on the request
         Returns an ActiveRequest or None
         """
@@ -192,34 +424,54 @@ class PeerBase:
             if not (active_request := ActiveRequest.from_active_piece(active_piece)):
                 continue
             return active_request
+        if not endgame:
+            return None
+        for active_piece in active_pieces:
+            if not self.has_piece(active_piece.piece_info.index):
+                continue
+            active_request = ActiveRequest.duplicate_from_active_piece(active_piece, self._grabbed_active_requests)
+            if not active_request:
+                continue
+            return active_request
         return None
 
     def perform_request(self, active_request: ActiveRequest, timeout: float) -> bool:
         """
-        Sends a request, creates a task that waits for the response
+        Sends a request, its timeout is tracked by the timer wheel
         ActiveRequest object is properly updated / handled
         """
-        if not self.check_if_ready_now():
+        if not self.check_if_ready_now() or not self.download_limiter.try_consume(active_request.data_length):
             active_request.on_failure()
             return False
-        if result := self.send(active_request.request):
-            self._grabbed_active_requests.add(active_request)
-            self._update_ready_for_requests()
-        asyncio.create_task(self._wait_for_response(active_request, timeout))
-        return result
+        if not self._grabbed_active_requests:
+            self._pipeline.on_idle()
+        if not self.send(active_request.request):
+            active_request.on_failure()
+            return False
+        active_request.sent_time = time.monotonic()
+        active_request.peer = self
+        active_request.timer = self._timer_wheel.schedule(timeout, self._on_request_timeout, active_request)
+        self._superseded_requests.discard(active_request.key)
+        self._grabbed_active_requests[active_request.key] = active_request
+        self._update_ready_for_requests()
+        return True
 
-    def grab_and_perform_a_request(self, active_pieces: list[ActivePiece], timeout: float) -> bool:
+    def grab_and_perform_a_request(self, active_pieces: Iterable[ActivePiece], timeout: float,
+                                   endgame: bool = False) -> bool:
         """
         Given the active pieces, grabs an active request (if available) and performs it.
         Handles both success and failure.
         Return true if a request was sent, false otherwise
         """
-        active_request: ActiveRequest = self.grab_request(active_pieces)
+        active_request: ActiveRequest = self.grab_request(active_pieces, endgame)
         if not active_request:
             return False
         return self.perform_request(active_request, timeout)
 
     def send(self, msg: Message) -> bool:
+        """
+        Queues msg in the outbox. Messages queued during one iteration of the event loop are written together
+        """
         if not self.alive():
             return False
         if isinstance(msg, Interested):
@@ -232,7 +484,18 @@ class PeerBase:
             self._status.am_not_choking.set()
         self._last_tx_time = time.time()
         self._update_ready_for_requests()
-        return self.send_bytes(msg.to_bytes())
+        self._outbox.append(msg.to_bytes())
+        if len(self._outbox) == 1:
+            asyncio.get_running_loop().call_soon(self._flush_outbox)
+        return True
+
+    def _flush_outbox(self):
+        """
+        Writes every queued message with a single write
+        """
+        outbox, self._outbox = self._outbox, []
+        if outbox and self.alive():
+            self.send_bytes(outbox)
 
     async def punishment(self, duration: float = -1.0):
         """
@@ -243,6 +506,26 @@ class PeerBase:
             duration = self.get_score_value()
         await asyncio.sleep(duration)
 
+    def is_choked(self) -> bool:
+        """
+        True if we choke the peer (its requests are not served)
+        """
+        return not self._status.am_not_choking.is_set()
+
+    def is_interested(self) -> bool:
+        """
+        True if the peer is interested in our pieces
+        """
+        return self._status.am_interesting.is_set()
+
+    def choke(self):
+        if not self.is_choked():
+            self.send(Choke())
+
+    def unchoke(self):
+        if self.is_choked():
+            self.send(Unchoke())
+
     def has_piece(self, index: int) -> bool:
         return self._bitfield.get_bit_value(index) != 0
 
@@ -251,8 +534,17 @@ class PeerBase:
             await asyncio.sleep(delay)
         await self.punishment()
         await self._ready_for_requests.wait()
+        await self.download_limiter.wait_available()
+        # backpressure: no new requests while too much data waits to be written to disk
+        await self._file_handler.wait_writable()
         return self
 
+    def is_download_limited(self) -> bool:
+        """
+        True if requests are held back by the download rate limit
+        """
+        return self.download_limiter.delay() > 0
+
     def check_if_ready_now(self) -> bool:
         self._update_ready_for_requests()
         return self._ready_for_requests.is_set()
@@ -260,6 +552,15 @@ class PeerBase:
     async def wait_for_handshake(self):
         await self._status.handshake.wait()
 
+    def is_handshaken(self) -> bool:
+        return self._status.handshake.is_set()
+
+    def request_window(self) -> int:
+        """
+        Number of requests that may be outstanding on the peer, see Pipeline
+        """
+        return self._pipeline.window
+
     def active_request_count(self) -> int:
         return len(self._grabbed_active_requests)
 
@@ -272,5 +573,5 @@ class PeerBase:
     async def create_tcp_connection(self) -> bool:
         raise NotImplementedError()
 
-    def send_bytes(self, data: bytes) -> bool:
+    def send_bytes(self, chunks: list[bytes]) -> bool:
         raise NotImplementedError()
\ No newline at end of file
@@ -0,0 +1,91 @@
+import asyncio
+
+from messages import Message, Handshake
+from peer.configuration import Timeouts
+from peer.peer_info import PeerInfo
+from peer.peer_protocol import PeerProtocol
+
+
+class PeerListener:
+    """
+    TCP listener shared by every torrent of the client
+
+    Accepted connections are read until the peer's Handshake arrives, then they are routed by info hash
+    to the torrent that was registered for it (see Torrent.accept_peer), which wraps the connection in a peer.
+    Connections are refused when the torrent is unknown, when there are too many connections in total
+    (max_connections, accepted and outgoing of every torrent) or when the torrent refuses the peer (its own limit)
+    """
+    __MAX_CONNECTIONS__ = 500
+    __MAX_PENDING_HANDSHAKES__ = 50
+
+    def __init__(self, port: int, host: str | None = None, max_connections: int = __MAX_CONNECTIONS__):
+        self.port = port
+        self.host = host
+        self.max_connections = max_connections
+        self._torrents: dict[bytes, 'Torrent'] = {}
+        self._pending_handshakes: int = 0
+        self._server: asyncio.Server | None = None
+
+    def register(self, torrent):
+        self._torrents[torrent.torrent_info.info_hash] = torrent
+
+    def unregister(self, torrent):
+        self._torrents.pop(torrent.torrent_info.info_hash, None)
+
+    def connection_count(self) -> int:
+        return sum(torrent.peer_count() for torrent in self._torrents.values())
+
+    async def start(self):
+        self._server = await asyncio.get_running_loop().create_server(self._create_protocol, self.host, self.port)
+        print(f"PeerListener - listening on {self.port}")
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def _create_protocol(self) -> PeerProtocol:
+        protocol: PeerProtocol | None = None
+        timeout_handle: asyncio.TimerHandle | None = None
+        self._pending_handshakes += 1
+
+        def done():
+            nonlocal timeout_handle
+            if timeout_handle:
+                timeout_handle.cancel()
+                timeout_handle = None
+                self._pending_handshakes -= 1
+
+        def on_handshake_timeout():
+            done()
+            if protocol.transport:
+                protocol.transport.close()
+            else:
+                asyncio.get_running_loop().call_soon(on_handshake_timeout)
+
+        def on_message(msg: Message) -> bool:
+            done()
+            if not self._route(protocol, msg):
+                protocol.transport.close()
+                return False
+            return True
+
+        protocol = PeerProtocol(on_message)
+        timeout_handle = asyncio.get_running_loop().call_later(Timeouts.Handshake, on_handshake_timeout)
+        protocol.closed.add_done_callback(lambda _: done())
+        if self._pending_handshakes > self.__MAX_PENDING_HANDSHAKES__:
+            asyncio.get_running_loop().call_soon(on_handshake_timeout)
+        return protocol
+
+    def _route(self, protocol: PeerProtocol, msg: Message) -> bool:
+        """
+        Hands the connection to the torrent of the info hash in the Handshake
+        """
+        if not isinstance(msg, Handshake):
+            return False
+        torrent = self._torrents.get(msg.info_hash)
+        if torrent is None or self.connection_count() >= self.max_connections:
+            return False
+        ip, port = protocol.transport.get_extra_info('peername')[:2]
+        return torrent.accept_peer(PeerInfo(ip, port, msg.peer_id), protocol, msg)
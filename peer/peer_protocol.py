@@ -0,0 +1,113 @@
+import asyncio
+from typing import Callable
+
+from messages import Message, Handshake, Keepalive
+from misc import utils
+
+
+class PeerProtocol(asyncio.BufferedProtocol):
+    """
+    Wire protocol reader of a peer connection
+
+    The transport receives directly into a reusable buffer, complete messages are framed out of it and
+    passed to on_message synchronously, without a coroutine per message and without copying payloads.
+    Piece blocks are memoryviews of the receive buffer, they are only valid during the on_message call
+    """
+    __BUFFER_SIZE__ = 2 ** 18
+    __MAX_MESSAGE_LENGTH__ = 2 ** 24
+
+    def __init__(self, on_message: Callable[[Message], bool]):
+        self._on_message = on_message
+        self._buffer: bytearray = bytearray(self.__BUFFER_SIZE__)
+        self._start: int = 0
+        self._end: int = 0
+        self._handshake_received: bool = False
+        self.transport: asyncio.Transport | None = None
+        self.closed: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    def set_message_handler(self, on_message: Callable[[Message], bool]):
+        """
+        Messages that follow are passed to on_message (used when an accepted connection is handed to a peer)
+        """
+        self._on_message = on_message
+
+    def connection_made(self, transport: asyncio.Transport):
+        self.transport = transport
+
+    def connection_lost(self, exc: Exception | None):
+        if not self.closed.done():
+            self.closed.set_result(exc)
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        if self._end == len(self._buffer):
+            self._make_room(self._end - self._start + 1)
+        return memoryview(self._buffer)[self._end:]
+
+    def buffer_updated(self, nbytes: int):
+        self._end += nbytes
+        try:
+            self._process_buffer()
+        except Exception as e:
+            print(f"{self.transport.get_extra_info('peername')} - buffer_updated - {type(e).__name__} - {e}")
+            self.transport.close()
+
+    def _make_room(self, needed: int):
+        """
+        Moves unprocessed data to the front of the buffer, the buffer grows if needed bytes do not fit.
+        A new buffer is allocated on growth since views of the old one may still be referenced
+        """
+        pending = self._end - self._start
+        if needed > len(self._buffer):
+            buffer = bytearray(max(needed, 2 * len(self._buffer)))
+            buffer[:pending] = self._buffer[self._start: self._end]
+            self._buffer = buffer
+        elif self._start:
+            self._buffer[:pending] = self._buffer[self._start: self._end]
+        self._start, self._end = 0, pending
+
+    def _process_buffer(self):
+        """
+        Frames and handles every complete message in the buffer
+        """
+        view = memoryview(self._buffer)
+        try:
+            if not self._handshake_received:
+                if not self._process_handshake(view):
+                    return
+            while self._end - self._start >= 4 and not self.transport.is_closing():
+                msg_len = int.from_bytes(view[self._start: self._start + 4], byteorder="big")
+                if msg_len > self.__MAX_MESSAGE_LENGTH__:
+                    raise ValueError(f'Message length {msg_len} exceeds {self.__MAX_MESSAGE_LENGTH__}')
+                msg_end = self._start + 4 + msg_len
+                if msg_end > self._end:
+                    if 4 + msg_len > len(self._buffer) - self._start:
+                        self._make_room(4 + msg_len)
+                    return
+                if msg_len == 0:
+                    msg = Keepalive()
+                else:
+                    msg = utils.mem_view_to_msg(view[self._start + 4], view[self._start + 5: msg_end])
+                self._start = msg_end
+                self._on_message(msg)
+        finally:
+            if self._start == self._end:
+                self._start = self._end = 0
+
+    def _process_handshake(self, view: memoryview) -> bool:
+        """
+        Returns True if the handshake is complete and was handled
+        """
+        if self._end - self._start < 1:
+            return False
+        pstrlen = view[self._start]
+        handshake_end = self._start + 1 + pstrlen + 48
+        if handshake_end > self._end:
+            return False
+        pstr = bytes(view[self._start + 1: self._start + 1 + pstrlen])
+        reserved = bytes(view[self._start + 1 + pstrlen: self._start + 9 + pstrlen])
+        info_hash = bytes(view[self._start + 9 + pstrlen: self._start + 29 + pstrlen])
+        peer_id = bytes(view[self._start + 29 + pstrlen: handshake_end])
+        self._start = handshake_end
+        self._handshake_received = True
+        self._on_message(Handshake(info_hash, peer_id, pstr, reserved))
+        return True
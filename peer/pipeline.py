@@ -0,0 +1,92 @@
+import math
+import time
+
+
+class Pipeline:
+    """
+    Sizes the window of outstanding requests of a peer so that it covers the bandwidth-delay product
+
+    Throughput is sampled periodically and smoothed (EWMA), round trip times of requests are smoothed as well
+    and their minimum over a recent period is kept.
+    While the window is full and RTT stays close to the minimum (requests do not queue on the peer's side)
+    the window grows by one per response, so it doubles every round trip (like TCP slow start).
+    Once RTT grows the window is set to the bandwidth-delay product (rate * minimum RTT) plus __HEADROOM__.
+    The window is bounded by the number of outstanding requests the peer advertises (reqq of the extended handshake)
+    """
+    __MIN_WINDOW__ = 2
+    __INITIAL_WINDOW__ = 8
+    __DEFAULT_MAX_WINDOW__ = 250
+    __HEADROOM__ = 1.5
+    __RATE_INTERVAL__ = 1.0
+    __RATE_WEIGHT__ = 0.5
+    __RTT_WEIGHT__ = 0.125
+    __MIN_RTT_PERIOD__ = 10.0
+
+    def __init__(self):
+        self.max_window: int = self.__DEFAULT_MAX_WINDOW__
+        self.rate: float = 0.0
+        self.rtt: float = 0.0
+        self.min_rtt: float = 0.0
+        self._window: int = self.__INITIAL_WINDOW__
+        self._block_size: int = 0
+        self._sample_bytes: int = 0
+        self._sample_start: float = time.monotonic()
+        self._min_rtt_time: float = 0.0
+
+    def __repr__(self):
+        return f"window: {self.window} | rate: {self.rate / 1024:.1f} KiB/s | rtt: {self.rtt * 1000:.0f} ms"
+
+    @property
+    def window(self) -> int:
+        """
+        Number of requests that may be outstanding
+        """
+        return max(self.__MIN_WINDOW__, min(self._window, self.max_window))
+
+    def set_max_window(self, reqq: int | None):
+        """
+        Applies the reqq value advertised by the peer, None restores the default
+        """
+        self.max_window = max(self.__MIN_WINDOW__, reqq) if reqq else self.__DEFAULT_MAX_WINDOW__
+
+    def on_response(self, length: int, rtt: float, outstanding: int):
+        """
+        A request of length bytes was responded rtt seconds after it was sent,
+        outstanding is the number of requests that were in flight (including this one)
+        """
+        now = time.monotonic()
+        self._block_size = length
+        self._sample_bytes += length
+        self.rtt = rtt if not self.rtt else self.rtt + self.__RTT_WEIGHT__ * (rtt - self.rtt)
+        if not self.min_rtt or rtt <= self.min_rtt or now - self._min_rtt_time > self.__MIN_RTT_PERIOD__:
+            self.min_rtt = rtt
+            self._min_rtt_time = now
+        queueing = rtt > self.min_rtt * self.__HEADROOM__
+        if not queueing and outstanding >= self.window:
+            self._window = min(self._window + 1, self.max_window)
+        elapsed = now - self._sample_start
+        if elapsed < self.__RATE_INTERVAL__:
+            return
+        sample = self._sample_bytes / elapsed
+        self.rate = sample if not self.rate else self.rate + self.__RATE_WEIGHT__ * (sample - self.rate)
+        self._sample_bytes = 0
+        self._sample_start = now
+        if queueing:
+            self._resize()
+
+    def on_idle(self):
+        """
+        The peer had no outstanding requests, time spent idle is not counted in throughput
+        """
+        self._sample_bytes = 0
+        self._sample_start = time.monotonic()
+
+    def on_timeout(self):
+        """
+        A request was not responded in time, the window is halved
+        """
+        self._window = max(self.__MIN_WINDOW__, self._window // 2)
+
+    def _resize(self):
+        bandwidth_delay_product = self.rate * self.min_rtt / self._block_size
+        self._window = max(self.__MIN_WINDOW__, math.ceil(bandwidth_delay_product * self.__HEADROOM__))
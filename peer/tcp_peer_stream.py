@@ -1,78 +1,102 @@
 import asyncio
-from asyncio import StreamReader, StreamWriter
+from typing import Any, Callable
 
 from file_handling.file_handler import FileHandler
-from messages import Keepalive, Handshake
-from misc import utils
+from messages import Message, Piece
+from misc.rate_limiter import TokenBucket
+from misc.timer_wheel import TimerWheel
 from peer.peer_info import PeerInfo
 from peer.peer_base import PeerBase
+from peer.peer_protocol import PeerProtocol
+from piece_handling.piece_picker import PiecePicker
 
 # noinspection PyBroadException
 class TcpPeerStream(PeerBase):
-    def __init__(self, peer_info: PeerInfo, bitfield_len: int, file_handler: FileHandler):
-        super().__init__(peer_info, bitfield_len, file_handler)
-        self._reader: StreamReader | None = None
-        self._writer: StreamWriter | None = None
+    def __init__(self, peer_info: PeerInfo, bitfield_len: int, file_handler: FileHandler, piece_picker: PiecePicker,
+                 timer_wheel: TimerWheel, download_limiter: TokenBucket | None = None,
+                 upload_limiter: TokenBucket | None = None,
+                 on_pex: Callable[[dict[PeerInfo, int]], Any] | None = None,
+                 on_upload: Callable[[int], Any] | None = None,
+                 on_listen_address: Callable[[PeerBase], Any] | None = None,
+                 on_wasted: Callable[[int], Any] | None = None,
+                 on_interested: Callable[[PeerBase], Any] | None = None):
+        super().__init__(
+            peer_info, bitfield_len, file_handler, piece_picker, timer_wheel, download_limiter, upload_limiter, on_pex,
+            on_upload, on_listen_address, on_wasted, on_interested
+        )
+        self._transport: asyncio.Transport | None = None
+        self._protocol: PeerProtocol | None = None
+        self._resume_reading_task: asyncio.Task | None = None
+
+    def attach(self, protocol: PeerProtocol):
+        """
+        Takes over an accepted connection, messages of protocol are handled by this peer from now on
+        """
+        self._transport, self._protocol = protocol.transport, protocol
+        self.incoming = True
+        protocol.set_message_handler(self._on_message)
+        asyncio.create_task(self._wait_for_connection_lost())
 
     async def create_tcp_connection(self) -> bool:
+        if self._transport:
+            return True
         try:
-            self._reader, self._writer = await asyncio.open_connection(
-                self._peer_info.ip, self._peer_info.port
+            self._transport, self._protocol = await asyncio.get_running_loop().create_connection(
+                lambda: PeerProtocol(self._on_message), self._peer_info.ip, self._peer_info.port
             )
-            asyncio.create_task(self._reader_task())
+            asyncio.create_task(self._wait_for_connection_lost())
         except Exception:
             self._dead.set()
             return False
         return True
 
-    async def _reader_task(self):
-        print(f"{self} - _reader_task - started")
-        try:
-            pstrlen = int.from_bytes(await self._reader.readexactly(1), byteorder="big")
-            pstr = await self._reader.readexactly(pstrlen)
-            reserved = await self._reader.readexactly(8)
-            info_hash = await self._reader.readexactly(20)
-            peer_id = await self._reader.readexactly(20)
-            self.handle_msg(Handshake(info_hash, peer_id, pstr, reserved))
-            print(f"{self} - _reader_task - Handshake OK")
-        except Exception:
-            await self.close()
-        while self.alive():
-            self._update_ready_for_requests()
-            try:
-                msg_len = int.from_bytes(await self._reader.readexactly(4), byteorder="big")
-                if msg_len == 0:
-                    self.handle_msg(Keepalive())
-                    continue
-                msg_id = int.from_bytes(await self._reader.readexactly(1), byteorder="big")
-                msg_bytes = await self._reader.readexactly(msg_len - 1)
-                msg = utils.mem_view_to_msg(msg_id, memoryview(msg_bytes))
-                self.handle_msg(msg)
-            except Exception:
-                await self.close()
-        self._dead.set()
-        print(f"{self} - _reader_task - stopped")
+    def _on_message(self, msg: Message) -> bool:
+        result = self.handle_msg(msg)
+        if isinstance(msg, Piece):
+            self._apply_backpressure()
+        return result
+
+    def _apply_backpressure(self):
+        """
+        Stops reading from the socket while too much data waits to be written to disk
+        """
+        if self._resume_reading_task or self._file_handler.writable.is_set():
+            return
+        self._transport.pause_reading()
+        self._resume_reading_task = asyncio.create_task(self._resume_reading())
+
+    async def _resume_reading(self):
+        await self._file_handler.wait_writable()
+        self._resume_reading_task = None
+        if self.alive():
+            self._transport.resume_reading()
 
+    async def _wait_for_connection_lost(self):
+        print(f"{self} - _wait_for_connection_lost - started")
+        await self._protocol.closed
+        if self._resume_reading_task:
+            self._resume_reading_task.cancel()
+        self._dead.set()
+        print(f"{self} - _wait_for_connection_lost - stopped")
 
     async def close(self):
-        if not self._writer:
+        if not self._transport:
             return
-        if self._writer.is_closing():
+        if self._transport.is_closing():
             return
         try:
-            self._writer.close()
-            await self._writer.wait_closed()
+            self._transport.close()
+            await self._protocol.closed
         except Exception as e:
             print(f"{self} - close - {e}")
 
-
     def alive(self):
-        if not self._writer:
+        if not self._transport:
             return False
-        return not self._writer.is_closing()
+        return not self._transport.is_closing()
 
-    def send_bytes(self, data: bytes) -> bool:
-        if not self._writer:
+    def send_bytes(self, chunks: list[bytes]) -> bool:
+        if not self._transport:
             return False
-        self._writer.write(data)
-        return True
\ No newline at end of file
+        self._transport.writelines(chunks)
+        return True
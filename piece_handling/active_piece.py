@@ -1,3 +1,6 @@
+import hashlib
+from typing import Container
+
 from messages import Request
 from misc import utils
 from misc.structures import QueueExt
@@ -7,18 +10,71 @@ from piece_handling.piece_info import PieceInfo
 class ActivePiece:
     """
     Active piece is a piece that peers can perform requests and download
+
+    Every block (request) is taken from the queue once. While a block is in flight the ActiveRequests
+    that try to download it are kept in _in_flight by (index, begin, length), in endgame mode there can be
+    more than one of them. _in_flight can be shared by all the active pieces of a torrent.
+    The ActivePiece keeps track of its own keys in _keys_in_flight
+    The block is marked as done once (by the first copy that lands) or put back in queue once
+    (when the last copy fails)
+
+    Received blocks are assembled in memory, the buffer is allocated when the first block lands.
+    The piece is verified in memory and written to disk only if the hash is correct.
+    SHA-1 is computed incrementally: it advances whenever the next contiguous block lands,
+    out of order blocks wait in the buffer (their ranges in _received) until the gap before them is filled
     """
-    def __init__(self, piece_info: PieceInfo, max_request_length: int = 2 ** 14):
+    __MAX_BLOCK_COPIES__ = 3
+
+    def __init__(self, piece_info: PieceInfo, max_request_length: int = 2 ** 14,
+                 in_flight: dict[tuple[int, int, int], list] | None = None):
         self.piece_info: PieceInfo = piece_info
         self._requests: QueueExt[Request] = QueueExt()
+        self._in_flight: dict[tuple[int, int, int], list] = in_flight if in_flight is not None else {}
+        self._keys_in_flight: set[tuple[int, int, int]] = set()
+        self._buffer: bytearray | None = None
+        self._hasher = hashlib.sha1()
+        self._hashed_bytes: int = 0
+        self._received: dict[int, int] = {}
         self._max_request_length = max_request_length
         self._build_requests()
 
     def __repr__(self):
-        return f"index: {self.piece_info.index} | requests: {self._requests.qsize()}"
+        return f"index: {self.piece_info.index} | requests: {self._requests.qsize()} | in flight: {len(self._keys_in_flight)}"
+
+    @property
+    def data(self) -> bytearray:
+        """
+        The assembled piece
+        """
+        if self._buffer is None:
+            self._buffer = bytearray(self.piece_info.length)
+        return self._buffer
+
+    def write_block(self, begin: int, block: bytes | memoryview) -> bool:
+        """
+        Copies a received block into the assembly buffer
+        """
+        if begin < 0 or begin + len(block) > self.piece_info.length:
+            return False
+        self.data[begin: begin + len(block)] = block
+        if begin >= self._hashed_bytes:
+            self._received[begin] = len(block)
+            self._advance_hash()
+        return True
+
+    def _advance_hash(self):
+        """
+        Hashes every block that is contiguous to the already hashed part of the piece
+        """
+        with memoryview(self.data) as view:
+            while (length := self._received.pop(self._hashed_bytes, None)) is not None:
+                self._hasher.update(view[self._hashed_bytes: self._hashed_bytes + length])
+                self._hashed_bytes += length
 
-    def is_hash_ok(self, data: bytes) -> bool:
-        return utils.calculate_hash(data) == self.piece_info.hash_value
+    def is_hash_ok(self) -> bool:
+        if self._hashed_bytes == self.piece_info.length:
+            return self._hasher.digest() == self.piece_info.hash_value
+        return utils.calculate_hash(self.data) == self.piece_info.hash_value
 
     def _build_requests(self):
         """
@@ -49,6 +105,63 @@ class ActivePiece:
             return self._requests.get_nowait()
         return None
 
+    def has_queued_requests(self) -> bool:
+        return self._requests.qsize() > 0
+
+    def get_duplicate_request(self, excluded: Container[tuple[int, int, int]]) -> Request | None:
+        """
+        Endgame mode: get a request that is already in flight so that one more peer can download the same block.
+        The block with the fewest copies is chosen, blocks whose (index, begin, length) is in excluded are skipped
+        None is returned if there is no such block
+        """
+        best: Request | None = None
+        best_copies = self.__MAX_BLOCK_COPIES__
+        for key in self._keys_in_flight:
+            active_requests = self._in_flight[key]
+            if len(active_requests) >= best_copies or active_requests[0].key in excluded:
+                continue
+            best = active_requests[0].request
+            best_copies = len(active_requests)
+        return best
+
+    def request_in_flight(self, active_request):
+        """
+        Register an ActiveRequest that is about to download one of the blocks of this piece
+        """
+        self._in_flight.setdefault(active_request.key, []).append(active_request)
+        self._keys_in_flight.add(active_request.key)
+
+    def block_received(self, active_request) -> bool:
+        """
+        Called when the block of active_request lands.
+        Returns False if the block was already received by another copy, otherwise all other copies are superseded
+        (their peers send Cancel)
+        """
+        active_requests = self._in_flight.get(active_request.key, [])
+        if active_request not in active_requests:
+            return False
+        del self._in_flight[active_request.key]
+        self._keys_in_flight.discard(active_request.key)
+        for other in active_requests:
+            if other is not active_request:
+                other.supersede()
+        return True
+
+    def request_failed(self, active_request):
+        """
+        A copy of a block failed. If no other copy is in flight, put the request back in queue
+        """
+        active_requests = self._in_flight.get(active_request.key, [])
+        if active_request not in active_requests:
+            return
+        active_requests.remove(active_request)
+        if active_requests:
+            return
+        del self._in_flight[active_request.key]
+        self._keys_in_flight.discard(active_request.key)
+        self.put_request_back(active_request.request)
+        self.request_done()
+
     def put_request_back(self, request: Request) -> bool:
         """
         In case a request is not fulfilled for some reason, put the request back
@@ -1,7 +1,9 @@
 import asyncio
 from asyncio import Event
+from typing import Container
 
 from messages import Request
+from misc.timer_wheel import Timer
 from piece_handling.active_piece import ActivePiece
 
 
@@ -15,6 +17,11 @@ class ActiveRequest:
         self.active_piece = active_piece
         self.request = request
         self.completed: Event = asyncio.Event()
+        self.superseded: bool = False
+        self.sent_time: float = 0.0
+        self.timer: Timer | None = None
+        self.peer = None  # the peer that performs this request
+        active_piece.request_in_flight(self)
 
     @staticmethod
     def from_active_piece(active_piece: ActivePiece):
@@ -26,6 +33,24 @@ class ActiveRequest:
             return ActiveRequest(active_piece, request)
         return None
 
+    @staticmethod
+    def duplicate_from_active_piece(active_piece: ActivePiece, excluded: Container[tuple[int, int, int]]):
+        """
+        Endgame mode: builds an ActiveRequest for a block of ActivePiece that is already in flight.
+        Blocks whose (index, begin, length) is in excluded are skipped
+        None is returned if there is no block that can be duplicated
+        """
+        if request := active_piece.get_duplicate_request(excluded):
+            return ActiveRequest(active_piece, request)
+        return None
+
+    @property
+    def key(self) -> tuple[int, int, int]:
+        """
+        (index, begin, length) identifies the block of the request
+        """
+        return self.request.index, self.request.begin, self.request.data_length
+
     @property
     def index(self) -> int:
         return self.request.index
@@ -47,9 +72,18 @@ class ActiveRequest:
 
     def on_failure(self):
         """
-        On failure clear completion event, put request back in queue
+        On failure clear completion event, put request back in queue (if no other copy is in flight)
         and update queue by marking task as done
         """
         self.completed.clear()
-        self.active_piece.put_request_back(self.request)
-        self.active_piece.request_done()
+        self.active_piece.request_failed(self)
+
+    def supersede(self):
+        """
+        Another copy of this block landed first (endgame mode).
+        Notifies the peer that performs this request, the peer is expected to send a Cancel
+        """
+        self.superseded = True
+        self.completed.set()
+        if self.peer is not None:
+            self.peer.on_request_superseded(self)
@@ -0,0 +1,153 @@
+import random
+from typing import Hashable, Iterable
+
+from messages import Bitfield
+
+
+class PiecePicker:
+    """
+    Chooses which pending piece should be downloaded next using a rarest-first strategy
+
+    Availability (number of peers that have a piece) is kept per piece and pending pieces are grouped
+    in buckets by availability. Each bucket is a list paired with a position index, so moving a piece
+    between buckets, picking a random piece of a bucket and removing it are all O(1).
+    Peers that have every piece (seeds) do not touch per-piece counters, they are counted separately
+    since they raise the availability of all pieces equally.
+    """
+    def __init__(self, piece_count: int):
+        self.piece_count: int = piece_count
+        self._availability: list[int] = [0] * piece_count
+        self._buckets: list[list[int]] = [[]]
+        self._positions: dict[int, int] = {}
+        self._seeds: set[Hashable] = set()
+
+    def __len__(self) -> int:
+        """
+        Number of pending pieces
+        """
+        return len(self._positions)
+
+    def __contains__(self, index: int) -> bool:
+        return index in self._positions
+
+    def _bucket_insert(self, index: int):
+        availability = self._availability[index]
+        while len(self._buckets) <= availability:
+            self._buckets.append([])
+        bucket = self._buckets[availability]
+        self._positions[index] = len(bucket)
+        bucket.append(index)
+
+    def _bucket_remove(self, index: int):
+        """
+        Removes piece from its bucket by swapping it with the last element of the bucket
+        """
+        bucket = self._buckets[self._availability[index]]
+        position = self._positions.pop(index)
+        last = bucket.pop()
+        if last != index:
+            bucket[position] = last
+            self._positions[last] = position
+
+    def _change_availability(self, index: int, delta: int):
+        if not 0 <= index < self.piece_count:
+            return
+        if self._availability[index] + delta < 0:
+            return
+        pending = index in self._positions
+        if pending:
+            self._bucket_remove(index)
+        self._availability[index] += delta
+        if pending:
+            self._bucket_insert(index)
+
+    def _is_seed_bitfield(self, bitfield: Bitfield) -> bool:
+        spare_bits = len(bitfield.data) * 8 - self.piece_count
+        if spare_bits < 0:
+            return False
+        value = int.from_bytes(bitfield.data, byteorder="big") >> spare_bits
+        return value == (1 << self.piece_count) - 1
+
+    def _pieces_in_bitfield(self, bitfield: Bitfield) -> Iterable[int]:
+        """
+        Yields the indices of pieces that are set in bitfield
+        """
+        for byte_index, byte in enumerate(bitfield.data):
+            if not byte:
+                continue
+            for bit in range(8):
+                if byte & (0x80 >> bit):
+                    yield byte_index * 8 + bit
+
+    def set_pending(self, pending_pieces: Iterable[int]):
+        """
+        Replaces the set of pieces that are waiting to be downloaded
+        """
+        self._buckets = [[] for _ in self._buckets]
+        self._positions = {}
+        for index in pending_pieces:
+            self._bucket_insert(index)
+
+    def availability(self, index: int) -> int:
+        """
+        Number of known peers that have piece index
+        """
+        return self._availability[index] + len(self._seeds)
+
+    def has_available(self) -> bool:
+        """
+        True if there is at least one pending piece that some peer has
+        """
+        if self._seeds:
+            return len(self._positions) > 0
+        return len(self._positions) > len(self._buckets[0])
+
+    def pick(self) -> int | None:
+        """
+        Removes and returns the rarest pending piece that is available from at least one peer
+        Ties are broken randomly. None is returned if there is no such piece
+        """
+        first_bucket = 0 if self._seeds else 1
+        for bucket in self._buckets[first_bucket:]:
+            if bucket:
+                index = bucket[random.randrange(len(bucket))]
+                self._bucket_remove(index)
+                return index
+        return None
+
+    def put_back(self, index: int):
+        """
+        Marks piece index as pending again (for example after a hash error)
+        """
+        if index in self._positions or not 0 <= index < self.piece_count:
+            return
+        self._bucket_insert(index)
+
+    def add_peer_bitfield(self, peer: Hashable, bitfield: Bitfield):
+        """
+        Accounts for the pieces advertised by a Bitfield message of peer
+        """
+        if self._is_seed_bitfield(bitfield):
+            self._seeds.add(peer)
+            return
+        for index in self._pieces_in_bitfield(bitfield):
+            self._change_availability(index, 1)
+
+    def add_peer_have(self, peer: Hashable, index: int):
+        """
+        Accounts for a Have message of peer. Caller must make sure that the piece was not already known
+        """
+        if peer in self._seeds:
+            return
+        self._change_availability(index, 1)
+
+    def remove_peer_bitfield(self, peer: Hashable, bitfield: Bitfield):
+        """
+        Removes the contribution of peer, whose currently known pieces are in bitfield
+        Used when a peer disconnects or re-sends its bitfield
+        """
+        if peer in self._seeds:
+            self._seeds.discard(peer)
+            return
+        for index in self._pieces_in_bitfield(bitfield):
+            self._change_availability(index, -1)
@@ -0,0 +1,147 @@
+import asyncio
+import os
+from asyncio import Task
+from concurrent.futures import ThreadPoolExecutor
+
+from dht import DhtNode
+from file_handling.disk_io import DiskIO
+from file_handling.read_cache import ReadCache
+from misc.rate_limiter import TokenBucket
+from misc.timer_wheel import TimerWheel
+from peer.peer_listener import PeerListener
+from torrent.torrent import Torrent
+from torrent.torrent_info import TorrentInfo
+from tracker.http_tracker_client import HttpTrackerClient
+from tracker.udp_tracker_client import UdpTrackerClient
+
+
+class Session:
+    """
+    Runs many torrents in one process and owns the resources they share:
+    the listen socket, the connection budget, the disk I/O pool and read cache, the bandwidth limits,
+    the hash workers, the timer wheel, the tracker clients, the DHT node (on the udp port of the listen port)
+    and the limit of connects in progress (half open connections)
+
+    The connection budget is split evenly between torrents (recomputed whenever a torrent is added / removed).
+    At most __VERIFICATION_SLOTS__ torrents verify their files at the same time, the others wait for a slot.
+    Torrents can be added and removed at any time
+    """
+    __MAX_CONNECTIONS__ = 500
+    __VERIFICATION_SLOTS__ = 2
+    __DISK_WORKERS__ = 4
+    __READ_CACHE_SIZE__ = 2 ** 28
+    __MAX_HALF_OPEN__ = 32
+
+    def __init__(self, port: int, max_connections: int = __MAX_CONNECTIONS__,
+                 download_rate: float = 0.0, upload_rate: float = 0.0, hash_workers: int = 0):
+        self.port = port
+        self.listener = PeerListener(port, max_connections=max_connections)
+        self.timer_wheel = TimerWheel()
+        self.udp_tracker_client = UdpTrackerClient()
+        self.http_tracker_client = HttpTrackerClient()
+        self.dht = DhtNode(port=port)
+        # connects in progress of every torrent together
+        self.half_open = asyncio.Semaphore(self.__MAX_HALF_OPEN__)
+        self.disk_io = DiskIO(self.__DISK_WORKERS__)
+        self.read_cache = ReadCache(self.__READ_CACHE_SIZE__)
+        self.hash_executor = ThreadPoolExecutor(
+            hash_workers if hash_workers > 0 else min(8, os.cpu_count() or 1), thread_name_prefix='Hash'
+        )
+        # global limits, parents of the limits of every torrent (set_rate changes them at runtime)
+        self.download_limiter = TokenBucket(download_rate)
+        self.upload_limiter = TokenBucket(upload_rate)
+        self.torrents: dict[bytes, Torrent] = {}
+        self._torrent_tasks: dict[bytes, Task] = {}
+        self._verification_slots = asyncio.Semaphore(self.__VERIFICATION_SLOTS__)
+
+    @property
+    def max_connections(self) -> int:
+        return self.listener.max_connections
+
+    @max_connections.setter
+    def max_connections(self, value: int):
+        self.listener.max_connections = value
+        self._allocate_connections()
+
+    def _allocate_connections(self):
+        """
+        Every torrent gets an even share of the connection budget
+        """
+        if not self.torrents:
+            return
+        share = max(1, self.max_connections // len(self.torrents))
+        for torrent in self.torrents.values():
+            torrent.max_peers = share
+
+    async def start(self):
+        await self.listener.start()
+        await self.dht.start()
+
+    def add_torrent(self, torrent_info: TorrentInfo) -> Torrent:
+        """
+        Creates a torrent that uses the resources of the session and starts it
+        Returns the torrent that is already running if the info hash is known
+        """
+        info_hash = torrent_info.info_hash
+        if info_hash in self.torrents:
+            return self.torrents[info_hash]
+        torrent_info.self_port = self.port
+        torrent = Torrent(
+            torrent_info,
+            timer_wheel=self.timer_wheel,
+            download_limiter=self.download_limiter,
+            upload_limiter=self.upload_limiter,
+            disk_io=self.disk_io,
+            read_cache=self.read_cache,
+            hash_executor=self.hash_executor,
+            udp_tracker_client=self.udp_tracker_client,
+            http_tracker_client=self.http_tracker_client,
+            dht=self.dht,
+            half_open=self.half_open,
+        )
+        self.torrents[info_hash] = torrent
+        self._allocate_connections()
+        self.listener.register(torrent)
+        self._torrent_tasks[info_hash] = asyncio.create_task(
+            self._run_torrent(torrent), name=f'Torrent {info_hash.hex()}'
+        )
+        return torrent
+
+    async def _run_torrent(self, torrent: Torrent):
+        """
+        Verification slots are only held while files are verified, not while the metadata of a magnet is downloaded.
+        A torrent that fails to start is removed
+        """
+        try:
+            await torrent.prepare_metadata()
+            async with self._verification_slots:
+                await torrent.prepare()
+            await torrent.start()
+        except Exception as e:
+            print(f'{torrent.torrent_info.torrent_file} - {type(e).__name__} - {e}')
+            # remove_torrent waits for this task, it runs in a task of its own
+            asyncio.create_task(self.remove_torrent(torrent.torrent_info.info_hash))
+
+    async def remove_torrent(self, info_hash: bytes):
+        """
+        Stops the torrent, its connection budget is given to the other torrents
+        """
+        torrent = self.torrents.pop(info_hash, None)
+        if torrent is None:
+            return
+        self.listener.unregister(torrent)
+        task = self._torrent_tasks.pop(info_hash)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await torrent.stop()
+        self._allocate_connections()
+
+    async def stop(self):
+        await self.listener.stop()
+        for info_hash in list(self.torrents):
+            await self.remove_torrent(info_hash)
+        self.hash_executor.shutdown(wait=False)
+        await self.disk_io.close()
+        self.udp_tracker_client.close()
+        self.http_tracker_client.close()
+        self.dht.close()
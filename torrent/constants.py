@@ -12,3 +12,9 @@ PORT = b'port'
 PEERS = b'peers'
 PEER_ID = b'peer id'
 INTERVAL = b'interval'
+MIN_INTERVAL = b'min interval'
+COMPLETE = b'complete'
+INCOMPLETE = b'incomplete'
+DOWNLOADED = b'downloaded'
+FAILURE_REASON = b'failure reason'
+PRIVATE = b'private'
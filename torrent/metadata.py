@@ -16,6 +16,7 @@ class Metadata:
         self.torrent_size: int = 0
         self.piece_size: int = 0
         self.pieces_info: tuple[PieceInfo, ...] = tuple()
+        self.piece_count: int = 0
         self.info_hash: bytes = bytes()
         self._validate_data()
 
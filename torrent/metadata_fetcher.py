@@ -0,0 +1,193 @@
+import asyncio
+import math
+import time
+from typing import Container
+
+import bencdec
+from misc import utils
+from peer.connection_manager import Candidate
+from peer.metadata_peer import MetadataPeer
+from peer.peer_info import PeerInfo
+from torrent.metadata import Metadata
+
+
+class MetadataFetcher:
+    """
+    Downloads the info dictionary of a torrent from peers (BEP 9), so that a torrent can start from its info hash
+
+    The metadata is split into pieces of Metadata.__METADATA_PIECE_SIZE__ bytes that are requested from up to
+    __MAX_PEERS__ peers at the same time, a peer always asks for the missing piece with the fewest requests
+    in flight (a piece is requested from at most __MAX_DUPLICATES__ peers, so slow peers do not hold back the end).
+    Once every piece arrived the metadata is verified against the info hash. On a mismatch the peers that sent
+    pieces are disconnected and banned (they are never connected again nor passed on as known peers)
+    and everything is downloaded again.
+    Peers whose connection ends before the metadata is complete are tried again after
+    __RETRY_BASE__ * 2 ** (failures - 1) seconds (up to __MAX_RETRY__), peers are never given up on:
+    trackers and the DHT mostly return the same swarm again
+    """
+    __MAX_PEERS__ = 30
+    __MAX_DUPLICATES__ = 2
+    __MAX_METADATA_SIZE__ = 2 ** 24
+    __MAX_CANDIDATES__ = 2000
+    __RETRY_BASE__ = 15.0
+    __MAX_RETRY__ = 300.0
+
+    def __init__(self, info_hash: bytes, self_id: bytes):
+        self.info_hash = info_hash
+        self.self_id = self_id
+        self.size: int = 0
+        self.completed: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._pieces: list[bytes | None] = []
+        self._sources: list[MetadataPeer | None] = []
+        self._in_flight: list[int] = []
+        self._candidates: dict[PeerInfo, Candidate] = {}
+        self._banned: set[PeerInfo] = set()
+        self._peers: dict[asyncio.Task, MetadataPeer] = {}
+        self._retry_handle: asyncio.TimerHandle | None = None
+
+    def _piece_length(self, piece: int) -> int:
+        return min(Metadata.__METADATA_PIECE_SIZE__, self.size - piece * Metadata.__METADATA_PIECE_SIZE__)
+
+    def _reset(self, size: int):
+        self.size = size
+        piece_count = math.ceil(size / Metadata.__METADATA_PIECE_SIZE__)
+        self._pieces = [None] * piece_count
+        self._sources = [None] * piece_count
+        self._in_flight = [0] * piece_count
+
+    def set_size(self, size: int) -> bool:
+        """
+        The first size that is reported by a peer is used, returns False if size is different (or invalid)
+        """
+        if self.size:
+            return size == self.size
+        if not 0 < size <= self.__MAX_METADATA_SIZE__:
+            return False
+        self._reset(size)
+        return True
+
+    def next_piece(self, excluded: Container[int]) -> int | None:
+        """
+        The missing piece with the fewest requests in flight, pieces in excluded (requested by the caller) are skipped
+        """
+        best: int | None = None
+        for piece, data in enumerate(self._pieces):
+            if data is not None or piece in excluded or self._in_flight[piece] >= self.__MAX_DUPLICATES__:
+                continue
+            if best is None or self._in_flight[piece] < self._in_flight[best]:
+                best = piece
+                if not self._in_flight[piece]:
+                    break
+        if best is not None:
+            self._in_flight[best] += 1
+        return best
+
+    def request_failed(self, piece: int):
+        if 0 <= piece < len(self._in_flight) and self._in_flight[piece]:
+            self._in_flight[piece] -= 1
+            self._wake_peers()
+
+    def on_piece(self, peer: MetadataPeer, piece: int, data: bytes):
+        if not 0 <= piece < len(self._pieces) or len(data) != self._piece_length(piece):
+            return
+        self._in_flight[piece] = max(0, self._in_flight[piece] - 1)
+        if self._pieces[piece] is not None:
+            return
+        self._pieces[piece] = data
+        self._sources[piece] = peer
+        if all(data is not None for data in self._pieces):
+            self._verify()
+
+    def _verify(self):
+        metadata = b''.join(self._pieces)
+        if utils.calculate_hash(metadata) == self.info_hash:
+            try:
+                self.completed.set_result(bencdec.decode(metadata)[0])
+            except Exception as e:
+                self.completed.set_exception(ValueError(f'Metadata of {self.info_hash.hex()} is invalid - {e}'))
+            return
+        print(f"{self.info_hash.hex()} - metadata hash error, downloading again")
+        for source in set(self._sources):
+            self._banned.add(source.peer_info)
+            self._candidates.pop(source.peer_info, None)
+            source.close()
+        self._reset(0)
+        self._wake_peers()
+
+    def _wake_peers(self):
+        """
+        Peers that wait for pieces request again (requests failed or the metadata is downloaded again)
+        """
+        for peer in list(self._peers.values()):
+            peer.request_pieces()
+
+    def add_peer(self, peer_info: PeerInfo) -> bool:
+        """
+        Downloads metadata from the peer, peers wait in line while __MAX_PEERS__ peers are connected.
+        Returns False if the peer is known already or refused (banned peers sent bad metadata)
+        """
+        if self.completed.done() or peer_info in self._candidates or peer_info in self._banned:
+            return False
+        if len(self._candidates) >= self.__MAX_CANDIDATES__:
+            return False
+        self._candidates[peer_info] = Candidate(peer_info)
+        self._run_candidates()
+        return True
+
+    def known_peers(self) -> set[PeerInfo]:
+        """
+        Every peer that was added, they are the swarm of the torrent
+        """
+        return set(self._candidates)
+
+    def _run_candidates(self):
+        """
+        Connects the candidates that are ready (fewest failures first) while there is room,
+        wakes up again when the next candidate that waits for its retry is ready
+        """
+        if self._retry_handle:
+            self._retry_handle.cancel()
+            self._retry_handle = None
+        if self.completed.done():
+            return
+        now = time.monotonic()
+        waiting = [candidate for candidate in self._candidates.values() if not candidate.connected]
+        ready = sorted(
+            (candidate for candidate in waiting if candidate.next_attempt <= now),
+            key=lambda candidate: candidate.failures
+        )
+        for candidate in ready[:self.__MAX_PEERS__ - len(self._peers)]:
+            self._run_peer(candidate)
+        if later := [candidate.next_attempt for candidate in waiting if candidate.next_attempt > now]:
+            self._retry_handle = asyncio.get_running_loop().call_later(min(later) - now, self._run_candidates)
+
+    def _run_peer(self, candidate: Candidate):
+        candidate.connected = True
+        peer = MetadataPeer(candidate.peer_info, self)
+        task = asyncio.create_task(peer.run(), name=f'Metadata {candidate.peer_info.ip}')
+        self._peers[task] = peer
+        task.add_done_callback(lambda t: self._on_peer_done(candidate, t))
+
+    def _on_peer_done(self, candidate: Candidate, task: asyncio.Task):
+        """
+        The metadata is not complete, so the peer failed us (connect error, timeout, rejected request...)
+        """
+        self._peers.pop(task, None)
+        candidate.connected = False
+        candidate.backoff(self.__RETRY_BASE__, self.__MAX_RETRY__)
+        self._run_candidates()
+
+    async def fetch(self) -> dict:
+        """
+        Waits until the metadata is downloaded and verified, returns the decoded info dictionary
+        """
+        try:
+            return await asyncio.shield(self.completed)
+        finally:
+            # no new peer is run once the fetch is over
+            if not self.completed.done():
+                self.completed.cancel()
+            if self._retry_handle:
+                self._retry_handle.cancel()
+                self._retry_handle = None
+            await utils.cancel_tasks(set(self._peers))
@@ -1,156 +1,546 @@
 import asyncio
+import math
 import random
 from asyncio import Task
+from concurrent.futures import ThreadPoolExecutor
 
+from dht import DhtNode
+from file_handling.disk_io import DiskIO
 from file_handling.file_handler import FileHandler
-from messages import Have, Bitfield
+from file_handling.read_cache import ReadCache
+from messages import Have, Bitfield, Handshake
+from messages.extended import ExtendedPex
+from misc import utils
+from misc.rate_limiter import TokenBucket
 from misc.structures import SetExt
+from misc.timer_wheel import TimerWheel
+from peer.choker import Choker
 from peer.configuration import Timeouts, Punishments
+from peer.connection_manager import ConnectionManager
 from peer.peer_base import PeerBase
+from peer.peer_info import PeerInfo
+from peer.peer_protocol import PeerProtocol
+from peer.tcp_peer_stream import TcpPeerStream
 from piece_handling.active_piece import ActivePiece
-from piece_handling.piece_info import PieceInfo
+from piece_handling.active_request import ActiveRequest
+from piece_handling.piece_picker import PiecePicker
+from torrent.metadata import Metadata
+from torrent.metadata_fetcher import MetadataFetcher
 from torrent.torrent_info import TorrentInfo
-from tracker import Tracker
+from tracker import TrackerTiers
+from tracker.announce import AnnounceRequest, Event
+from tracker.http_tracker_client import HttpTrackerClient
+from tracker.udp_tracker_client import UdpTrackerClient
 
 
 class Torrent:
     """
     A class that represent a torrent and handles download/upload sessions
     """
+    __MAX_PEERS__ = 100
+    __DHT_INTERVAL__ = 900.0
+    __DHT_RETRY_INTERVAL__ = 15.0
+    __MIN_ACTIVE_PIECES__ = 8
 
-    def __init__(self, torrent_info: TorrentInfo):
+    def __init__(self, torrent_info: TorrentInfo, timer_wheel: TimerWheel | None = None,
+                 download_limiter: TokenBucket | None = None, upload_limiter: TokenBucket | None = None,
+                 disk_io: DiskIO | None = None, read_cache: ReadCache | None = None,
+                 hash_executor: ThreadPoolExecutor | None = None,
+                 udp_tracker_client: UdpTrackerClient | None = None,
+                 http_tracker_client: HttpTrackerClient | None = None, dht: DhtNode | None = None,
+                 half_open: asyncio.Semaphore | None = None):
+        """
+        The optional arguments are resources shared by the torrents of a session (see Session),
+        peers are looked up in the DHT only if dht is given
+        If torrent_info has no metadata yet (magnet) it is downloaded from peers by prepare
+        """
         self.torrent_info = torrent_info
-        self.file_handler = FileHandler(self.torrent_info.metadata)
+        self.timer_wheel: TimerWheel = timer_wheel or TimerWheel()
+        # limits of this torrent, parents are the global limits (set_rate changes them at runtime)
+        self.download_limiter: TokenBucket = TokenBucket(parent=download_limiter)
+        self.upload_limiter: TokenBucket = TokenBucket(parent=upload_limiter)
+        self._disk_io, self._read_cache, self._hash_executor = disk_io, read_cache, hash_executor
+        self.file_handler: FileHandler = self._create_file_handler()
+        self.piece_picker = PiecePicker(self.torrent_info.metadata.piece_count)
+        self.metadata_fetcher: MetadataFetcher | None = None
         self.peers: set[PeerBase] = set()
         self.peer_tasks: set[Task] = set()
         self.peer_readiness_tasks: SetExt[Task] = SetExt()
-        self.trackers: set[Tracker] = set()
-        self.tracker_tasks: set[Task] = set()
+        self.connections: ConnectionManager = ConnectionManager(
+            self._create_peer, self._run_peer, self._room, half_open
+        )
+        self.connection_task: Task | None = None
+        # a torrent that runs alone has its own udp tracker socket and http connections
+        self._own_udp_tracker_client: bool = udp_tracker_client is None
+        self._own_http_tracker_client: bool = http_tracker_client is None
+        self.udp_tracker_client: UdpTrackerClient = udp_tracker_client or UdpTrackerClient()
+        self.http_tracker_client: HttpTrackerClient = http_tracker_client or HttpTrackerClient()
+        self.trackers: TrackerTiers = TrackerTiers(
+            self.torrent_info, self._announce_request, self.udp_tracker_client, self.http_tracker_client
+        )
+        self.tracker_task: Task | None = None
+        self.dht: DhtNode | None = dht
+        self.dht_task: Task | None = None
+        self.downloaded_bytes: int = 0
+        # every block sent to peers, peers that are gone included
+        self.uploaded_bytes: int = 0
+        # in endgame mode peers may request blocks that are already in flight (see _update_endgame),
+        # wasted_bytes counts the duplicate data that was received for nothing
+        self.endgame: bool = False
+        self.wasted_bytes: int = 0
+        self._announce_key: int = random.getrandbits(32)
         self.bitfield: Bitfield = Bitfield()
-        self.max_active_pieces: int = 0
-        self.active_pieces: list[ActivePiece] = []
+        self.active_pieces: dict[int, ActivePiece] = {}
+        # (index, begin, length) -> the requests that download the block, shared by the active pieces
+        self._requests_in_flight: dict[tuple[int, int, int], list[ActiveRequest]] = {}
         self.piece_tasks: SetExt[Task] = SetExt()
+        self.resume_data_task: Task | None = None
+        self.choker: Choker = Choker(self.peers, self.is_seeding)
+        self.choker_task: Task | None = None
+        self.pex_task: Task | None = None
+        self._pending_haves: list[int] = []
         self._stop: asyncio.Event = asyncio.Event()
+        self._accepting_peers: bool = False
+        self._prepared: bool = False
+        self.max_peers: int = self.__MAX_PEERS__
+
+    def _create_file_handler(self) -> FileHandler:
+        return FileHandler(self.torrent_info.metadata, self._disk_io, self._read_cache, self._hash_executor)
 
     def _begin_trackers(self):
-        for tracker in self.torrent_info.trackers:
-            t = Tracker(tracker, self.torrent_info)
-            tracker_task = asyncio.create_task(
-                t.tracker_main_job(
-                    self.peers,
-                    self.peer_tasks,
-                    self.peer_readiness_tasks,
-                    self.bitfield,
-                    self.file_handler,
-                ), name=f'Tracker {tracker}')
-            self.tracker_tasks.add(tracker_task)
-            tracker_task.add_done_callback(self.tracker_tasks.discard)
-            self.trackers.add(t)
+        self.tracker_task = asyncio.create_task(self.trackers.run(self._add_tracker_peer), name='Trackers')
+
+    def _begin_dht(self):
+        """
+        (Re)starts the DHT lookups, private torrents do not use the DHT
+        """
+        if self.dht_task:
+            self.dht_task.cancel()
+        if self.dht and not self.torrent_info.is_private():
+            self.dht_task = asyncio.create_task(self._dht_job(), name='DHT lookups')
+
+    async def _dht_job(self):
+        """
+        Looks up peers in the DHT and announces the torrent every __DHT_INTERVAL__ seconds.
+        Lookups that find no peer are retried sooner, from __DHT_RETRY_INTERVAL__ seconds doubling up to the interval.
+        Peers take the same path as the peers of trackers
+        """
+        retry_interval = self.__DHT_RETRY_INTERVAL__
+        while True:
+            peers = await self.dht.get_peers(self.torrent_info.info_hash, self.torrent_info.self_port)
+            for peer_info in peers:
+                self._add_tracker_peer(peer_info)
+            if peers:
+                interval, retry_interval = self.__DHT_INTERVAL__, self.__DHT_RETRY_INTERVAL__
+            else:
+                interval, retry_interval = retry_interval, min(2 * retry_interval, self.__DHT_INTERVAL__)
+            await asyncio.sleep(interval)
+
+    def _announce_request(self, event: Event) -> AnnounceRequest:
+        """
+        Announce with the transfer numbers of the torrent, as many peers as we have room for
+        """
+        if self.torrent_info.has_metadata():
+            completed_bytes = sum(
+                self.torrent_info.metadata.pieces_info[index].length for index in self.file_handler.completed_pieces
+            )
+            left = self.torrent_info.metadata.torrent_size - completed_bytes
+        else:
+            # the size is not known yet, trackers must not take us for a seed
+            left = Metadata.__METADATA_PIECE_SIZE__
+        return AnnounceRequest(
+            self.torrent_info.info_hash, self.torrent_info.self_id, self.torrent_info.self_port,
+            uploaded=self.uploaded_bytes,
+            downloaded=self.downloaded_bytes,
+            left=left,
+            event=event,
+            numwant=0 if event == Event.stopped else max(0, self.max_peers - self.peer_count()),
+            key=self._announce_key,
+        )
+
+    def _add_tracker_peer(self, peer_info: PeerInfo) -> bool:
+        """
+        Peers are used to download the metadata until it is complete
+        """
+        if self.metadata_fetcher:
+            return self.metadata_fetcher.add_peer(peer_info)
+        return self.add_peer(peer_info)
+
+    def _add_pex_peers(self, peers: dict[PeerInfo, int]):
+        """
+        Peers learned with Peer Exchange take the same path as the peers of trackers, seeds are useless to seeds
+        """
+        seeding = self.torrent_info.has_metadata() and self.is_seeding()
+        for peer_info, flags in peers.items():
+            if not (seeding and flags & ExtendedPex.__SEED__):
+                self._add_tracker_peer(peer_info)
+
+    async def _pex_job(self):
+        """
+        Sends a Peer Exchange message every Timeouts.Pex seconds to every peer that supports it:
+        the connected peers that were added / dropped since its previous message
+        """
+        while not await utils.run_with_timeout(self._stop.wait(), Timeouts.Pex):
+            alive_peers = [peer for peer in self.peers if peer.alive()]
+            connected = {
+                address: peer.pex_flags() for peer in alive_peers if (address := peer.listen_address())
+            }
+            for peer in alive_peers:
+                try:
+                    peer.send_pex(connected)
+                except Exception as e:
+                    print(f"{peer} - send_pex - {type(e).__name__} - {e}")
+
+    def is_seeding(self) -> bool:
+        return len(self.file_handler.completed_pieces) == self.torrent_info.metadata.piece_count
+
+    def peer_count(self) -> int:
+        return len(self.peer_tasks)
+
+    def _room(self) -> int:
+        """
+        Number of connections the torrent can still open
+        """
+        return self.max_peers - self.peer_count() if self._accepting_peers else 0
+
+    def _create_peer(self, peer_info: PeerInfo) -> TcpPeerStream | None:
+        """
+        Returns a new peer or None if it is refused: files are not verified yet, too many peers or already connected
+        """
+        if not self._accepting_peers or self.peer_count() >= self.max_peers:
+            return None
+        peer = TcpPeerStream(
+            peer_info, len(self.bitfield.data), self.file_handler, self.piece_picker, self.timer_wheel,
+            self.download_limiter, self.upload_limiter,
+            # peers of private torrents come from their trackers only (BEP 27)
+            on_pex=None if self.torrent_info.is_private() else self._add_pex_peers,
+            on_upload=self._on_upload, on_listen_address=self._on_listen_address, on_wasted=self._on_wasted,
+            on_interested=self.choker.on_interested
+        )
+        if peer in self.peers or self._duplicate_of(peer):
+            return None
+        return peer
+
+    def _duplicate_of(self, peer: PeerBase) -> PeerBase | None:
+        """
+        Another peer that is alive and has the listen address of peer (peers are identified by ip and listen port,
+        a peer that connected to us has an other port than its listen port)
+        """
+        if (address := peer.listen_address()) is None:
+            return None
+        return next(
+            (other for other in self.peers if other is not peer and other.alive() and other.listen_address() == address),
+            None
+        )
+
+    def _drop_duplicate(self, peer: PeerBase, other: PeerBase) -> bool:
+        """
+        peer and other are connections with the same peer (mostly because we connected to each other at the same time).
+        Both sides keep the connection that the side with the lower peer id opened and close the other one.
+        Returns True if peer is the one that is closed
+        """
+        if peer.incoming == other.incoming:
+            dropped = peer
+        else:
+            ours, theirs = (other, peer) if peer.incoming else (peer, other)
+            dropped = theirs if self.torrent_info.self_id < (peer.peer_id() or other.peer_id()) else ours
+        asyncio.create_task(dropped.close())
+        return dropped is peer
+
+    def _on_listen_address(self, peer: PeerBase):
+        """
+        A peer that connected to us told its listen address: the connection manager does not connect to it
+        while it is connected
+        """
+        if (other := self._duplicate_of(peer)) and self._drop_duplicate(peer, other):
+            return
+        self.connections.on_peer_connected(peer.listen_address())
+
+    def _on_upload(self, length: int):
+        self.uploaded_bytes += length
+
+    def _on_wasted(self, length: int):
+        self.wasted_bytes += length
+
+    def _handshake(self) -> Handshake:
+        reserved = bytearray(int(0).to_bytes(8))
+        reserved[5] = 0x10
+        return Handshake(self.torrent_info.info_hash, self.torrent_info.self_id, reserved=reserved)
+
+    def _on_peer_done(self, peer: TcpPeerStream, peer_task: Task):
+        """
+        Dead peers are forgotten, the connection manager decides if they are connected again
+        """
+        self.peer_tasks.discard(peer_task)
+        self.peers.discard(peer)
+        # the address is still connected if the peer was a duplicate
+        if not self._duplicate_of(peer):
+            self.connections.on_peer_closed(peer)
+
+    def _run_peer(self, peer: TcpPeerStream):
+        """
+        Creates the task that runs peer until it is dead and the first readiness task of the peer.
+        A peer we connected to may have connected to us meanwhile, see _drop_duplicate
+        """
+        if (other := self._duplicate_of(peer)) and self._drop_duplicate(peer, other):
+            return
+        self.peers.add(peer)
+        peer_task = asyncio.create_task(
+            peer.run_till_dead(
+                handshake=self._handshake(), bitfield=self.bitfield, listen_port=self.torrent_info.self_port
+            ),
+            name=f'Peer {peer._peer_info.ip}'
+        )
+        self.peer_tasks.add(peer_task)
+        peer_task.add_done_callback(lambda task: self._on_peer_done(peer, task))
+        self.peer_readiness_tasks.add(asyncio.create_task(peer.wait_till_ready()))
+
+    def add_peer(self, peer_info: PeerInfo) -> bool:
+        """
+        Adds a peer (learned from a tracker, the DHT or Peer Exchange) to the candidates of the connection manager.
+        Returns False if the peer is known already or refused
+        """
+        return self.connections.add(peer_info)
+
+    def accept_peer(self, peer_info: PeerInfo, protocol: PeerProtocol, handshake: Handshake) -> bool:
+        """
+        Takes over an incoming connection (see PeerListener) once the peer's handshake was received
+        Returns False if the peer is refused
+        """
+        if not (peer := self._create_peer(peer_info)):
+            return False
+        peer.attach(protocol)
+        # our handshake goes out before anything that handling the peer's messages may send
+        peer.send_handshake(self._handshake(), self.bitfield)
+        peer.handle_msg(handshake)
+        self._run_peer(peer)
+        return True
 
     def _choose_pending_piece(self) -> int | None:
         """
         Strategy to choose which piece should be downloaded
 
-        For now just get a random piece
+        Rarest piece among the ones that connected peers have, see PiecePicker
         """
-        try:
-            piece = random.choice(self.file_handler.pending_pieces)
-            self.file_handler.pending_pieces.remove(piece)
-            return piece
-        except IndexError:
-            return None
+        return self.piece_picker.pick()
 
     def _handle_completed_piece(self, piece: ActivePiece):
         """
         Marks piece as complete
-        Notifies other peers with Have message
-        Removes related active piece from list
+        Notifies other peers with Have message (see _announce_have)
+        Removes related active piece from active pieces
         """
+        for peer in self.peers:
+            peer.on_piece_completed(piece.piece_info.index)
         self.file_handler.completed_pieces.append(piece.piece_info.index)
         self.bitfield.set_bit_value(piece.piece_info.index, True)
+        self.downloaded_bytes += piece.piece_info.length
         print(
             f'{self.torrent_info.torrent_file} | '
             f'Piece done: {piece.piece_info.index} | '
             f'Progress: {len(self.file_handler.completed_pieces)} / {self.torrent_info.metadata.piece_count} | '
             f'Peers: {len(self.peer_tasks)}'
+            f'{f" | Endgame - wasted: {self.wasted_bytes}" if self.endgame else ""}'
         )
+        self._announce_have(piece.piece_info.index)
+        del self.active_pieces[piece.piece_info.index]
+        if self.is_seeding():
+            self.trackers.announce_now(Event.completed)
+
+    def _announce_have(self, index: int):
+        """
+        Sends Have of a completed piece to peers, batched for Timeouts.HaveBatch seconds if configured
+        """
+        if not Timeouts.HaveBatch:
+            self._send_haves([index])
+            return
+        self._pending_haves.append(index)
+        if len(self._pending_haves) == 1:
+            self.timer_wheel.schedule(Timeouts.HaveBatch, self._flush_haves)
+
+    def _flush_haves(self):
+        haves, self._pending_haves = self._pending_haves, []
+        self._send_haves(haves)
+
+    def _send_haves(self, indices: list[int]):
+        """
+        Peers that already have a piece are not notified about it
+        """
         for peer in self.peers:
-            peer.send(Have(piece.piece_info.index))
-        self.active_pieces.remove(piece)
+            for index in indices:
+                if not peer.has_piece(index):
+                    peer.send(Have(index))
 
-    def _handle_hash_error(self, piece: ActivePiece):
+    def _handle_piece_error(self, piece: ActivePiece, reason: str = 'Hash error'):
         """
-        An active piece can be completed but with wrong hash value
+        An active piece can be completed but with wrong hash value (or it could not be written to disk)
         Put that piece back in pending pieces list in order to be downloaded again at some point
         """
-        print(f"{self.torrent_info.torrent_file} - Hash error: {piece.piece_info.index}")
-        self.active_pieces.remove(piece)
-        self.file_handler.pending_pieces.append(piece.piece_info.index)
+        print(f"{self.torrent_info.torrent_file} - {reason}: {piece.piece_info.index}")
+        del self.active_pieces[piece.piece_info.index]
+        self.piece_picker.put_back(piece.piece_info.index)
+
+    def _update_endgame(self):
+        """
+        Endgame mode begins once every remaining block is in flight:
+        no pending piece can be picked and no active piece has requests in queue.
+        In endgame mode peers are allowed to request blocks that are already in flight on other peers
+        """
+        endgame = (
+            len(self.active_pieces) > 0
+            and not self.piece_picker.has_available()
+            and not any(piece.has_queued_requests() for piece in self.active_pieces.values())
+        )
+        if endgame and not self.endgame:
+            print(f'{self.torrent_info.torrent_file} | Endgame mode - active pieces: {len(self.active_pieces)}')
+        self.endgame = endgame
+
+    def requests_in_flight(self, index: int, begin: int, length: int) -> list[ActiveRequest]:
+        """
+        The requests that are downloading block (index, begin, length), their peer attribute tells who performs them
+        """
+        return list(self._requests_in_flight.get((index, begin, length), ()))
+
+    def _max_active_pieces(self) -> int:
+        """
+        max_active_pieces of the torrent info if it is set. Otherwise twice the pieces that fill the request windows
+        of the connected peers (at least __MIN_ACTIVE_PIECES__): pieces are picked as they are needed,
+        so rarest first follows the availability of the moment and few piece buffers are held in memory
+        """
+        if self.torrent_info.max_active_pieces:
+            return self.torrent_info.max_active_pieces
+        blocks_per_piece = math.ceil(self.torrent_info.metadata.piece_size / self.torrent_info.max_request_length)
+        window = sum(peer.request_window() for peer in self.peers if peer.alive())
+        return max(self.__MIN_ACTIVE_PIECES__, 2 * math.ceil(window / blocks_per_piece))
 
     def _update_active_pieces_and_piece_tasks(self):
         """
-        Ensures that active piece list has at most max_active_pieces elements
+        Ensures that active pieces are at most _max_active_pieces() elements
         Creates new actives pieces if necessary and their appropriate piece_tasks
         Uses piece_done_callback to handle completed pieces
         """
+        async def store_piece(piece: ActivePiece):
+            """
+            The piece was verified in memory, it is marked as complete once it is written to disk
+            """
+            if await self.file_handler.write_piece(piece.piece_info.index, 0, piece.data):
+                self._handle_completed_piece(piece)
+            else:
+                self._handle_piece_error(piece, 'Write error')
+
         def piece_done_callback(piece_task: Task):
             try:
                 if piece_task.cancelled():
                     return
                 result: ActivePiece = piece_task.result()
-                info: PieceInfo = result.piece_info
-                data = self.file_handler.read_piece(info.index, 0, info.length).block
-                if result.is_hash_ok(data):
-                    self._handle_completed_piece(result)
+                if result.is_hash_ok():
+                    store_task = asyncio.create_task(store_piece(result), name=f"Store {piece_task.get_name()}")
+                    self.piece_tasks.add(store_task)
+                    store_task.add_done_callback(self.piece_tasks.discard)
                 else:
-                    self._handle_hash_error(result)
+                    self._handle_piece_error(result)
             except Exception as e:
                 print(f"Exception: {piece_task.get_name()} - {e}")
             self.piece_tasks.discard(piece_task)
 
+        max_active_pieces = self._max_active_pieces()
         active_pieces_count = len(self.active_pieces)
-        if active_pieces_count >= self.max_active_pieces:
+        if active_pieces_count >= max_active_pieces:
             return
-        pieces_to_create = min(self.max_active_pieces - active_pieces_count, len(self.file_handler.pending_pieces))
+        pieces_to_create = min(max_active_pieces - active_pieces_count, len(self.piece_picker))
         for _ in range(pieces_to_create):
             piece_index = self._choose_pending_piece()
             if piece_index is None:
-                continue
+                break
             piece_info = self.torrent_info.metadata.pieces_info[piece_index]
-            new_active_piece = ActivePiece(piece_info, self.torrent_info.max_request_length)
-            self.active_pieces.append(new_active_piece)
+            new_active_piece = ActivePiece(piece_info, self.torrent_info.max_request_length, self._requests_in_flight)
+            self.active_pieces[piece_index] = new_active_piece
             new_piece_task = asyncio.create_task(
                     new_active_piece.join_queue(), name=f"ActivePiece {new_active_piece.piece_info.index}"
                 )
             self.piece_tasks.add(new_piece_task)
             new_piece_task.add_done_callback(piece_done_callback)
 
-    def _on_metadata_completion(self):
+    def _print_verification_progress(self, checked: int, total: int):
+        print(f'{self.torrent_info.torrent_file} | Verifying: {checked} / {total}')
+
+    async def _on_metadata_completion(self):
         print("Handling files...")
-        self.file_handler.on_metadata_completion()
+        await self.file_handler.on_metadata_completion(self._print_verification_progress)
         print("Files OK")
         self.bitfield.update_from_completed_pieces(
             self.file_handler.completed_pieces, self.torrent_info.metadata.piece_count
         )
-        self.max_active_pieces: int = (
-            self.torrent_info.max_active_pieces
-            if self.torrent_info.max_active_pieces
-            else len(self.file_handler.pending_pieces)
-        )
+        self.piece_picker.set_pending(self.file_handler.pending_pieces)
 
-    async def start(self):
+    async def _resume_data_job(self):
         """
-        Begins trackers, wakes up whenever a peer is ready to perform requests, handles piece tasks.
-        Basically handles everything, once start is called the download begins
+        Periodically saves fast-resume data so that a restart does not need to hash everything again
+        """
+        while not await utils.run_with_timeout(self._stop.wait(), Timeouts.ResumeData):
+            await self.file_handler.save_resume_data()
+
+    async def _fetch_metadata(self):
         """
+        Downloads the metadata from the peers that trackers return (see MetadataFetcher).
+        The files are created for the new metadata, the peers become candidates of the download
+        (trackers announce again afterwards to get more peers)
+        """
+        print(f'{self.torrent_info.torrent_file} | Waiting for metadata')
+        self.metadata_fetcher = MetadataFetcher(self.torrent_info.info_hash, self.torrent_info.self_id)
         self._begin_trackers()
+        self._begin_dht()
+        try:
+            self.torrent_info.set_metadata(await self.metadata_fetcher.fetch())
+            for peer_info in self.metadata_fetcher.known_peers():
+                self.add_peer(peer_info)
+        finally:
+            self.metadata_fetcher = None
+        print(f'{self.torrent_info.torrent_file} | Metadata OK')
+        await self.file_handler.close()
+        self.file_handler = self._create_file_handler()
+        self.piece_picker = PiecePicker(self.torrent_info.metadata.piece_count)
 
-        print(f'Waiting for metadata')
-        # await metadata completion
+    async def prepare_metadata(self):
+        """
+        Downloads the metadata if it is missing (magnet), prepare calls it if it was not called before.
+        Raises ValueError if the downloaded metadata is invalid
+        """
+        if not self.torrent_info.has_metadata():
+            await self._fetch_metadata()
 
-        print(f'Metadata OK')
-        self._on_metadata_completion()
+    async def prepare(self):
+        """
+        Downloads the metadata if it is missing, creates / verifies the files of the torrent.
+        start calls it if it was not called before
+        """
+        if self._prepared:
+            return
+        await self.prepare_metadata()
+        await self._on_metadata_completion()
         print(f'Loaded: {len(self.file_handler.completed_pieces)} / {self.torrent_info.metadata.piece_count}')
+        self._prepared = True
+
+    async def start(self):
+        """
+        Begins trackers, wakes up whenever a peer is ready to perform requests, handles piece tasks.
+        Basically handles everything, once start is called the download begins
+        """
+        await self.prepare()
+
+        # trackers (and therefore peers) begin after verification, peers need the final bitfield
+        self._accepting_peers = True
+        if self.tracker_task:
+            # trackers were started to download the metadata, their peers were not used for the download
+            self.trackers.announce_now()
+        else:
+            self._begin_trackers()
+        # lookups that ran for the metadata fed the metadata fetcher, the download needs a new lookup
+        self._begin_dht()
+        self.resume_data_task = asyncio.create_task(self._resume_data_job(), name='Resume data')
+        self.choker_task = asyncio.create_task(self.choker.run(self._stop), name='Choker')
+        self.pex_task = asyncio.create_task(self._pex_job(), name='Peer Exchange')
+        self.connection_task = asyncio.create_task(self.connections.run(self._stop), name='Connections')
 
         while not self._stop.is_set():
             await self.peer_readiness_tasks.non_empty.wait()
@@ -161,8 +551,10 @@ class Torrent:
                 timeout=Timeouts.Progress
             )
 
+            # pieces that no peer has are not picked, so there may be no piece tasks yet
+            # ready peers that find nothing to request are simply delayed below
             self._update_active_pieces_and_piece_tasks()
-            await self.piece_tasks.non_empty.wait()
+            self._update_endgame()
 
             self.peer_readiness_tasks.update(pending)
             self.peer_readiness_tasks.difference_update(ready)
@@ -174,13 +566,38 @@ class Torrent:
                 if not peer.alive():
                     continue
                 count = 0
-                while peer.grab_and_perform_a_request(self.active_pieces, Timeouts.Request):
+                while peer.grab_and_perform_a_request(self.active_pieces.values(), Timeouts.Request, self.endgame):
                     count += 1
                 self.peer_readiness_tasks.add(
                     asyncio.create_task(
-                        peer.wait_till_ready(None if count else Punishments.ActiveRequest)
+                        peer.wait_till_ready(
+                            None if count or peer.is_download_limited() else Punishments.ActiveRequest
+                        )
                     )
                 )
 
-    def stop(self):
+    async def stop(self):
+        """
+        Stops the download loop, trackers and peers, saves fast-resume data once queued writes are done
+        and closes the files
+        """
         self._stop.set()
+        self._accepting_peers = False
+        tasks = self.peer_readiness_tasks | self.piece_tasks
+        for task in (self.choker_task, self.tracker_task, self.dht_task, self.pex_task, self.connection_task):
+            if task:
+                tasks.add(task)
+        await utils.cancel_tasks(tasks)
+        await self.trackers.stop()
+        if self._own_udp_tracker_client:
+            self.udp_tracker_client.close()
+        if self._own_http_tracker_client:
+            self.http_tracker_client.close()
+        await asyncio.gather(*(peer.close() for peer in self.peers), return_exceptions=True)
+        await utils.cancel_tasks(set(self.peer_tasks))
+        if self.resume_data_task:
+            await self.resume_data_task
+        if self._prepared:
+            # the files are not verified (or do not exist) before prepare is done, resume data would be wrong
+            await self.file_handler.save_resume_data()
+        await self.file_handler.close()
@@ -1,3 +1,7 @@
+import base64
+import random
+import urllib.parse
+
 import bencdec
 from torrent.constants import *
 from torrent.metadata import Metadata
@@ -6,19 +10,50 @@ from torrent.metadata import Metadata
 class TorrentInfo:
     """
     Class to parse torrent file and hold info in a convenient way
+
+    torrent_file is either the path of a torrent file or a magnet URI. A magnet only gives the info hash
+    (and maybe trackers / a name), the metadata is then downloaded from peers and set with set_metadata
     """
+    __MAGNET_SCHEME__ = 'magnet'
+    __BTIH_PREFIX__ = 'urn:btih:'
 
     def __init__(self, torrent_file: str, port: int, self_id: bytes, max_request_length: int = 2 ** 14,
                  max_active_pieces: int = 0):
-        torrent_decoded_data = self._decode_torrent_file(torrent_file)
+        self._magnet_info_hash: bytes = bytes()
+        if urllib.parse.urlparse(torrent_file).scheme == self.__MAGNET_SCHEME__:
+            self._magnet_info_hash, torrent_file, torrent_decoded_data = self._parse_magnet(torrent_file)
+        else:
+            torrent_decoded_data = self._decode_torrent_file(torrent_file)
         self.torrent_file: str = torrent_file
-        self.trackers: set[str] = self._parse_trackers(torrent_decoded_data)
+        self.trackers: list[list[str]] = self._parse_trackers(torrent_decoded_data)
         self.metadata: Metadata = Metadata(torrent_decoded_data.get(INFO, {}))
         self.self_port: int = port
         self.self_id: bytes = self._build_self_id(self_id)
         self.max_request_length = max_request_length
         self.max_active_pieces = max_active_pieces
 
+    @property
+    def info_hash(self) -> bytes:
+        return self.metadata.info_hash or self._magnet_info_hash
+
+    def has_metadata(self) -> bool:
+        return bool(self.metadata.info_hash)
+
+    def is_private(self) -> bool:
+        """
+        Peers of private torrents (BEP 27) come from their trackers only, unknown until the metadata is known
+        """
+        return self.metadata.decoded_info_data.get(PRIVATE) == 1
+
+    def set_metadata(self, decoded_info_data: dict):
+        """
+        Sets the metadata that was downloaded from peers, raises ValueError if it can not be used
+        """
+        metadata = Metadata(decoded_info_data)
+        if metadata.info_hash != self.info_hash:
+            raise ValueError(f'Metadata of {self.info_hash.hex()} is invalid or not supported')
+        self.metadata = metadata
+
     @staticmethod
     def _build_self_id(self_id: bytes, length: int = 20) -> bytes:
         """
@@ -38,15 +73,44 @@ class TorrentInfo:
         with open(torrent_file, mode='rb') as f:
             return bencdec.decode(f.read())[0]
 
+    @classmethod
+    def _parse_magnet(cls, uri: str) -> tuple[bytes, str, dict]:
+        """
+        Returns the info hash (hex or base32 encoded in xt), the name (dn or the hex info hash)
+        and the trackers (tr) in the form of decoded torrent data
+        """
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(uri).query)
+        info_hash = bytes()
+        for exact_topic in query.get('xt', []):
+            if not exact_topic.lower().startswith(cls.__BTIH_PREFIX__):
+                continue
+            encoded_hash = exact_topic[len(cls.__BTIH_PREFIX__):]
+            if len(encoded_hash) == 40:
+                info_hash = bytes.fromhex(encoded_hash)
+            elif len(encoded_hash) == 32:
+                info_hash = base64.b32decode(encoded_hash.upper())
+        if len(info_hash) != 20:
+            raise ValueError(f'Magnet without a valid info hash: {uri}')
+        name = query.get('dn', [info_hash.hex()])[0]
+        return info_hash, name, {ANNOUNCE_LIST: [[tracker.encode()] for tracker in query.get('tr', [])]}
+
     @staticmethod
-    def _parse_trackers(torrent_decoded_data: dict) -> set[str]:
+    def _parse_trackers(torrent_decoded_data: dict) -> list[list[str]]:
         """
-        Get tracker info from torrent file
+        Get tracker tiers from torrent file (BEP 12)
+        announce is ignored if announce-list exists, trackers of a tier are shuffled, duplicates are dropped
         """
-        trackers: set[str] = set()
-        if ANNOUNCE in torrent_decoded_data:
-            trackers |= {torrent_decoded_data[ANNOUNCE].decode()}
-        if ANNOUNCE_LIST in torrent_decoded_data:
-            trackers |= {tracker[0].decode() for tracker in torrent_decoded_data[ANNOUNCE_LIST]}
+        tiers: list[list[bytes]] = torrent_decoded_data.get(ANNOUNCE_LIST) or [[torrent_decoded_data.get(ANNOUNCE)]]
+        seen: set[str] = set()
+        trackers: list[list[str]] = []
+        for tier in tiers:
+            urls: list[str] = []
+            for url in filter(None, tier):
+                if url.decode() not in seen:
+                    seen.add(url.decode())
+                    urls.append(url.decode())
+            if urls:
+                random.shuffle(urls)
+                trackers.append(urls)
         return trackers
 
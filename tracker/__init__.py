@@ -1 +1,2 @@
 from .tracker import Tracker
+from .tracker_tiers import TrackerTiers
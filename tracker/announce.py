@@ -0,0 +1,146 @@
+import dataclasses
+import ipaddress
+from enum import Enum
+
+from peer.peer_info import PeerInfo
+from torrent.constants import *
+
+
+class Event(Enum):
+    """
+    Announce events, values are the ones of the udp protocol (BEP 15)
+    """
+    none = 0
+    completed = 1
+    started = 2
+    stopped = 3
+
+
+@dataclasses.dataclass
+class AnnounceRequest:
+    info_hash: bytes
+    peer_id: bytes
+    port: int
+    uploaded: int = 0
+    downloaded: int = 0
+    left: int = 0
+    event: Event = Event.none
+    # number of peers we want, trackers use their default when it is negative
+    numwant: int = -1
+    key: int = 0
+
+    def to_params(self) -> dict:
+        """
+        Query parameters of an http announce
+        """
+        params = {
+            'info_hash': self.info_hash,
+            'peer_id': self.peer_id,
+            'port': self.port,
+            'uploaded': self.uploaded,
+            'downloaded': self.downloaded,
+            'left': self.left,
+            'compact': 1,
+            'key': f'{self.key:08x}',
+        }
+        if self.event != Event.none:
+            params['event'] = self.event.name
+        if self.numwant >= 0:
+            params['numwant'] = self.numwant
+        return params
+
+
+@dataclasses.dataclass
+class AnnounceResponse:
+    peers: set[PeerInfo]
+    interval: float
+    min_interval: float = 0.0
+    # -1 if the tracker did not tell
+    seeders: int = -1
+    leechers: int = -1
+
+    @classmethod
+    def from_dict(cls, response: dict) -> 'AnnounceResponse':
+        """
+        Parses the decoded response of an http tracker, raises ValueError if the tracker reported a failure
+        or the response is malformed
+        """
+        check_failure(response)
+        raw_peers = response.get(PEERS, b'')
+        if isinstance(raw_peers, bytes):
+            peers = parse_compact_peers(raw_peers)
+        elif isinstance(raw_peers, list):
+            peers = {parse_peer_dict(p) for p in raw_peers}
+        else:
+            raise ValueError(f'Invalid peers: {raw_peers}')
+        return cls(
+            peers,
+            get_int(response, INTERVAL, 0),
+            get_int(response, MIN_INTERVAL, 0),
+            get_int(response, COMPLETE, -1),
+            get_int(response, INCOMPLETE, -1),
+        )
+
+
+@dataclasses.dataclass
+class ScrapeResponse:
+    seeders: int
+    completed: int
+    leechers: int
+
+    @classmethod
+    def from_dict(cls, response: dict, info_hash: bytes) -> 'ScrapeResponse':
+        """
+        Parses the decoded response of an http tracker, raises ValueError if info_hash is missing
+        """
+        check_failure(response)
+        files = response.get(FILES, {})
+        if not isinstance(files, dict):
+            raise ValueError(f'Invalid files: {files}')
+        if info_hash not in files:
+            raise ValueError(f'Scrape response without {info_hash.hex()}')
+        if not isinstance(stats := files[info_hash], dict):
+            raise ValueError(f'Invalid stats: {stats}')
+        return cls(get_int(stats, COMPLETE, 0), get_int(stats, DOWNLOADED, 0), get_int(stats, INCOMPLETE, 0))
+
+
+def check_failure(response: dict):
+    """
+    Raises ValueError with the failure reason of the tracker if there is one
+    """
+    if FAILURE_REASON in response:
+        reason = response[FAILURE_REASON]
+        raise ValueError(reason.decode(errors='ignore') if isinstance(reason, bytes) else f'Failure: {reason}')
+
+
+def get_int(response: dict, key: bytes, default: int) -> int:
+    """
+    The int value of key, raises ValueError if it is not an int
+    """
+    value = response.get(key, default)
+    if not isinstance(value, int):
+        raise ValueError(f'Invalid {key.decode()}: {value}')
+    return value
+
+
+def parse_peer_dict(peer: dict) -> PeerInfo:
+    """
+    A peer of a non compact response, raises ValueError if it is malformed
+    """
+    if not isinstance(peer, dict) or not isinstance(ip := peer.get(IP), bytes) \
+            or not isinstance(port := peer.get(PORT), int) or not 0 <= port < 2 ** 16:
+        raise ValueError(f'Invalid peer: {peer}')
+    peer_id = peer.get(PEER_ID, b'<Empty>')
+    return PeerInfo(ip.decode(errors='ignore'), port, peer_id if isinstance(peer_id, bytes) else b'<Empty>')
+
+
+def parse_compact_peers(raw_peers: bytes | memoryview) -> set[PeerInfo]:
+    """
+    Peers in compact form, 4 bytes of ip and 2 bytes of port each
+    """
+    peers: set[PeerInfo] = set()
+    for i in range(0, len(raw_peers) - len(raw_peers) % 6, 6):
+        peer_ip = ipaddress.IPv4Address(bytes(raw_peers[i: i + 4]))
+        peer_port = int.from_bytes(raw_peers[i + 4: i + 6], byteorder="big")
+        peers.add(PeerInfo(str(peer_ip), peer_port))
+    return peers
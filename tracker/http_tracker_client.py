@@ -0,0 +1,190 @@
+import asyncio
+import ssl
+import time
+import urllib.parse
+import zlib
+
+
+class HttpConnection:
+    """
+    An open HTTP/1.1 connection to a tracker host
+    """
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.idle_since: float = time.monotonic()
+
+    def close(self):
+        self.writer.close()
+
+
+class HttpTrackerClient:
+    """
+    Minimal asyncio HTTP/1.1 client for tracker announces / scrapes (GET only), shared by the torrents of a session
+
+    Connections are kept alive and pooled per (scheme, host, port), so announces of many torrents to the same
+    tracker reuse a connection (and its TLS session) instead of connecting every time. Idle connections are
+    dropped after __IDLE_TIMEOUT__ seconds, at most __MAX_IDLE_PER_HOST__ are kept per host.
+    A request on a pooled connection that the server closed meanwhile is sent again on a new connection.
+    Bodies may be chunked and / or gzip / deflate encoded, they are decoded while they are read
+    """
+    __IDLE_TIMEOUT__ = 30.0
+    __MAX_IDLE_PER_HOST__ = 2
+    __MAX_RESPONSE_SIZE__ = 2 ** 22
+    __MAX_HEADER_LINES__ = 100
+    __USER_AGENT__ = 'TorrentClient/0.1'
+
+    def __init__(self):
+        self._pool: dict[tuple[str, str, int], list[HttpConnection]] = {}
+        self._ssl_context: ssl.SSLContext | None = None
+
+    def close(self):
+        for connections in self._pool.values():
+            for connection in connections:
+                connection.close()
+        self._pool.clear()
+
+    async def _connect(self, scheme: str, host: str, port: int) -> HttpConnection:
+        secure = scheme == 'https'
+        if secure and self._ssl_context is None:
+            self._ssl_context = ssl.create_default_context()
+        reader, writer = await asyncio.open_connection(
+            host, port, ssl=self._ssl_context if secure else None, server_hostname=host if secure else None
+        )
+        return HttpConnection(reader, writer)
+
+    def _acquire(self, key: tuple[str, str, int]) -> HttpConnection | None:
+        """
+        An idle pooled connection of the host, connections that idled for too long are closed
+        """
+        connections = self._pool.get(key, [])
+        while connections:
+            connection = connections.pop()
+            if time.monotonic() - connection.idle_since < self.__IDLE_TIMEOUT__ and \
+                    not connection.writer.is_closing() and not connection.reader.at_eof():
+                return connection
+            connection.close()
+        return None
+
+    def _release(self, key: tuple[str, str, int], connection: HttpConnection):
+        connections = self._pool.setdefault(key, [])
+        if len(connections) >= self.__MAX_IDLE_PER_HOST__:
+            connection.close()
+            return
+        connection.idle_since = time.monotonic()
+        connections.append(connection)
+
+    async def get(self, url: str, params: dict) -> bytes:
+        """
+        Performs a GET request of url with params added to its query, returns the body of a 200 response.
+        Raises ValueError on other responses / malformed responses and OSError on connection errors
+        """
+        parsed_url = urllib.parse.urlparse(url)
+        scheme = parsed_url.scheme.casefold()
+        if scheme not in ('http', 'https'):
+            raise ValueError(f"Unknown scheme: {scheme}")
+        port = parsed_url.port or (443 if scheme == 'https' else 80)
+        key = (scheme, parsed_url.hostname, port)
+        query = urllib.parse.urlencode(params, quote_via=urllib.parse.quote)
+        if parsed_url.query:
+            query = f'{parsed_url.query}&{query}'
+        host = parsed_url.hostname if parsed_url.port is None else f'{parsed_url.hostname}:{port}'
+        request = (
+            f"GET {parsed_url.path or '/'}?{query} HTTP/1.1\r\n"
+            f"Host: {host}\r\n"
+            f"User-Agent: {self.__USER_AGENT__}\r\n"
+            f"Accept-Encoding: gzip, deflate\r\n"
+            f"Connection: keep-alive\r\n\r\n"
+        ).encode()
+
+        if connection := self._acquire(key):
+            try:
+                return await self._request(key, connection, request)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                # the server closed the idle connection, try again on a new one
+                pass
+            except asyncio.LimitOverrunError as e:
+                raise ValueError(f'Malformed response: {e}')
+        connection = await self._connect(scheme, parsed_url.hostname, port)
+        try:
+            return await self._request(key, connection, request)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError) as e:
+            raise ValueError(f'Malformed response: {e}')
+
+    async def _request(self, key: tuple[str, str, int], connection: HttpConnection, request: bytes) -> bytes:
+        """
+        The connection goes back to the pool if the response allows it, it is closed otherwise (or on any error)
+        """
+        reusable = False
+        try:
+            connection.writer.write(request)
+            await connection.writer.drain()
+            status, headers = await self._read_head(connection.reader)
+            body, reusable = await self._read_body(connection.reader, headers)
+        finally:
+            if reusable:
+                self._release(key, connection)
+            else:
+                connection.close()
+        if status != 200:
+            raise ValueError(f'HTTP status {status}')
+        return body
+
+    async def _read_head(self, reader: asyncio.StreamReader) -> tuple[int, dict[str, str]]:
+        status_line = (await reader.readuntil(b'\r\n')).decode('latin-1').split(maxsplit=2)
+        if len(status_line) < 2 or not status_line[0].startswith('HTTP/') or not status_line[1].isdigit():
+            raise ValueError(f'Invalid status line: {status_line}')
+        headers: dict[str, str] = {':version': status_line[0]}
+        for _ in range(self.__MAX_HEADER_LINES__):
+            line = (await reader.readuntil(b'\r\n')).decode('latin-1')
+            if line == '\r\n':
+                return int(status_line[1]), headers
+            name, _, value = line.partition(':')
+            headers[name.strip().casefold()] = value.strip()
+        raise ValueError('Too many header lines')
+
+    async def _read_body(self, reader: asyncio.StreamReader, headers: dict[str, str]) -> tuple[bytes, bool]:
+        """
+        Returns the decoded body and True if the connection can be used for another request
+        """
+        encoding = headers.get('content-encoding', 'identity').casefold()
+        if encoding in ('gzip', 'x-gzip'):
+            decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            decoder = zlib.decompressobj()
+        elif encoding == 'identity':
+            decoder = None
+        else:
+            raise ValueError(f'Unsupported content encoding: {encoding}')
+        body = bytearray()
+
+        def append(data: bytes, final: bool = False):
+            try:
+                if decoder:
+                    data = decoder.flush() if final else \
+                        decoder.decompress(data, self.__MAX_RESPONSE_SIZE__ + 1 - len(body))
+            except zlib.error as e:
+                raise ValueError(f'Invalid {encoding} body: {e}')
+            body.extend(data)
+            if len(body) > self.__MAX_RESPONSE_SIZE__:
+                raise ValueError('Response is too large')
+
+        reusable = headers[':version'] == 'HTTP/1.1' and headers.get('connection', '').casefold() != 'close'
+        if headers.get('transfer-encoding', '').casefold() == 'chunked':
+            while size := int((await reader.readuntil(b'\r\n')).split(b';')[0], 16):
+                append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            # trailers
+            while await reader.readuntil(b'\r\n') != b'\r\n':
+                pass
+        elif 'content-length' in headers:
+            length = int(headers['content-length'])
+            if length > self.__MAX_RESPONSE_SIZE__:
+                raise ValueError('Response is too large')
+            append(await reader.readexactly(length))
+        else:
+            while data := await reader.read(2 ** 16):
+                append(data)
+            reusable = False
+        append(b'', final=True)
+        return bytes(body), reusable
@@ -1,34 +1,36 @@
 import asyncio
 import os
-import ssl
-import time
 import urllib.parse
-from asyncio import Task, Event
 
-from file_handling.file_handler import FileHandler
+import bencdec
 from logger.logger import Logger
-from messages import Bitfield, Handshake
-from misc import utils
-from peer.peer_info import PeerInfo
-from peer.peer_base import PeerBase
-from peer.tcp_peer_stream import TcpPeerStream
 from torrent.torrent_info import TorrentInfo
-from tracker.tcp_tracker_protocol import TcpTrackerProtocol
-from tracker.udp_tracker_protocol import UdpTrackerProtocol
+from tracker.announce import AnnounceRequest, AnnounceResponse, ScrapeResponse
+from tracker.http_tracker_client import HttpTrackerClient
+from tracker.udp_tracker_client import UdpTrackerClient
 
 
 class Tracker:
     """
-    Class to handle tracker tcp and udp protocols
+    Class to handle tracker tcp and udp protocols: announces and scrapes of a single tracker url
+
+    responsive and seeders describe how good the tracker is, TrackerTiers uses them to order the trackers of a tier
     """
-    __MIN_INTERVAL__ = 60.0
+    __TIMEOUT__ = 15.0
 
-    def __init__(self, tracker: str, torrent_info: TorrentInfo):
-        self.last_run: float = 0.0
-        self.wake_up: Event = asyncio.Event()
+    def __init__(self, tracker: str, torrent_info: TorrentInfo, udp_client: UdpTrackerClient,
+                 http_client: HttpTrackerClient):
         self.tracker: str = tracker
         self.torrent_info: TorrentInfo = torrent_info
+        self.udp_client: UdpTrackerClient = udp_client
+        self.http_client: HttpTrackerClient = http_client
         self.parsed_url = urllib.parse.urlparse(self.tracker)
+        # True if the last announce succeeded
+        self.responsive: bool = False
+        # latest numbers of the tracker (announce or scrape), -1 if unknown
+        self.seeders: int = -1
+        self.leechers: int = -1
+        self.min_interval: float = 0.0
         self.tracker_logs_directory = (f'./tracker_logs/{os.path.basename(self.torrent_info.torrent_file)} - '
                                        f'{self.parsed_url.scheme}')
         os.makedirs(self.tracker_logs_directory, exist_ok=True)
@@ -36,104 +38,101 @@ class Tracker:
         self.logger = Logger().get(log_file, log_file)
         self.logger.info(f"Initialized tracker {self.tracker} - "
                          f"{torrent_info.torrent_file} - "
-                         f"{self.torrent_info.metadata.info_hash.hex()} - "
+                         f"{self.torrent_info.info_hash.hex()} - "
                          f"{self.torrent_info.metadata.torrent_size}")
 
-    async def _build_udp_transport_and_protocol(self):
-        return await asyncio.get_running_loop().create_datagram_endpoint(
-            lambda: UdpTrackerProtocol(
-                info_hash=self.torrent_info.metadata.info_hash,
-                self_port=self.torrent_info.self_port,
-                self_id=self.torrent_info.self_id,
-                tracker=self.tracker,
-                logger=self.logger,
-            ),
-            remote_addr=(self.parsed_url.hostname, self.parsed_url.port)
-        )
+    def __repr__(self):
+        return self.tracker
+
+    def scrape_url(self) -> str | None:
+        """
+        The scrape url of an http tracker is the announce url with 'announce' replaced by 'scrape' in the last
+        path component, None if the tracker does not support scrape
+        """
+        if self.parsed_url.scheme.casefold() == 'udp':
+            return self.tracker
+        head, _, last = self.parsed_url.path.rpartition('/')
+        if not last.startswith('announce'):
+            return None
+        return self.parsed_url._replace(path=f"{head}/scrape{last[len('announce'):]}").geturl()
 
-    async def _build_tcp_transport_and_protocol(self, secure: bool = False):
-        return await asyncio.get_event_loop().create_connection(
-            lambda: TcpTrackerProtocol(
-                info_hash=self.torrent_info.metadata.info_hash,
-                self_port=self.torrent_info.self_port,
-                self_id=self.torrent_info.self_id,
-                tracker=self.tracker,
-                logger=self.logger,
-            ),
-            host=self.parsed_url.hostname,
-            port=443 if secure else 80,
-            ssl=ssl.create_default_context() if secure else None,
-            server_hostname=self.parsed_url.hostname if secure else None
+    async def _udp_request(self, request: AnnounceRequest | None) -> AnnounceResponse | ScrapeResponse:
+        """
+        Requests go through the udp tracker client of the session
+        """
+        if request is None:
+            return await self.udp_client.scrape(
+                self.parsed_url.hostname, self.parsed_url.port, self.torrent_info.info_hash
+            )
+        # URLData option (BEP 41): path and query of the announce url
+        url_data = self.parsed_url.path + (f'?{self.parsed_url.query}' if self.parsed_url.query else '')
+        return await self.udp_client.announce(
+            self.parsed_url.hostname, self.parsed_url.port, request, url_data.encode() if url_data != '/' else b''
         )
 
-    async def _request_peers(self) -> tuple[set[PeerInfo], int]:
-        scheme = self.parsed_url.scheme.casefold()
-        self.logger.info(f"request_peers - {scheme}")
-        transport, protocol = None, None
+    async def _http_request(self, request: AnnounceRequest | None) -> AnnounceResponse | ScrapeResponse:
+        """
+        Requests go through the pooled http tracker client of the session
+        """
+        if request is None:
+            if (url := self.scrape_url()) is None:
+                raise ValueError('Scrape is not supported')
+            params = {'info_hash': self.torrent_info.info_hash}
+        else:
+            url, params = self.tracker, request.to_params()
+        body = await self.http_client.get(url, params)
         try:
-            async with asyncio.timeout(10):
-                match scheme:
-                    case 'http':
-                        transport, protocol = await self._build_tcp_transport_and_protocol()
-                    case 'https':
-                        transport, protocol = await self._build_tcp_transport_and_protocol(secure=True)
-                    case 'udp':
-                        transport, protocol = await self._build_udp_transport_and_protocol()
-                    case _:
-                        raise ValueError(f"Unknown scheme: {scheme}")
-                await protocol.finish()
-                transport.close()
-                peers, interval = protocol.result()
-        except (TimeoutError, ValueError, OSError):
-            if transport:
-                transport.close()
-            peers, interval = set(), 0
-        self.logger.info(f"result: ({len(peers)}, {interval})")
-        return peers, interval
+            result = bencdec.decode(body)[0]
+        except (ValueError, IndexError, TypeError, RecursionError) as e:
+            raise ValueError(f'Invalid response: {type(e).__name__} - {e}') from e
+        if not isinstance(result, dict):
+            raise ValueError(f'Invalid response: {result}')
+        if request is None:
+            return ScrapeResponse.from_dict(result, self.torrent_info.info_hash)
+        return AnnounceResponse.from_dict(result)
 
-    async def tracker_main_job(
-            self,
-            peer_set: set[PeerBase],
-            peer_tasks: set[Task],
-            peer_readiness_tasks: set[Task],
-            torrent_bitfield: Bitfield,
-            file_handler: FileHandler,
-    ):
+    async def _request(self, request: AnnounceRequest | None, timeout: float) -> AnnounceResponse | ScrapeResponse:
         """
-        Tracker jobs run in the background to periodically perform requests, get peer lists and create peer tasks
+        Announces if request is given, scrapes otherwise. Raises on errors / timeout
         """
-        while True:
-            peers, interval = set(), self.__MIN_INTERVAL__
-            if time.time() - self.last_run > self.__MIN_INTERVAL__:
-                peers, interval = await self._request_peers()
-                for p_i in peers:
-                    peer = TcpPeerStream(p_i, len(torrent_bitfield.data), file_handler)
-                    if peer in peer_set:
-                        continue
-                    peer_set.add(peer)
-                    reserved = bytearray(int(0).to_bytes(8))
-                    reserved[5] = 0x10
-                    peer_task = asyncio.create_task(
-                        peer.run_till_dead(
-                            handshake=Handshake(
-                                self.torrent_info.metadata.info_hash,
-                                self.torrent_info.self_id,
-                                reserved=reserved
-                            )
-                        ),
-                        name=f'Peer {p_i.ip}'
-                    )
-                    peer_tasks.add(peer_task)
-                    peer_task.add_done_callback(peer_tasks.discard)
+        scheme = self.parsed_url.scheme.casefold()
+        async with asyncio.timeout(timeout):
+            match scheme:
+                case 'udp':
+                    return await self._udp_request(request)
+                case 'http' | 'https':
+                    return await self._http_request(request)
+                case _:
+                    raise ValueError(f"Unknown scheme: {scheme}")
 
-                    peer_readiness_task = asyncio.create_task(
-                        peer.wait_till_ready()
-                    )
-                    peer_readiness_tasks.add(peer_readiness_task)
+    async def announce(self, request: AnnounceRequest, timeout: float = __TIMEOUT__) -> AnnounceResponse | None:
+        """
+        Returns None if the announce failed
+        """
+        self.logger.info(f"announce - {request.event.name} - left: {request.left} - numwant: {request.numwant}")
+        try:
+            response: AnnounceResponse = await self._request(request, timeout)
+        except (TimeoutError, ValueError, OSError) as e:
+            self.logger.info(f"announce failed: {type(e).__name__} - {e}")
+            self.responsive = False
+            return None
+        self.responsive = True
+        self.min_interval = response.min_interval
+        if response.seeders >= 0:
+            self.seeders, self.leechers = response.seeders, response.leechers
+        self.logger.info(f"result: ({len(response.peers)}, {response.interval}, "
+                         f"seeders: {response.seeders}, leechers: {response.leechers})")
+        return response
 
-                self.last_run = time.time()
-            if interval < self.__MIN_INTERVAL__:
-                interval = self.__MIN_INTERVAL__
-            await utils.run_with_timeout(self.wake_up.wait(), interval)
-            if self.wake_up.is_set():
-                self.wake_up.clear()
+    async def scrape(self, timeout: float = __TIMEOUT__) -> ScrapeResponse | None:
+        """
+        Returns None if the scrape failed or the tracker does not support it
+        """
+        try:
+            response: ScrapeResponse = await self._request(None, timeout)
+        except (TimeoutError, ValueError, OSError) as e:
+            self.logger.info(f"scrape failed: {type(e).__name__} - {e}")
+            return None
+        self.seeders, self.leechers = response.seeders, response.leechers
+        self.logger.info(f"scrape: {response}")
+        return response
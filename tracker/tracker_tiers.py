@@ -0,0 +1,146 @@
+import asyncio
+import time
+from asyncio import Task
+from typing import Callable
+
+from misc import utils
+from peer.peer_info import PeerInfo
+from torrent.torrent_info import TorrentInfo
+from tracker.announce import AnnounceRequest, AnnounceResponse, Event
+from tracker.http_tracker_client import HttpTrackerClient
+from tracker.tracker import Tracker
+from tracker.udp_tracker_client import UdpTrackerClient
+
+
+class TrackerTiers:
+    """
+    The trackers of a torrent grouped in tiers (BEP 12), announces go to one tracker at a time
+
+    Tiers are tried in order until a tracker responds. Within a tier the trackers race: they are started
+    __RACE_DELAY__ seconds apart until one responds, the first response wins and the other announces are cancelled.
+    The usual tracker responds before the next one is started, so racing costs no announces while it works.
+    Responsive trackers are promoted to the front of their tier, the rest of the tier is ordered by
+    the seeder count of periodic scrapes. Events (started, completed, stopped) are sent as the torrent progresses
+    """
+    __MIN_INTERVAL__ = 60.0
+    __RETRY_INTERVAL__ = 15.0
+    __MAX_RETRY_INTERVAL__ = 900.0
+    __RACE_DELAY__ = 2.0
+    __SCRAPE_INTERVAL__ = 1800.0
+    __STOPPED_TIMEOUT__ = 5.0
+
+    def __init__(self, torrent_info: TorrentInfo, announce_request: Callable[[Event], AnnounceRequest],
+                 udp_client: UdpTrackerClient, http_client: HttpTrackerClient):
+        """
+        announce_request returns the request of an announce with the current transfer numbers of the torrent
+        """
+        self.tiers: list[list[Tracker]] = [
+            [Tracker(tracker, torrent_info, udp_client, http_client) for tracker in tier] for tier in torrent_info.trackers
+        ]
+        self.announce_request = announce_request
+        self.current: Tracker | None = None
+        self._started: bool = False
+        self._event: Event = Event.started
+        self._pending_event: Event = Event.none  # an event that must wait until started went out
+        self._last_announce: float = 0.0
+        self._wake_up: asyncio.Event = asyncio.Event()
+
+    def __iter__(self):
+        return (tracker for tier in self.tiers for tracker in tier)
+
+    def announce_now(self, event: Event = Event.none):
+        """
+        The next announce happens now instead of after the interval (never before the min interval of the tracker)
+        An event that arrives before started was announced is sent right after it
+        """
+        if event != Event.none:
+            if self._started:
+                self._event = event
+            else:
+                self._pending_event = event
+        self._wake_up.set()
+
+    async def _announce_tier(self, tier: list[Tracker], request: AnnounceRequest) \
+            -> tuple[Tracker, AnnounceResponse] | None:
+        pending: set[Task] = set()
+        trackers: dict[Task, Tracker] = {}
+        remaining = iter(list(tier))
+        try:
+            while True:
+                if tracker := next(remaining, None):
+                    task = asyncio.create_task(tracker.announce(request), name=f'Announce {tracker}')
+                    trackers[task] = tracker
+                    pending.add(task)
+                if not pending:
+                    return None
+                done, pending = await asyncio.wait(
+                    pending, timeout=self.__RACE_DELAY__ if tracker else None, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if response := task.result():
+                        return trackers[task], response
+        finally:
+            await utils.cancel_tasks(pending)
+
+    async def announce(self, event: Event) -> AnnounceResponse | None:
+        request = self.announce_request(event)
+        for tier in self.tiers:
+            if not (result := await self._announce_tier(tier, request)):
+                continue
+            self.current, response = result
+            tier.remove(self.current)
+            tier.insert(0, self.current)
+            return response
+        self.current = None
+        return None
+
+    async def scrape(self):
+        """
+        Scrapes every tracker at the same time and orders the tiers: responsive trackers first, then by seeders
+        """
+        await asyncio.gather(*(tracker.scrape() for tracker in self))
+        for tier in self.tiers:
+            tier.sort(key=lambda tracker: (tracker is not self.current, not tracker.responsive, -tracker.seeders))
+
+    async def _scrape_job(self):
+        while True:
+            await self.scrape()
+            await asyncio.sleep(self.__SCRAPE_INTERVAL__)
+
+    async def run(self, add_peer: Callable[[PeerInfo], bool]):
+        """
+        Announces periodically and passes the peers to add_peer
+        """
+        scrape_task = asyncio.create_task(self._scrape_job(), name='Scrape')
+        retry_interval = self.__RETRY_INTERVAL__
+        try:
+            while True:
+                if self.current and self.current.min_interval:
+                    await asyncio.sleep(self._last_announce + self.current.min_interval - time.monotonic())
+                self._wake_up.clear()
+                event = self._event
+                response = await self.announce(event)
+                self._last_announce = time.monotonic()
+                if response:
+                    self._started = True
+                    if self._event == event:
+                        self._event = self._pending_event
+                    if self._pending_event != Event.none:
+                        self._pending_event = Event.none
+                        self._wake_up.set()
+                    retry_interval = self.__RETRY_INTERVAL__
+                    interval = max(response.interval, self.__MIN_INTERVAL__)
+                    for p_i in response.peers:
+                        add_peer(p_i)
+                else:
+                    interval, retry_interval = retry_interval, min(2 * retry_interval, self.__MAX_RETRY_INTERVAL__)
+                await utils.run_with_timeout(self._wake_up.wait(), interval)
+        finally:
+            scrape_task.cancel()
+
+    async def stop(self):
+        """
+        Tells the current tracker that we are leaving, the run task must be cancelled before
+        """
+        if self._started and self.current:
+            await self.current.announce(self.announce_request(Event.stopped), self.__STOPPED_TIMEOUT__)
@@ -0,0 +1,212 @@
+import asyncio
+import random
+import socket
+import struct
+import time
+from asyncio import DatagramTransport, Future
+
+from tracker.announce import AnnounceRequest, AnnounceResponse, ScrapeResponse, parse_compact_peers
+
+
+class UdpTrackerClient(asyncio.DatagramProtocol):
+    """
+    UDP tracker protocol (BEP 15) over a single socket shared by every torrent / tracker of a session
+
+    Responses are matched to requests by transaction id. Connection ids are cached per tracker address for
+    __CONNECTION_ID_TTL__ seconds, concurrent requests to a tracker share a single connect.
+    Lost packets are sent again after __RETRANSMIT_BASE__ * 2 ** n seconds (BEP 15 uses 15 seconds as base,
+    trackers usually answer within milliseconds and the tiers race dead trackers anyway).
+    Scrapes that are requested within __SCRAPE_DELAY__ seconds of each other are sent to a tracker together,
+    up to __MAX_SCRAPE_HASHES__ info hashes in a single packet.
+    The socket is opened on first use
+    """
+    __PROTOCOL_ID__ = 0x41727101980
+    __CONNECT__ = 0
+    __ANNOUNCE__ = 1
+    __SCRAPE__ = 2
+    __ERROR__ = 3
+    __CONNECTION_ID_TTL__ = 60.0
+    __RESOLVE_TTL__ = 300.0
+    __RETRANSMIT_BASE__ = 2.0
+    __MAX_RETRANSMITS__ = 3
+    __SCRAPE_DELAY__ = 1.0
+    __MAX_SCRAPE_HASHES__ = 74
+    __MIN_RESPONSE_LENGTH__ = {__CONNECT__: 8, __ANNOUNCE__: 12}
+
+    def __init__(self, host: str = '0.0.0.0', port: int = 0):
+        self.host = host
+        self.port = port
+        self.transport: DatagramTransport | None = None
+        self._open_lock: asyncio.Lock = asyncio.Lock()
+        self._transactions: dict[int, tuple[tuple, Future]] = {}
+        self._connection_ids: dict[tuple, tuple[int, float]] = {}
+        self._connecting: dict[tuple, asyncio.Task] = {}
+        self._addresses: dict[tuple[str, int], tuple[tuple, float]] = {}
+        self._scrapes: dict[tuple, dict[bytes, list[Future]]] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    async def _open(self):
+        async with self._open_lock:
+            if self.transport is None:
+                await asyncio.get_running_loop().create_datagram_endpoint(
+                    lambda: self, local_addr=(self.host, self.port)
+                )
+
+    def close(self):
+        for task in self._tasks:
+            task.cancel()
+        for _, future in self._transactions.values():
+            if not future.done():
+                future.cancel()
+        if self.transport:
+            self.transport.close()
+            self.transport = None
+
+    def _on_task_done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled():
+            # failures are passed to the waiting requests
+            task.exception()
+
+    def connection_made(self, transport: DatagramTransport):
+        self.transport = transport
+
+    def connection_lost(self, exc: Exception | None):
+        self.transport = None
+
+    def datagram_received(self, data: bytes, addr: tuple):
+        if len(data) < 8:
+            return
+        transaction_id, = struct.unpack_from('>I', data, 4)
+        transaction = self._transactions.get(transaction_id)
+        if transaction is None or transaction[0][:2] != addr[:2] or transaction[1].done():
+            return
+        transaction[1].set_result(data)
+
+    def error_received(self, exc: Exception):
+        # errors (icmp unreachable...) can not be matched to a transaction, the request is sent again / times out
+        pass
+
+    async def _resolve(self, host: str, port: int) -> tuple:
+        key = (host, port)
+        if (cached := self._addresses.get(key)) and cached[1] > time.monotonic():
+            return cached[0]
+        infos = await asyncio.get_running_loop().getaddrinfo(
+            host, port, family=socket.AF_INET, type=socket.SOCK_DGRAM
+        )
+        address = infos[0][4]
+        self._addresses[key] = (address, time.monotonic() + self.__RESOLVE_TTL__)
+        return address
+
+    def _new_transaction(self, addr: tuple) -> tuple[int, Future]:
+        while (transaction_id := random.getrandbits(32)) in self._transactions:
+            pass
+        future = asyncio.get_running_loop().create_future()
+        self._transactions[transaction_id] = (addr, future)
+        return transaction_id, future
+
+    async def _transact(self, addr: tuple, action: int, payload: bytes, connection_id: int | None = None) -> bytes:
+        """
+        Sends a request and waits for its response, sending it again on timeout.
+        The connection id is refreshed before every attempt (unless connection_id is given: connect requests).
+        Returns the response without its header, raises ValueError on tracker errors and TimeoutError
+        """
+        transaction_id, future = self._new_transaction(addr)
+        try:
+            for attempt in range(self.__MAX_RETRANSMITS__ + 1):
+                conn_id = connection_id if connection_id is not None else await self._connection_id(addr)
+                self.transport.sendto(struct.pack('>QII', conn_id, action, transaction_id) + payload, addr)
+                try:
+                    async with asyncio.timeout(self.__RETRANSMIT_BASE__ * 2 ** attempt):
+                        data = await asyncio.shield(future)
+                    break
+                except TimeoutError:
+                    continue
+            else:
+                raise TimeoutError()
+        finally:
+            self._transactions.pop(transaction_id, None)
+        response_action, = struct.unpack_from('>I', data)
+        if response_action == self.__ERROR__:
+            # the connection id may be the problem, the next request connects again
+            self._connection_ids.pop(addr, None)
+            raise ValueError(f'Tracker error: {data[8:].decode(errors="ignore")}')
+        if response_action != action:
+            raise ValueError(f'Expected action {action} but received {response_action}')
+        if len(data) < 8 + self.__MIN_RESPONSE_LENGTH__.get(action, 0):
+            raise ValueError(f'Response of action {action} is too short: {len(data)} bytes')
+        return data[8:]
+
+    async def _connection_id(self, addr: tuple) -> int:
+        """
+        The cached connection id of the tracker or a new one. The connect runs in its own task,
+        so that requests that give up waiting do not cancel it for the others
+        """
+        if (cached := self._connection_ids.get(addr)) and cached[1] > time.monotonic():
+            return cached[0]
+        if addr not in self._connecting:
+            task = asyncio.create_task(self._connect(addr))
+            self._connecting[addr] = task
+            self._tasks.add(task)
+            task.add_done_callback(self._on_task_done)
+        return await asyncio.shield(self._connecting[addr])
+
+    async def _connect(self, addr: tuple) -> int:
+        try:
+            data = await self._transact(addr, self.__CONNECT__, b'', self.__PROTOCOL_ID__)
+        finally:
+            del self._connecting[addr]
+        conn_id, = struct.unpack_from('>Q', data)
+        self._connection_ids[addr] = (conn_id, time.monotonic() + self.__CONNECTION_ID_TTL__)
+        return conn_id
+
+    async def announce(self, host: str, port: int, request: AnnounceRequest, url_data: bytes = b'') \
+            -> AnnounceResponse:
+        await self._open()
+        addr = await self._resolve(host, port)
+        payload = request.info_hash + request.peer_id + struct.pack(
+            '>QQQIIIiH', request.downloaded, request.left, request.uploaded, request.event.value, 0,
+            request.key, request.numwant, request.port
+        )
+        # URLData option (BEP 41): path and query of the announce url
+        if url_data:
+            payload += struct.pack('>BB', 2, len(url_data[:255])) + url_data[:255]
+        data = await self._transact(addr, self.__ANNOUNCE__, payload)
+        interval, leechers, seeders = struct.unpack_from('>III', data)
+        return AnnounceResponse(parse_compact_peers(memoryview(data)[12:]), interval, 0.0, seeders, leechers)
+
+    async def scrape(self, host: str, port: int, info_hash: bytes) -> ScrapeResponse:
+        """
+        Scrapes of the same tracker are batched, see __SCRAPE_DELAY__
+        """
+        await self._open()
+        addr = await self._resolve(host, port)
+        future = asyncio.get_running_loop().create_future()
+        if addr not in self._scrapes:
+            self._scrapes[addr] = {}
+            asyncio.get_running_loop().call_later(self.__SCRAPE_DELAY__, self._flush_scrapes, addr)
+        self._scrapes[addr].setdefault(info_hash, []).append(future)
+        return await future
+
+    def _flush_scrapes(self, addr: tuple):
+        scrapes = self._scrapes.pop(addr, {})
+        info_hashes = list(scrapes)
+        for i in range(0, len(info_hashes), self.__MAX_SCRAPE_HASHES__):
+            batch = {info_hash: scrapes[info_hash] for info_hash in info_hashes[i: i + self.__MAX_SCRAPE_HASHES__]}
+            task = asyncio.create_task(self._scrape_batch(addr, batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._on_task_done)
+
+    async def _scrape_batch(self, addr: tuple, batch: dict[bytes, list[Future]]):
+        try:
+            data = await self._transact(addr, self.__SCRAPE__, b''.join(batch))
+            for i, info_hash in enumerate(batch):
+                response = ScrapeResponse(*struct.unpack_from('>III', data, 12 * i))
+                for future in batch[info_hash]:
+                    if not future.done():
+                        future.set_result(response)
+        finally:
+            for futures in batch.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(ValueError('Scrape failed'))